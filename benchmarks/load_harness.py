@@ -0,0 +1,584 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+"""
+Drives the bot with synthetic traffic from many guilds and users, without a network connection. Run from the
+repository's root:
+
+    python -m benchmarks.load_harness [--guilds 500] [--duration 60] [--rate 50] [--mix play=40,queue=20,...]
+
+The bot runs with the options in config/options.ini, except for the history, the library, the saved playlists and the
+shared cache, which are disabled. Whatever else the bot writes goes to a temporary directory rather than data/. Its
+connection to Discord is replaced by a fake gateway: messages are handed straight to on_message, everything the bot
+sends is answered locally after a simulated delay, and voice clients play songs by sending silent frames. YouTube is
+replaced by fake videos, playlists and search results that take a simulated time to resolve.
+
+Every guild has a few users who send commands from the traffic mix and wait for the bot to reply before sending the
+next one. The harness reports the latency of every kind of command, how late the event loop runs its callbacks, and
+how the memory and the number of threads grow. Keep in mind that the bot has a single player, so the guilds share its
+queue.
+"""
+
+import argparse
+import asyncio
+import collections
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from urllib.parse import urlparse, parse_qs
+from bot import log
+from bot import search
+from bot import songfetcher
+from bot.metalbot import MetalBot
+from benchmarks.search_fixture import make_results
+
+FRAME_LENGTH = 0.02
+COMMAND_TIMEOUT = 30
+DEFAULT_MIX = "play=40,playlist=3,search=7,skip=10,queue=25,np=15"
+ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_"
+
+
+def make_id(rand, length=11):
+    return "".join(rand.choice(ALPHABET) for _ in range(length))
+
+
+# ---- fake YouTube ----
+class FakeStream:
+    def __init__(self, video_id, length, itag, extension, kbps):
+        self.extension = extension
+        self.rawbitrate = kbps * 1000
+        self.bitrate = "%sk" % kbps
+        # the fake voice client reads the length of the song from its stream's URL
+        self.url = "https://fake.invalid/videoplayback?id=%s&itag=%s&clen=%s&dur=%s&expire=%s" % \
+                   (video_id, itag, length * kbps * 125, length, int(time.time()) + 6 * 3600)
+
+
+class FakeVideo:
+    """
+    Looks like a :class:`pafy.Pafy` object. Resolving its audio stream takes a simulated time. Songs are short, so the
+    queue keeps moving.
+    """
+    def __init__(self, video_id, latency, song_length):
+        rand = random.Random(video_id)
+        self.videoid = video_id
+        self.title = "Fake artist %s - Fake song %s" % (rand.randint(1, 500), video_id)
+        self.length = rand.randint(max(song_length // 2, 1), song_length * 3 // 2 + 1)
+        self.thumb = "https://i.ytimg.com/vi/%s/default.jpg" % video_id
+        self.bigthumb = "https://i.ytimg.com/vi/%s/hqdefault.jpg" % video_id
+        self._latency = latency
+
+    @property
+    def audiostreams(self):
+        time.sleep(random.expovariate(1 / self._latency) if self._latency > 0 else 0)
+        return [FakeStream(self.videoid, self.length, itag, extension, kbps)
+                for itag, extension, kbps in ((249, "webm", 50), (250, "webm", 70), (140, "m4a", 128),
+                                              (251, "webm", 160))]
+
+    def getbestaudio(self):
+        return self.audiostreams[-1]
+
+
+def make_fake_pafy(latency, playlist_length, song_length):
+    """
+    Builds a module that replaces pafy with fake videos and playlists.
+    """
+    module = types.ModuleType("pafy")
+
+    def new(url):
+        time.sleep(random.expovariate(1 / latency) if latency > 0 else 0)
+        return FakeVideo(url[-11:], latency, song_length)
+
+    def get_playlist(url):
+        rand = random.Random(url)
+        time.sleep(latency)
+        videos = [FakeVideo(make_id(rand), latency, song_length) for _ in range(playlist_length)]
+        return {"items": [{"pafy": video, "playlist_meta": {"encrypted_id": video.videoid, "title": video.title,
+                                                            "length_seconds": video.length}}
+                          for video in videos]}
+
+    module.new = new
+    module.get_playlist = get_playlist
+    return module
+
+
+class FakeSearchBackend(search.SearchBackend):
+    """
+    Returns synthetic search results after a simulated time.
+    """
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    def search(self, term, limit=None):
+        time.sleep(random.expovariate(1 / self.latency) if self.latency > 0 else 0)
+        return make_results(term, limit or 20)
+
+
+# ---- fake Discord ----
+class FakeVoiceState:
+    self_deaf = False
+    deaf = False
+
+
+class FakeMember:
+    def __init__(self, member_id, name, server=None, voice_channel=None):
+        self.id = member_id
+        self.name = name
+        self.server = server
+        self.voice_channel = voice_channel
+        self.voice = FakeVoiceState()
+        self.roles = []
+        self.mention = "<@%s>" % member_id
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeChannel:
+    def __init__(self, channel_id, name, server):
+        self.id = channel_id
+        self.name = name
+        self.server = server
+        self.is_private = False
+        self.voice_members = []
+
+
+class FakeServer:
+    def __init__(self, server_id, name):
+        self.id = server_id
+        self.name = name
+        self.channels = []
+        self.members = {}
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+
+class FakeMessage:
+    def __init__(self, message_id, content, author=None, channel=None):
+        self.id = message_id
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.server = channel.server if channel is not None else None
+
+
+class FakeReaction:
+    def __init__(self, emoji, user):
+        self.reaction = types.SimpleNamespace(emoji=emoji)
+        self.user = user
+
+
+class FakeStreamPlayer(threading.Thread):
+    """
+    Looks like a :class:`discord.voice_client.StreamPlayer`: it reads frames and sends them every 20ms until its song
+    ends, then calls its finish handler.
+    """
+    def __init__(self, length, after):
+        super().__init__(daemon=True)
+        self.after = after
+        self.volume = 1.0
+        self.error = None
+        self.buff = types.SimpleNamespace(read=lambda size=-1: b"\0" * 3840)
+        self.player = lambda data: None
+        self._frames_left = max(int(length / FRAME_LENGTH), 1)
+        self._end = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    def run(self):
+        while not self._end.is_set() and self._frames_left > 0:
+            self._resumed.wait()
+            self.player(self.buff.read(3840))
+            self._frames_left -= 1
+            time.sleep(FRAME_LENGTH)
+        if self.after is not None:
+            self.after(self)
+
+    def stop(self):
+        self._end.set()
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def is_done(self):
+        return not self.is_alive() or self._end.is_set()
+
+
+class FakeVoiceClient:
+    def __init__(self, channel):
+        self.channel = channel
+        self.server = channel.server
+
+    def create_ffmpeg_player(self, filename, before_options="", after=None, **kwargs):
+        length = float(parse_qs(urlparse(filename).query).get("dur", ["10"])[0])
+        options = before_options.split()
+        if "-ss" in options:
+            length -= float(options[options.index("-ss") + 1])
+        return FakeStreamPlayer(length, after)
+
+    def is_connected(self):
+        return True
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    async def disconnect(self):
+        pass
+
+
+class LoadBot(MetalBot):
+    """
+    A bot whose connection to Discord is a fake gateway. Every request to Discord takes a simulated time and
+    succeeds, and replies are reported to the harness.
+    """
+    def __init__(self, config, servers, rest_latency, reply_listener):
+        self.fake_servers = servers
+        self.fake_channels = dict((channel.id, channel) for server in servers for channel in server.channels)
+        self.fake_voices = {}
+        self.fake_user = FakeMember("1", "MetalBot")
+        self.rest_latency = rest_latency
+        self.reply_listener = reply_listener
+        self.sent_count = 0
+        self.played_count = 0
+        self._message_ids = iter(range(10 ** 6, 10 ** 12))
+        super().__init__(config)
+
+    def warm_up(self):
+        pass  # there is nothing to load
+
+    def song_changed_handler(self, song):
+        if song is not None:
+            self.played_count += 1
+        super().song_changed_handler(song)
+
+    @property
+    def user(self):
+        return self.fake_user
+
+    @property
+    def servers(self):
+        return list(self.fake_servers)
+
+    @property
+    def voice_clients(self):
+        return list(self.fake_voices.values())
+
+    def get_channel(self, channel_id):
+        return self.fake_channels.get(channel_id)
+
+    def voice_client_in(self, server):
+        return self.fake_voices.get(server.id)
+
+    def is_voice_connected(self, server):
+        return server.id in self.fake_voices
+
+    async def _request(self):
+        await asyncio.sleep(random.expovariate(1 / self.rest_latency) if self.rest_latency > 0 else 0)
+
+    async def join_voice_channel(self, channel):
+        voice = self.fake_voices.get(channel.server.id)
+        if voice is None:
+            await self._request()
+            voice = self.fake_voices[channel.server.id] = FakeVoiceClient(channel)
+        self.player.voice_client = voice
+        self.player.set_stream_preferences(self.get_stream_bitrate(channel),
+                                           self.config.getboolean("Playback", "PreferOpus"))
+        self.player.ensure_playing()
+        self.check_idle(channel.server)
+        return voice
+
+    async def send_message(self, destination, content=None, *, tts=False, embed=None):
+        await self._request()
+        self.sent_count += 1
+        self.reply_listener(destination, content)
+        return FakeMessage(str(next(self._message_ids)), content or "", self.fake_user, destination)
+
+    async def send_typing(self, destination):
+        await self._request()
+
+    async def add_reaction(self, message, emoji):
+        await self._request()
+
+    async def delete_message(self, message):
+        await self._request()
+
+    async def change_presence(self, *, game=None, status=None, afk=False):
+        await self._request()
+
+    async def wait_for_reaction(self, emoji=None, *, user=None, timeout=None, message=None, check=None):
+        await asyncio.sleep(random.uniform(0.5, 3))  # the user reads the results and chooses one
+        return FakeReaction(random.choice(emoji), user)
+
+    async def wait_for_message(self, timeout=None, *, author=None, channel=None, content=None, check=None):
+        await asyncio.sleep(timeout)
+        return None
+
+    async def logout(self):
+        pass
+
+
+# ---- traffic ----
+def parse_mix(text):
+    """
+    Parses a traffic mix like "play=40,queue=20" into a list of (command, weight) tuples.
+    """
+    mix = []
+    for part in text.split(","):
+        name, weight = part.split("=")
+        if name.strip() not in COMMANDS:
+            raise ValueError("Unknown command '%s', expected one of: %s" % (name, ", ".join(sorted(COMMANDS))))
+        mix.append((name.strip(), float(weight)))
+    return mix
+
+
+def play_command(rand, popular_ids):
+    # a few videos are requested much more than the rest, like in real servers
+    return "play https://www.youtube.com/watch?v=" + popular_ids[int(rand.paretovariate(1.2)) % len(popular_ids)]
+
+
+COMMANDS = {
+    "play": play_command,
+    "playlist": lambda rand, popular_ids: "play https://www.youtube.com/playlist?list=PL" + make_id(rand, 16),
+    "search": lambda rand, popular_ids: "search fake song %s" % rand.randint(1, 1000),
+    "skip": lambda rand, popular_ids: "skip",
+    "queue": lambda rand, popular_ids: "queue",
+    "np": lambda rand, popular_ids: "np"
+}
+
+
+class Harness:
+    """
+    Builds the simulated guilds, runs their users and collects the measurements.
+    """
+    def __init__(self, args, config):
+        self.args = args
+        self.mix = parse_mix(args.mix)
+        self.rand = random.Random(args.seed)
+        self.popular_ids = [make_id(self.rand) for _ in range(args.videos)]
+        self.prefix = config.get("Preferences", "CommandPrefix")
+        self.servers = []
+        self.users = []
+        for index in range(args.guilds):
+            server = FakeServer(str(10 ** 17 + index), "Guild %s" % index)
+            text_channel = FakeChannel(str(2 * 10 ** 17 + index), "general", server)
+            voice_channel = FakeChannel(str(3 * 10 ** 17 + index), "Music", server)
+            voice_channel.bitrate = 64000
+            server.channels.extend((text_channel, voice_channel))
+            for user_index in range(args.users):
+                member = FakeMember(str(4 * 10 ** 17 + index * args.users + user_index), "User %s" % user_index,
+                                    server, voice_channel)
+                server.members[member.id] = member
+                voice_channel.voice_members.append(member)
+                self.users.append((member, text_channel))
+            self.servers.append(server)
+
+        self.pending = {}  # text channel id -> the event of the command that waits for a reply in it
+        self.latencies = collections.defaultdict(list)
+        self.timeouts = collections.Counter()
+        self.errors = collections.Counter()
+        self.loop_lags = []
+        self.samples = []  # (seconds since start, RSS in MB, threads)
+        self.bot = LoadBot(config, self.servers, args.rest_latency, self.reply_received)
+        self._message_ids = iter(range(10 ** 12, 10 ** 13))
+
+    def reply_received(self, channel, content):
+        if content is not None and content.endswith("is now playing!"):
+            return  # not a reply to a command
+        event = self.pending.pop(channel.id, None)
+        if event is not None:
+            event.set()
+
+    async def run_user(self, member, text_channel, deadline):
+        # users of a guild take turns, so there is at most one command waiting for a reply in every channel
+        rand = random.Random(member.id)
+        mean_think_time = self.args.guilds * self.args.users / self.args.rate
+        await asyncio.sleep(rand.uniform(0, mean_think_time))
+        names = [name for name, weight in self.mix]
+        weights = [weight for name, weight in self.mix]
+        while time.monotonic() < deadline:
+            await asyncio.sleep(rand.expovariate(1 / mean_think_time))
+            if text_channel.id in self.pending:
+                continue
+            name = self._weighted_choice(rand, names, weights)
+            content = self.prefix + COMMANDS[name](rand, self.popular_ids)
+            msg = FakeMessage(str(next(self._message_ids)), content, member, text_channel)
+
+            event = asyncio.Event()
+            self.pending[text_channel.id] = event
+            start = time.perf_counter()
+            try:
+                await self.bot.on_message(msg)
+                await asyncio.wait_for(event.wait(), COMMAND_TIMEOUT)
+                self.latencies[name].append(time.perf_counter() - start)
+            except asyncio.TimeoutError:
+                self.timeouts[name] += 1
+            except Exception as e:
+                self.errors["%s: %s" % (name, type(e).__name__)] += 1
+            finally:
+                if self.pending.get(text_channel.id) is event:
+                    del self.pending[text_channel.id]
+
+    @staticmethod
+    def _weighted_choice(rand, names, weights):
+        point = rand.uniform(0, sum(weights))
+        for name, weight in zip(names, weights):
+            point -= weight
+            if point <= 0:
+                return name
+        return names[-1]
+
+    async def measure_loop_lag(self, deadline, interval=0.1):
+        loop = asyncio.get_event_loop()
+        while time.monotonic() < deadline:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lags.append(loop.time() - start - interval)
+
+    async def sample_resources(self, deadline, start, interval=1.0):
+        while time.monotonic() < deadline:
+            self.samples.append((time.monotonic() - start, rss_mb(), threading.active_count()))
+            await asyncio.sleep(interval)
+
+    async def run(self):
+        for server in self.servers:
+            await self.bot.join_voice_channel(server.channels[1])
+        start = time.monotonic()
+        deadline = start + self.args.duration
+        tasks = [self.measure_loop_lag(deadline), self.sample_resources(deadline, start)]
+        tasks.extend(self.run_user(member, text_channel, deadline) for member, text_channel in self.users)
+        await asyncio.gather(*tasks)
+        self.samples.append((time.monotonic() - start, rss_mb(), threading.active_count()))
+
+    def report(self):
+        print("%s guilds, %s users, %.0f commands/s offered for %ss" %
+              (self.args.guilds, len(self.users), self.args.rate, self.args.duration))
+        print("\nCommand latency (until the bot replies):")
+        for name, weight in self.mix:
+            times = self.latencies.get(name, [])
+            if len(times) == 0:
+                print("  %-9s no replies, %s timed out" % (name, self.timeouts[name]))
+                continue
+            print("  %-9s %6s done, p50 %7.1fms, p90 %7.1fms, p99 %7.1fms, max %7.1fms, %s timed out" %
+                  (name, len(times), percentile(times, 50) * 1000, percentile(times, 90) * 1000,
+                   percentile(times, 99) * 1000, max(times) * 1000, self.timeouts[name]))
+        for error, count in sorted(self.errors.items()):
+            print("  error %s: %s" % (error, count))
+
+        if len(self.loop_lags) > 0:
+            print("\nEvent loop lag: p50 %.1fms, p99 %.1fms, max %.1fms (%s samples)" %
+                  (percentile(self.loop_lags, 50) * 1000, percentile(self.loop_lags, 99) * 1000,
+                   max(self.loop_lags) * 1000, len(self.loop_lags)))
+        if len(self.samples) > 0:
+            first, last = self.samples[0], self.samples[-1]
+            print("Memory (RSS): %.1f MB at start, %.1f MB at the end, %.1f MB peak" %
+                  (first[1], last[1], max(sample[1] for sample in self.samples)))
+            print("Threads: %s at start, %s at the end, %s peak" %
+                  (first[2], last[2], max(sample[2] for sample in self.samples)))
+        if self.bot.loop_monitor is not None:
+            print("Event loop monitor: %s" % str(self.bot.loop_monitor).replace("\n", ", "))
+        streams = songfetcher.stream_stats
+        if streams["selected"] > 0:
+            print("Streams: %s picked (%s Opus), %s kbps on average instead of %s kbps, about %.1f MB downloaded" %
+                  (streams["selected"], streams["opus"], streams["selected_bitrate"] // streams["selected"],
+                   streams["best_bitrate"] // streams["selected"], self.bot.player.stream_stats["bytes"] / 1024 / 1024))
+        print("Coalesced: resolves %s, searches %s" % (songfetcher.resolves, search.searches))
+        print("Messages sent: %s, songs played: %s, songs left in the queue: %s" %
+              (self.bot.sent_count, self.bot.played_count, self.bot.player.queue.qsize()))
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+def rss_mb():
+    """
+    Returns the resident memory of the process in MB, or 0 if it can't be read.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            import resource
+            return int(statm.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+    except (OSError, ImportError):
+        return 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drives the bot with synthetic traffic, without a network.")
+    parser.add_argument("--guilds", type=int, default=500)
+    parser.add_argument("--users", type=int, default=3, help="users per guild")
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument("--rate", type=float, default=50, help="commands per second, over all of the guilds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weights of the commands, default: " + DEFAULT_MIX)
+    parser.add_argument("--videos", type=int, default=2000, help="number of different videos that are played")
+    parser.add_argument("--playlist-length", type=int, default=25)
+    parser.add_argument("--resolve-latency", type=float, default=0.3,
+                        help="average seconds to resolve a video, a stream or a playlist")
+    parser.add_argument("--search-latency", type=float, default=0.4, help="average seconds to search")
+    parser.add_argument("--rest-latency", type=float, default=0.05,
+                        help="average seconds of a request to Discord")
+    parser.add_argument("--song-length", type=int, default=10, help="average seconds a song plays")
+    parser.add_argument("--no-limits", action="store_true", help="don't limit how many songs users can add")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args()
+
+    import configparser
+    config = configparser.ConfigParser()
+    config.read("config/options.ini")
+    data_dir = tempfile.mkdtemp(prefix="metalbot-load-")  # keeps the real data/ directory untouched
+    config.set("History", "HistoryPath", "")
+    config.set("History", "AudioCachePath", os.path.join(data_dir, "audio"))
+    config.set("Library", "Directories", "")
+    config.set("Library", "IndexPath", os.path.join(data_dir, "library.idx"))
+    config.set("Playlists", "Path", "")
+    config.set("Sharding", "SharedCachePath", "")
+    config.set("Preferences", "ResolverBackends", "pafy")  # the fake YouTube replaces pafy.new only
+    config.set("Playback", "AudioWorker", "no")
+    if args.no_limits:
+        for scope in ("User", "Guild", "Global"):
+            config.set("Limits", scope + "Rate", "0")
+
+    log.setup(level=args.log_level)
+    sys.modules["pafy"] = make_fake_pafy(args.resolve_latency, args.playlist_length, args.song_length)
+
+    try:
+        harness = Harness(args, config)
+        search.set_backend(FakeSearchBackend(args.search_latency))  # the bot sets the configured backend
+        harness.bot.loop.run_until_complete(harness.run())
+        harness.report()
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+"""
+Benchmarks the search backends against the local fixture server. Run from the repository's root:
+
+    python -m benchmarks.search_benchmark [queries]
+"""
+
+import sys
+import time
+from bot import search
+from benchmarks.search_fixture import FixtureServer, make_page, make_results
+
+
+def bench_parse(queries):
+    """
+    Measures parsing alone, without HTTP, by feeding fixture pages to the parsers directly.
+    """
+    pages = [make_page("query %s" % i) for i in range(queries)]
+
+    start = time.perf_counter()
+    for page in pages:
+        chunks = (page[i:i + 16384] for i in range(0, len(page), 16384))
+        search.InitialDataBackend.parse_initial_data(search.InitialDataBackend.extract_initial_data(chunks))
+    print("initialdata parse: %.2f ms/page" % ((time.perf_counter() - start) * 1000 / queries))
+
+    try:
+        from lxml import html
+    except ImportError:
+        print("html parse: skipped, lxml is not installed")
+        return
+    start = time.perf_counter()
+    for page in pages:
+        html.fromstring(page).xpath("//a[contains(@class, 'yt-uix-tile-link')]")
+    print("html parse: %.2f ms/page" % ((time.perf_counter() - start) * 1000 / queries))
+
+
+def bench_backend(name, base_url, queries):
+    """
+    Measures full searches against the fixture server and checks that the results are correct.
+    """
+    backend = search.create_backend(name, base_url=base_url)
+    start = time.perf_counter()
+    try:
+        for i in range(queries):
+            term = "query %s" % i
+            results = backend.search(term)
+            expected = make_results(term)
+            if name == "html":  # the old markup has no lengths
+                expected = [search.SearchResult(r.video_id, r.title) for r in expected]
+            if results != expected:
+                print("%s: wrong results for '%s'" % (name, term))
+                return
+    except ImportError as e:
+        print("%s: skipped, %s" % (name, e))
+        return
+    print("%s search: %.2f ms/query" % (name, (time.perf_counter() - start) * 1000 / queries))
+
+
+def main():
+    queries = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    bench_parse(queries)
+    with FixtureServer() as server:
+        for name in sorted(search.BACKENDS):
+            bench_backend(name, server.base_url, queries)
+
+
+if __name__ == "__main__":
+    main()
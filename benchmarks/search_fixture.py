@@ -0,0 +1,152 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+"""
+A local HTTP server that serves synthetic YouTube results pages, so search backends can be tested and benchmarked
+without a network connection.
+"""
+
+import json
+import random
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+from bot import search
+from bot import utils
+
+
+def make_results(term, count=20):
+    """
+    Returns the results a fixture page shows for a search term. The results are random, but the same for the same term.
+
+    :param term: The search term
+    :type term: str
+    :param count: Number of results
+    :type count: int
+    :return: A list of :class:`search.SearchResult` objects
+    :rtype: list
+    """
+    rand = random.Random(term)
+    alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_"
+    results = []
+    for i in range(count):
+        video_id = "".join(rand.choice(alphabet) for _ in range(11))
+        results.append(search.SearchResult(video_id, "%s - result %s" % (term, i + 1), rand.randint(30, 4000)))
+    return results
+
+
+def _video_renderer(result):
+    return {"videoRenderer": {
+        "videoId": result.video_id,
+        "thumbnail": {"thumbnails": [{"url": "https://i.ytimg.com/vi/%s/hqdefault.jpg" % result.video_id}]},
+        "title": {"runs": [{"text": result.title}]},
+        "lengthText": {"simpleText": utils.seconds_to_timestamp(result.length)},
+        "viewCountText": {"simpleText": "1,234 views"},
+        "navigationEndpoint": {"watchEndpoint": {"videoId": result.video_id}}
+    }}
+
+
+def make_page(term, count=20, padding=400000):
+    """
+    Builds a results page that resembles YouTube's. The results are both embedded as initial data and listed in the
+    old markup, with script and style padding around them like a real page has.
+
+    :param term: The search term
+    :type term: str
+    :param count: Number of results
+    :type count: int
+    :param padding: Approximate number of bytes of padding before and after the results
+    :type padding: int
+    :return: The page's HTML
+    :rtype: bytes
+    """
+    results = make_results(term, count)
+    contents = [{"channelRenderer": {"channelId": "UC" + "x" * 22, "title": {"simpleText": term}}}]
+    contents.extend(_video_renderer(result) for result in results)
+    initial_data = {
+        "responseContext": {"serviceTrackingParams": [{"service": "GFEEDBACK", "params": []}]},
+        "contents": {"twoColumnSearchResultsRenderer": {"primaryContents": {"sectionListRenderer": {
+            "contents": [{"itemSectionRenderer": {"contents": contents}}]
+        }}}}
+    }
+
+    filler = "var f%s = function(a){return a*%s;};\n"
+    head_script = "".join(filler % (i, i) for i in range(padding // 2 // 35))
+    tail_script = "".join(filler % (i, i) for i in range(padding // 2 // 35))
+    legacy = "".join('<div class="yt-lockup"><a class="yt-uix-tile-link" href="/watch?v=%s" title="%s">%s</a></div>\n' %
+                     (r.video_id, r.title, r.title) for r in results)
+
+    page = ('<!DOCTYPE html><html><head><title>%s - YouTube</title><script>%s</script></head><body>'
+            '<div id="results">%s</div>'
+            '<script nonce="fixture">var ytInitialData = %s;</script>'
+            '<script>%s</script></body></html>') % (term, head_script, legacy, json.dumps(initial_data), tail_script)
+    return page.encode("utf-8")
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/results":
+            self.send_error(404)
+            return
+
+        term = parse_qs(url.query).get("search_query", [""])[0]
+        page = make_page(term, self.server.result_count, self.server.padding)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer(ThreadingMixIn, HTTPServer):
+    """
+    Serves fixture results pages at /results on a local port. Use as a context manager to run it in the background.
+    """
+    daemon_threads = True
+
+    def __init__(self, port=0, result_count=20, padding=400000):
+        """
+        :param port: The port to listen on, 0 for any free port
+        :type port: int
+        :param result_count: Number of results in every page
+        :type result_count: int
+        :param padding: Approximate number of bytes of padding in every page
+        :type padding: int
+        """
+        super().__init__(("127.0.0.1", port), _FixtureHandler)
+        self.result_count = result_count
+        self.padding = padding
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:%s" % self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,119 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+"""
+Benchmarks the memory queued songs take. Run from the repository's root:
+
+    python -m benchmarks.song_memory_benchmark [songs]
+
+The songs are spread over a number of servers, users and popular videos, and their strings are built separately for
+every song like they are when songs are resolved. They are compared with songs that are plain objects with a __dict__,
+which is how songs used to be kept.
+"""
+
+import random
+import sys
+import tracemalloc
+from bot.player import Player
+from bot.song import Song
+
+
+class DictSong:
+    """
+    A song as it used to be kept: a plain object that holds its stream URL, requester and text channel.
+    """
+    def __init__(self, stream_url, title, requester=None, length=0, text_channel=None, image=None, song_url=""):
+        self.stream_url = stream_url
+        self.title = title
+        self.requester = requester
+        self.length = length
+        self.text_channel = text_channel
+        self.image = image
+        self.song_url = song_url
+        self.other_requesters = []
+        self._last_resume = None
+        self._seconds_played = 0.0
+
+
+class FakeDiscordObject:
+    def __init__(self, object_id):
+        self.id = object_id
+
+
+def make_details(count, rng, users, channels):
+    """
+    Generates the details of queued songs. Every detail is a new string, like it is when a song is resolved.
+    """
+    video_ids = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789_-") for _ in range(11))
+                 for _ in range(count // 10 + 1)]
+    details = []
+    for _ in range(count):
+        video_id = rng.choice(video_ids)
+        details.append({
+            "stream_url": "https://r%s---sn-example.googlevideo.com/videoplayback?expire=%s&id=%s&%s" %
+                          (rng.randrange(10), rng.randrange(10 ** 10), video_id, "x" * rng.randrange(600, 900)),
+            "title": "".join(["Artist - Title of video ", video_id]),
+            "requester": rng.choice(users),
+            "length": rng.randrange(60, 600),
+            "text_channel": rng.choice(channels),
+            "image": "".join(["https://i.ytimg.com/vi/", video_id, "/hqdefault.jpg"]),
+            "song_url": "".join(["https://www.youtube.com/watch?v=", video_id])
+        })
+    return details
+
+
+def measure(name, count, make_songs):
+    """
+    Measures the memory that is left allocated after songs are made from generated details and the details are
+    dropped. The users and channels exist anyway, so they're not measured.
+    """
+    rng = random.Random(1)  # the same songs for every measurement
+    users = [FakeDiscordObject(str(rng.randrange(10 ** 17, 10 ** 18))) for _ in range(2000)]
+    channels = [FakeDiscordObject(str(rng.randrange(10 ** 17, 10 ** 18))) for _ in range(200)]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    details = make_details(count, rng, users, channels)
+    songs = make_songs(details)
+    del details
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print("%s: %.1f MB, %s bytes/song" % (name, used / 1024 / 1024, used // count))
+    return songs
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    measure("dict songs", count, lambda details: [DictSong(**song) for song in details])
+    measure("compact songs, with stream URLs", count, lambda details: [Song(**song) for song in details])
+
+    def queue_songs(details):
+        player = Player()
+        for song in details:
+            player.queue.put(Song(**song))  # put() rather than add_to_queue(), which would log every song
+            if player.queue.qsize() > player.lookahead:
+                player.queue.queue[-1].stream_url = None
+        return player
+    measure("compact songs, queued with a lookahead of %s" % Player().lookahead, count, queue_songs)
+
+
+if __name__ == "__main__":
+    main()
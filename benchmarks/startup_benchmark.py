@@ -0,0 +1,100 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+"""
+Benchmarks how fast the bot starts. Run from the repository's root:
+
+    python -m benchmarks.startup_benchmark [runs] [YouTube URL]
+
+Every run is a fresh process. The time to import the bot is always measured. If a token is set in the config, the bot
+also logs in and the time until on_ready is measured. If a URL is given as well and the owner is in a voice channel,
+the bot joins them, plays the URL and the time until the first audio frame is sent is measured.
+"""
+
+import time
+START = time.perf_counter()  # measured before anything else is imported
+
+import asyncio
+import configparser
+import json
+import statistics
+import subprocess
+import sys
+
+
+def run_child(url):
+    """
+    A single measured start of the bot. Prints the times of the milestones as JSON, on a line that starts with
+    "STARTUP".
+    """
+    from bot.metalbot import MetalBot
+    from bot import songfetcher
+    times = {"import": time.perf_counter() - START}
+
+    class BenchmarkBot(MetalBot):
+        async def on_ready(self):
+            times["on_ready"] = time.perf_counter() - START
+            await super().on_ready()
+            if url is not None and self.player.can_play():
+                song = await self.loop.run_in_executor(None, songfetcher.get_youtube_song, url)
+                self.player.add_to_queue(song)
+                while self.player.song_frame_stats.frames == 0:
+                    await asyncio.sleep(0.005)
+                times["first_audio"] = time.perf_counter() - START
+            print("STARTUP " + json.dumps(times))
+            for voice in list(self.voice_clients):
+                await voice.disconnect()
+            await self.logout()
+
+        def song_changed_handler(self, song):
+            pass
+
+    config = configparser.ConfigParser()
+    config.read("config/options.ini")
+    if len(config.get("Login", "Token")) == 0:
+        print("STARTUP " + json.dumps(times))
+        return
+    BenchmarkBot(config).run(config.get("Login", "Token"))
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    args = [sys.executable, "-m", "benchmarks.startup_benchmark", "--child"] + sys.argv[2:3]
+
+    results = {}
+    for _ in range(runs):
+        output = subprocess.check_output(args, universal_newlines=True)
+        for line in output.splitlines():
+            if line.startswith("STARTUP "):
+                for name, seconds in json.loads(line[len("STARTUP "):]).items():
+                    results.setdefault(name, []).append(seconds)
+
+    for name in ("import", "on_ready", "first_audio"):
+        if name in results:
+            times = results[name]
+            print("%s: median %.3fs, min %.3fs, max %.3fs (%s runs)" %
+                  (name, statistics.median(times), min(times), max(times), len(times)))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        run_child(sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        main()
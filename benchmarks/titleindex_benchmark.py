@@ -0,0 +1,111 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+"""
+Benchmarks the title index with generated titles. Run from the repository's root:
+
+    python -m benchmarks.titleindex_benchmark [titles] [queries]
+"""
+
+import random
+import statistics
+import sys
+import time
+from bot.titleindex import TitleIndex
+
+CONSONANTS = "bcdfghjklmnprstvwyz"
+VOWELS = "aeiou"
+SUFFIXES = ("", "", "", " (Official Video)", " (Live)", " [Remastered]", " (Official Audio)", " - Lyrics")
+
+
+def make_words(count, rng):
+    return ["".join(rng.choice(CONSONANTS) + rng.choice(VOWELS) + rng.choice(("", "", "n", "r", "s"))
+                    for _ in range(rng.randint(1, 3))) for _ in range(count)]
+
+
+def make_titles(count, words, rng):
+    """
+    Generates titles like "Artist - Song Name (Official Video)". Some words are much more common than others, like in
+    real titles.
+    """
+    def word():
+        return words[int(len(words) * rng.random() ** 3)]
+
+    titles = []
+    for _ in range(count):
+        artist = " ".join(word().capitalize() for _ in range(rng.randint(1, 2)))
+        name = " ".join(word() for _ in range(rng.randint(1, 5)))
+        titles.append("%s - %s%s" % (artist, name.title(), rng.choice(SUFFIXES)))
+    return titles
+
+
+def add_typo(text, rng):
+    index = rng.randrange(len(text))
+    return text[:index] + rng.choice("aeiou") + text[index + 1:]
+
+
+def percentiles(times):
+    times = sorted(times)
+    return "median %.3f ms, p95 %.3f ms, max %.3f ms" % (statistics.median(times) * 1000,
+                                                         times[int(len(times) * 0.95)] * 1000, times[-1] * 1000)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    rng = random.Random(1)
+    words = make_words(20000, rng)
+    titles = make_titles(count, words[:10000], rng)
+
+    index = TitleIndex()
+    start = time.perf_counter()
+    for i, title in enumerate(titles):
+        index.add("yt:%s" % i, title, i)
+    elapsed = time.perf_counter() - start
+    print("add: %s titles in %.2fs (%.1f us/title)" % (count, elapsed, elapsed * 1000000 / count))
+
+    update_times = []
+    for _ in range(queries):
+        i = rng.randrange(count)
+        start = time.perf_counter()
+        index.add("yt:%s" % i, titles[i] + " (Live)", i)
+        update_times.append(time.perf_counter() - start)
+    print("update: %s" % percentiles(update_times))
+
+    for name, threshold, make_query in (
+            ("exact query", 0.75, lambda: rng.choice(titles)),
+            ("query with a typo", 0.75, lambda: add_typo(rng.choice(titles), rng)),
+            ("query without the artist", 0.75, lambda: rng.choice(titles).split(" - ", 1)[1]),
+            ("unknown query", 0.75, lambda: "%s %s" % (rng.choice(words[10000:]), rng.choice(words[10000:]))),
+            ("low threshold", 0.3, lambda: rng.choice(titles))):
+        times = []
+        found = 0
+        for _ in range(queries):
+            query = make_query()
+            start = time.perf_counter()
+            matches = index.query(query, threshold, limit=1)
+            times.append(time.perf_counter() - start)
+            found += len(matches) > 0
+        print("%s (threshold %.2f): %s, %.0f%% matched" % (name, threshold, percentiles(times),
+                                                            found * 100.0 / queries))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+import time
+
+FRAME_LENGTH = 0.02  # discord.py sends a frame of audio every 20 ms
+# upper bounds (in milliseconds) of the histogram's buckets, the last bucket holds everything above them
+INTERVAL_BUCKETS = (10, 15, 18, 22, 25, 30, 40, 60, 100)
+
+
+class FrameStats:
+    """
+    Measures the timing of the audio frames sent to a voice channel: how far the interval between each two frames was
+    from the target, how many frames were late and how many times ffmpeg couldn't deliver audio in time.
+    """
+    def __init__(self, frame_length=FRAME_LENGTH, late_threshold=0.005):
+        """
+        :param frame_length: The target interval between frames, in seconds
+        :type frame_length: float
+        :param late_threshold: A frame that is sent this number of seconds later than the target is considered late
+        :type late_threshold: float
+        """
+        self.frame_length = frame_length
+        self.late_threshold = late_threshold
+        self.frames = 0
+        self.late = 0
+        self.underruns = 0
+        self.drift = 0.0  # total seconds frames were sent later (positive) or earlier (negative) than the target
+        self.max_interval = 0.0
+        self.histogram = [0] * (len(INTERVAL_BUCKETS) + 1)
+        self._last_send = None
+
+    def interrupt(self):
+        """
+        Call this when frames stop on purpose (pausing, seeking, starting a new stream), so the gap isn't counted.
+        """
+        self._last_send = None
+
+    def record_send(self):
+        """
+        Records that a frame was sent now.
+        """
+        now = time.perf_counter()
+        self.frames += 1
+        if self._last_send is not None:
+            interval = now - self._last_send
+            self.drift += interval - self.frame_length
+            if interval > self.max_interval:
+                self.max_interval = interval
+            if interval > self.frame_length + self.late_threshold:
+                self.late += 1
+
+            interval_ms = interval * 1000
+            bucket = 0
+            while bucket < len(INTERVAL_BUCKETS) and interval_ms > INTERVAL_BUCKETS[bucket]:
+                bucket += 1
+            self.histogram[bucket] += 1
+        self._last_send = now
+
+    def record_read(self, duration):
+        """
+        Records how long reading a frame from ffmpeg took.
+
+        :param duration: Number of seconds the read took
+        :type duration: float
+        """
+        if duration > self.frame_length:
+            self.underruns += 1
+
+    def wrap_sender(self, send):
+        """
+        Returns a function that sends a frame with the function given and records it.
+
+        :param send: The function that sends frames, like :meth:`discord.VoiceClient.play_audio`
+        :type send: function
+        :rtype: function
+        """
+        def timed_send(*args, **kwargs):
+            self.record_send()
+            return send(*args, **kwargs)
+        return timed_send
+
+    def wrap_stream(self, stream):
+        """
+        Returns a stream that reads from the stream given and records how long each read took.
+
+        :param stream: The stream that frames are read from
+        :type stream: io.RawIOBase
+        """
+        return _TimedStream(stream, self)
+
+    def merge(self, other):
+        """
+        Adds the measurements of other stats to these.
+
+        :param other: The stats to add
+        :type other: FrameStats
+        """
+        self.frames += other.frames
+        self.late += other.late
+        self.underruns += other.underruns
+        self.drift += other.drift
+        self.max_interval = max(self.max_interval, other.max_interval)
+        self.histogram = [mine + theirs for mine, theirs in zip(self.histogram, other.histogram)]
+
+    def histogram_str(self):
+        """
+        Returns the histogram of intervals between frames as text, like "<=10ms: 3, <=15ms: 20, ..., >100ms: 1".
+
+        :rtype: str
+        """
+        labels = ["<=%sms" % bound for bound in INTERVAL_BUCKETS] + [">%sms" % INTERVAL_BUCKETS[-1]]
+        return ", ".join("%s: %s" % (label, count) for label, count in zip(labels, self.histogram) if count > 0)
+
+    def __str__(self):
+        late_percent = 100.0 * self.late / self.frames if self.frames > 0 else 0.0
+        return "%s frames, %s late (%.2f%%), %s underruns, drift %+.1fms, max interval %.1fms" % \
+               (self.frames, self.late, late_percent, self.underruns, self.drift * 1000, self.max_interval * 1000)
+
+
+class _TimedStream:
+    """
+    Wraps a stream and records how long each read from it takes in a :class:`FrameStats`.
+    """
+    def __init__(self, stream, stats):
+        self._stream = stream
+        self._stats = stats
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = self._stream.read(size)
+        self._stats.record_read(time.perf_counter() - start)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
@@ -0,0 +1,619 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+"""
+Runs the :class:`player.Player` and its voice connection in a separate process, so that sending audio does not share
+the GIL with the gateway, searches and playlist processing.
+
+The gateway process keeps the voice state (joining, moving and leaving channels) and hands the voice session to the
+worker, which opens the voice websocket and UDP socket itself. Commands are sent to the worker over a pipe, and the
+worker answers with snapshots of its state which :class:`RemotePlayer` mirrors.
+"""
+
+import asyncio
+import multiprocessing
+import threading
+import time
+from random import shuffle
+import discord
+from bot import opus_loader
+from bot.player import Player, PlayerWatchdog
+from bot.song import Song
+from bot import log
+
+MOVE_SERVER_UPDATE_TIMEOUT = 2  # seconds to wait for a new voice server after moving to another channel
+
+
+def song_to_dict(song, token):
+    """
+    Returns the details of a song that the audio worker needs, in a form that can be sent to it.
+
+    :param song: The song
+    :type song: song.Song
+    :param token: A number that identifies the song between the processes
+    :type token: int
+    :rtype: dict
+    """
+    return {
+        "token": token,
+        "stream_url": song.stream_url,
+        "title": song.title,
+        "length": song.length,
+        "image": song.image,
+        "song_url": song.song_url
+    }
+
+
+def song_from_dict(data):
+    """
+    Builds a song from details created by :func:`song_to_dict`.
+
+    :param data: The details of the song
+    :type data: dict
+    :rtype: song.Song
+    """
+    return Song(
+        stream_url=data["stream_url"],
+        title=data["title"],
+        length=data["length"],
+        image=data["image"],
+        song_url=data["song_url"]
+    )
+
+
+class _GatewayStub:
+    """
+    Stands in for the gateway websocket a :class:`discord.VoiceClient` expects. The gateway process owns the voice
+    state, so the worker never sends it.
+    """
+    async def voice_state(self, guild_id, channel_id, self_mute=False, self_deaf=False):
+        pass
+
+
+class _VoiceChannel:
+    """
+    The parts of a :class:`discord.Channel` a :class:`discord.VoiceClient` uses.
+    """
+    def __init__(self, channel_id, server_id):
+        self.id = channel_id
+        self.server = discord.Object(server_id)
+
+
+class AudioWorker:
+    """
+    The audio worker process. It owns a :class:`player.Player` and the voice connection, and runs the commands it
+    receives from a :class:`RemotePlayer`.
+    """
+    def __init__(self, conn, options):
+        """
+        :param conn: The worker's end of the pipe to the gateway process
+        :type conn: multiprocessing.connection.Connection
+        :param options: Keyword arguments for the :class:`player.Player`
+        :type options: dict
+        """
+        self.conn = conn
+        self.loop = asyncio.new_event_loop()
+        self.player = Player(update_listener=self.song_changed_handler, **options)
+        self.handled_count = 0
+        self._tokens = {}  # id of a song -> its token
+        self._send_lock = threading.Lock()
+        self._commands = {
+            "connect": self.connect,
+            "disconnect": self.disconnect,
+            "move": self.move,
+            "add": self.add_to_queue,
+            "reorder": self.reorder_queue,
+            "clear": self.player.clear_queue,
+            "ensure_playing": lambda: self._in_executor(self.player.ensure_playing),
+            "play_next": lambda: self._in_executor(self.player.play_next),
+            "volume": self.set_volume,
+            "pause": self.player.pause,
+            "resume": lambda: self._in_executor(self.player.resume),
+            "seek": self.player.seek,
+            "stream_preferences": self.player.set_stream_preferences,
+            "resolver": self.player.set_resolver,
+            "suspend": lambda: self._in_executor(self.player.suspend),
+            "resume_suspended": lambda: self._in_executor(self.player.resume_suspended)
+        }
+
+    def run(self):
+        """
+        Runs the worker until the gateway process closes the pipe.
+        """
+        asyncio.set_event_loop(self.loop)
+        opus_loader.load_opus_lib(cache_path=opus_loader.CACHE_PATH)
+        threading.Thread(target=self._receive, daemon=True).start()
+        if self.player.stall_timeout > 0:
+            PlayerWatchdog(self.player, interval=self.player.stall_timeout / 4).start()
+        self.loop.run_forever()
+
+    def _receive(self):
+        while True:
+            try:
+                command = self.conn.recv()
+            except EOFError:
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                return
+            self.loop.call_soon_threadsafe(self.handle, command)
+
+    def handle(self, command):
+        """
+        Runs a command from the gateway process and reports the resulting state.
+
+        :param command: A tuple of the command's name and its arguments
+        :type command: tuple
+        """
+        name, args = command[0], command[1:]
+        self.handled_count += 1
+        try:
+            result = self._commands[name](*args)
+            if asyncio.iscoroutine(result):
+                self.loop.create_task(self._report_errors(result))
+        except Exception as e:
+            self.send("error", "%s failed: %s" % (name, e))
+        self.send_state()
+
+    async def _in_executor(self, function, *args):
+        """
+        Runs a command that may block, like one that resolves the stream of the next song, off the event loop.
+        """
+        return await self.loop.run_in_executor(None, function, *args)
+
+    async def _report_errors(self, coro):
+        try:
+            await coro
+        except Exception as e:
+            self.send("error", str(e))
+        self.send_state()
+
+    def send(self, *message):
+        """
+        Sends a message to the gateway process. This can be called from any thread.
+        """
+        with self._send_lock:
+            try:
+                self.conn.send(message)
+            except (OSError, EOFError):  # the gateway process is gone
+                self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def snapshot(self):
+        """
+        Returns the state of the player that :class:`RemotePlayer` mirrors.
+
+        :rtype: dict
+        """
+        current_song = self.player.current_song
+        queued = list(self.player.queue.queue)
+        live = set(id(song) for song in queued)
+        if current_song is not None:
+            live.add(id(current_song))
+        self._tokens = dict((key, token) for key, token in list(self._tokens.items()) if key in live)
+
+        return {
+            "current": self._tokens.get(id(current_song)),
+            "elapsed": current_song.elapsed() if current_song is not None else 0,
+            "paused": self.player.is_paused(),
+            "suspended": self.player.is_suspended(),
+            "queue": [self._tokens.get(id(song)) for song in queued],
+            "recovery_stats": dict(self.player.recovery_stats),
+            "stall_stats": dict(self.player.stall_stats),
+            "stream_stats": dict(self.player.stream_stats),
+            "suspend_stats": dict(self.player.suspend_stats),
+            "frame_stats": self.player.frame_stats,
+            "song_frame_stats": self.player.song_frame_stats,
+            "handled": self.handled_count
+        }
+
+    def send_state(self, kind="state"):
+        self.send(kind, self.snapshot())
+
+    def song_changed_handler(self, song):
+        self.send_state("song_changed")
+
+    async def connect(self, session):
+        """
+        Opens a voice connection with a session the gateway process created.
+
+        :param session: The voice session's details: user_id, server_id, channel_id, session_id and data (the voice
+                        server update the gateway received)
+        :type session: dict
+        """
+        await self.disconnect()
+        voice = discord.VoiceClient(
+            user=discord.Object(session["user_id"]),
+            main_ws=_GatewayStub(),
+            session_id=session["session_id"],
+            channel=_VoiceChannel(session["channel_id"], session["server_id"]),
+            data=session["data"],
+            loop=self.loop
+        )
+        await voice.connect()
+        self.player.voice_client = voice
+        await self._in_executor(self.player.ensure_playing)
+
+    async def disconnect(self):
+        if self.player.voice_client is not None:
+            voice = self.player.voice_client
+            self.player.voice_client = None
+            await voice.disconnect()
+
+    def move(self, channel_id):
+        """
+        Follows a move to another voice channel that kept the same voice session.
+        """
+        voice = self.player.voice_client
+        if voice is not None:
+            voice.channel = _VoiceChannel(channel_id, voice.channel.server.id)
+
+    def add_to_queue(self, data):
+        song = song_from_dict(data)
+        self._tokens[id(song)] = data["token"]
+        self.player.add_to_queue(song)
+
+    def reorder_queue(self, tokens):
+        """
+        Puts the queued songs in the order of the tokens given.
+        """
+        by_token = dict((self._tokens.get(id(song)), song) for song in list(self.player.queue.queue))
+        self.player.queue.replace([by_token[token] for token in tokens if token in by_token])
+
+    def set_volume(self, volume):
+        self.player.volume = volume
+
+
+def run(conn, options):
+    """
+    The entry point of the audio worker process.
+    """
+    AudioWorker(conn, options).run()
+
+
+class RemotePlayer(Player):
+    """
+    A :class:`player.Player` whose audio is played by an audio worker process. Commands are forwarded to the worker,
+    while the queue and the current song are mirrored locally so they can be read without waiting for it.
+    """
+    def __init__(self, voice_client=None, volume=0.15, update_listener=None, max_resume_retries=3,
+                 resume_tolerance=5, lookahead=3, stall_timeout=20, stall_grace=30):
+        super().__init__(voice_client, volume, update_listener, max_resume_retries, resume_tolerance, lookahead,
+                         stall_timeout, stall_grace)
+        self._options = {
+            "volume": volume,
+            "max_resume_retries": max_resume_retries,
+            "resume_tolerance": resume_tolerance,
+            "lookahead": lookahead,
+            "stall_timeout": stall_timeout,
+            "stall_grace": stall_grace
+        }
+        self._resolver_args = None  # sent to every worker that is started, see set_resolver
+        self._songs = {}  # token -> song, for every song the worker knows
+        self._next_token = 0
+        self._sent_count = 0
+        self._conn = None
+        self._process = None
+        self._lock = threading.Lock()
+
+    def start_worker(self):
+        """
+        Starts the audio worker process if it is not running.
+        """
+        with self._lock:
+            if self._process is not None and self._process.is_alive():
+                return
+
+            self._conn, child_conn = multiprocessing.Pipe()
+            self._process = multiprocessing.Process(target=run, args=(child_conn, self._options), daemon=True)
+            self._process.start()
+            self._sent_count = 0
+            threading.Thread(target=self._receive, args=(self._conn,), daemon=True).start()
+        if self._resolver_args is not None:
+            self.send("resolver", *self._resolver_args)
+        log.info("Started audio worker", pid=self._process.pid)
+
+    def send(self, *command):
+        """
+        Sends a command to the audio worker. This can be called from any thread.
+        """
+        with self._lock:
+            if self._conn is None:
+                return
+            self._sent_count += 1
+            self._conn.send(command)
+
+    def _receive(self, conn):
+        while True:
+            try:
+                kind, data = conn.recv()
+            except (EOFError, OSError):
+                log.warning("Audio worker exited")
+                with self._lock:
+                    if self._conn is conn:
+                        self._conn = None
+                self._current_song = None
+                self.fire_update_listener()
+                return
+
+            if kind == "error":
+                log.error("Audio worker error", error=data)
+            else:
+                self._apply_state(data)
+                if kind == "song_changed":
+                    self.fire_update_listener()
+
+    def _apply_state(self, state):
+        """
+        Mirrors a snapshot of the worker's state.
+        """
+        current_song = self._songs.get(state["current"])
+        if current_song is not None:
+            if state["paused"]:
+                current_song.pause()
+            else:
+                current_song.play()
+            current_song.seek(state["elapsed"])
+        self._current_song = current_song
+        self.recovery_stats = state["recovery_stats"]
+        self.stall_stats = state["stall_stats"]
+        self.stream_stats = state["stream_stats"]
+        self.suspend_stats = state["suspend_stats"]
+        if not state["suspended"]:
+            self._suspended_since = None
+        elif self._suspended_since is None:
+            self._suspended_since = time.monotonic()
+        self.frame_stats = state["frame_stats"]
+        self.song_frame_stats = state["song_frame_stats"]
+
+        with self._lock:
+            # the queue is only taken from the worker once it handled every command, otherwise it would undo changes
+            # that were made locally but are still on their way to the worker
+            if state["handled"] != self._sent_count:
+                return
+            songs = dict((token, self._songs[token]) for token in state["queue"] if token in self._songs)
+            if current_song is not None:
+                songs[state["current"]] = current_song
+            self._songs = songs
+            self.queue.replace([songs[token] for token in state["queue"] if token in songs])
+
+    def _token_of(self, song):
+        for token, known_song in self._songs.items():
+            if known_song is song:
+                return token
+        return None
+
+    def connect_voice(self, session):
+        """
+        Makes the worker open a voice connection.
+
+        :param session: The voice session's details, see :meth:`AudioWorker.connect`
+        :type session: dict
+        """
+        self.start_worker()
+        self.send("connect", session)
+
+    def disconnect_voice(self):
+        """
+        Makes the worker close its voice connection.
+        """
+        self.send("disconnect")
+
+    def move_voice(self, channel_id):
+        """
+        Tells the worker its voice connection moved to another channel, with the same voice session.
+
+        :param channel_id: The ID of the channel the connection moved to
+        :type channel_id: str
+        """
+        self.send("move", channel_id)
+
+    def ensure_playing(self):
+        self.send("ensure_playing")
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, volume):
+        self._volume = volume
+        self.send("volume", volume)
+
+    def set_stream_preferences(self, target_bitrate, prefer_opus=True):
+        super().set_stream_preferences(target_bitrate, prefer_opus)  # songs are resolved in both processes
+        self.send("stream_preferences", target_bitrate, prefer_opus)
+
+    def set_resolver(self, backend_names, hedge_percentile=95):
+        super().set_resolver(backend_names, hedge_percentile)
+        self._resolver_args = (backend_names, hedge_percentile)
+        self.send("resolver", backend_names, hedge_percentile)
+
+    def pause(self):
+        if self._current_song is None or self.is_paused():
+            return False
+        self._current_song.pause()
+        self.send("pause")
+        return True
+
+    def resume(self):
+        if self.is_suspended():
+            return self.resume_suspended()
+        if not self.is_paused():
+            return False
+        self._current_song.play()
+        self.send("resume")
+        return True
+
+    def suspend(self):
+        if self._current_song is None or self.is_paused():
+            return False
+        self._current_song.pause()
+        self._suspended_since = time.monotonic()
+        self.send("suspend")
+        return True
+
+    def resume_suspended(self):
+        if self._current_song is None or not self.is_suspended():
+            return False
+        self._suspended_since = None
+        self._current_song.play()
+        self.send("resume_suspended")
+        return True
+
+    def seek(self, seconds):
+        if self._current_song is None:
+            return False
+        self._suspended_since = None
+        self._current_song.play()
+        self._current_song.seek(seconds)
+        self.send("seek", seconds)
+        return True
+
+    def add_to_queue(self, song):
+        with self._lock:
+            token = self._next_token
+            self._next_token += 1
+            self._songs[token] = song
+            self.queue.put(song)
+        self.send("add", song_to_dict(song, token))
+        if song.video_id is not None:
+            song.stream_url = None  # only the worker streams it
+        log.debug("Added to queue", title=song.title, video=song.video_id)
+
+    def clear_queue(self):
+        removed_count = super().clear_queue()
+        self.send("clear")
+        return removed_count
+
+    def shuffle_queue(self):
+        with self._lock:
+            song_list = list(self.queue.queue)
+            shuffle(song_list)
+            self.queue.replace(song_list)
+            tokens = [self._token_of(song) for song in song_list]
+        self.send("reorder", tokens)
+
+    def play_next(self):
+        self.send("play_next")
+
+
+class RemoteVoiceClient:
+    """
+    Stands in for a :class:`discord.VoiceClient` in the gateway process. It sets up the voice state like
+    :meth:`discord.Client.join_voice_channel` does, but hands the voice session to the audio worker instead of
+    connecting to it.
+    """
+    def __init__(self, client, channel, player):
+        """
+        :param client: The client that is connected to the gateway
+        :type client: discord.Client
+        :param channel: The voice channel to connect to
+        :type channel: discord.Channel
+        :param player: The player whose audio worker should connect
+        :type player: RemotePlayer
+        """
+        self.client = client
+        self.channel = channel
+        self.player = player
+        self._connected = False
+        self._session = None  # the voice session the worker was handed last
+
+    @property
+    def server(self):
+        return self.channel.server
+
+    def is_connected(self):
+        return self._connected
+
+    async def connect(self):
+        """
+        Joins the voice channel and hands the voice session to the audio worker.
+        """
+        client = self.client
+        server = self.server
+
+        def session_id_found(data):
+            return data.get("user_id") == client.user.id and data.get("guild_id") == server.id
+
+        session_id_future = client.ws.wait_for("VOICE_STATE_UPDATE", session_id_found)
+        voice_data_future = client.ws.wait_for("VOICE_SERVER_UPDATE", lambda d: d.get("guild_id") == server.id)
+        await client.ws.voice_state(server.id, self.channel.id)
+
+        try:
+            session_id_data = await asyncio.wait_for(session_id_future, timeout=10.0, loop=client.loop)
+            data = await asyncio.wait_for(voice_data_future, timeout=10.0, loop=client.loop)
+        except asyncio.TimeoutError:
+            await client.ws.voice_state(server.id, None, self_mute=True)
+            raise
+
+        self._session = {
+            "user_id": client.user.id,
+            "server_id": server.id,
+            "channel_id": self.channel.id,
+            "session_id": session_id_data.get("session_id"),
+            "data": data
+        }
+        self.player.connect_voice(self._session)
+        self._connected = True
+        client.connection._add_voice_client(server.id, self)
+
+    async def disconnect(self):
+        if not self._connected:
+            return
+        self._connected = False
+        self.player.disconnect_voice()
+        try:
+            await self.client.ws.voice_state(self.server.id, None, self_mute=True)
+        finally:
+            self.client.connection._remove_voice_client(self.server.id)
+
+    async def move_to(self, channel):
+        """
+        Moves to another voice channel of the same server. Discord may hand the bot a new voice session or server for
+        the channel, and then the audio worker reconnects with them.
+        """
+        client = self.client
+        server = self.server
+
+        def session_id_found(data):
+            return data.get("user_id") == client.user.id and data.get("guild_id") == server.id
+
+        session_id_future = client.ws.wait_for("VOICE_STATE_UPDATE", session_id_found)
+        voice_data_future = client.ws.wait_for("VOICE_SERVER_UPDATE", lambda d: d.get("guild_id") == server.id)
+        await client.ws.voice_state(server.id, channel.id)
+        self.channel = channel
+
+        try:
+            session_id_data = await asyncio.wait_for(session_id_future, timeout=10.0, loop=client.loop)
+        except asyncio.TimeoutError:
+            voice_data_future.cancel()
+            raise
+        try:
+            # the voice server is only updated when it changes, and then right after the voice state
+            data = await asyncio.wait_for(voice_data_future, timeout=MOVE_SERVER_UPDATE_TIMEOUT, loop=client.loop)
+        except asyncio.TimeoutError:
+            data = None
+
+        session = dict(self._session, channel_id=channel.id, session_id=session_id_data.get("session_id"))
+        if data is not None:
+            session["data"] = data
+        if data is not None or session["session_id"] != self._session["session_id"]:
+            self.player.connect_voice(session)
+        else:
+            self.player.move_voice(channel.id)
+        self._session = session
@@ -0,0 +1,257 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+import os
+import sqlite3
+import threading
+import time
+from bot import log
+from bot import songfetcher
+
+
+def current_hour():
+    """
+    Returns the number of hours since the epoch, the unit of time the history is indexed by.
+
+    :rtype: int
+    """
+    return int(time.time() // 3600)
+
+
+class PlayHistory:
+    """
+    Stores which songs were played in each server, who requested them and when. Plays are counted per server, hour,
+    song and requester, so the store grows with the variety of what is played rather than with how much is played.
+    """
+    def __init__(self, path):
+        """
+        :param path: Path of the SQLite database file to keep the history in
+        :type path: str
+        """
+        directory = os.path.dirname(path)
+        if len(directory) > 0:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS plays ("
+                             "server_id TEXT NOT NULL, hour INTEGER NOT NULL, video_id TEXT NOT NULL, "
+                             "requester_id TEXT NOT NULL, count INTEGER NOT NULL, "
+                             "PRIMARY KEY (server_id, hour, video_id, requester_id)) WITHOUT ROWID")
+            self._db.execute("CREATE TABLE IF NOT EXISTS songs ("
+                             "video_id TEXT PRIMARY KEY, title TEXT NOT NULL, length INTEGER NOT NULL) WITHOUT ROWID")
+
+    def record(self, server_id, video_id, requester_id, title, length, hour=None):
+        """
+        Records that a song was played.
+
+        :param server_id: The ID of the server the song was played in
+        :type server_id: str
+        :param video_id: The ID of the song's video
+        :type video_id: str
+        :param requester_id: The ID of the user who requested the song
+        :type requester_id: str
+        :param title: The title of the song
+        :type title: str
+        :param length: The length of the song in seconds
+        :type length: int
+        :param hour: The hour the song was played in, see :func:`current_hour`. Defaults to the current hour.
+        :type hour: int
+        """
+        if hour is None:
+            hour = current_hour()
+        key = (server_id, hour, video_id, requester_id)
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO plays VALUES (?, ?, ?, ?, 0)", key)
+            self._db.execute("UPDATE plays SET count = count + 1 "
+                             "WHERE server_id = ? AND hour = ? AND video_id = ? AND requester_id = ?", key)
+            self._db.execute("INSERT OR REPLACE INTO songs VALUES (?, ?, ?)", (video_id, title, length))
+
+    def songs(self):
+        """
+        Returns every song that was ever played.
+
+        :return: A list of (video ID, title, length) tuples
+        :rtype: list
+        """
+        with self._lock:
+            return self._db.execute("SELECT video_id, title, length FROM songs").fetchall()
+
+    def top_songs(self, server_id, limit, since=None, hours_of_day=None):
+        """
+        Returns the songs that were played the most in a server.
+
+        :param server_id: The ID of the server
+        :type server_id: str
+        :param limit: The maximal number of songs to return
+        :type limit: int
+        :param since: Only count plays from this hour on, see :func:`current_hour`. None to count every play.
+        :type since: int
+        :param hours_of_day: Only count plays in these hours of the day (0-23, UTC). None to count every play.
+        :type hours_of_day: iterable
+        :return: A list of (video ID, title, length, play count) tuples, most played first
+        :rtype: list
+        """
+        query = "SELECT plays.video_id, title, length, SUM(count) AS total FROM plays " \
+                "JOIN songs ON plays.video_id = songs.video_id WHERE server_id = ?"
+        params = [server_id]
+        if since is not None:
+            query += " AND hour >= ?"
+            params.append(since)
+        if hours_of_day is not None:
+            hours_of_day = list(hours_of_day)
+            query += " AND hour %% 24 IN (%s)" % ", ".join("?" * len(hours_of_day))
+            params.extend(hours_of_day)
+        query += " GROUP BY plays.video_id ORDER BY total DESC LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            return self._db.execute(query, params).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class HistoryWarmer(threading.Thread):
+    """
+    Keeps the songs that are played the most around the current time of day resolved in the song cache, so requesting
+    them again starts right away. It can download their audio too, so they don't even need to be streamed.
+    """
+    def __init__(self, history, get_server_ids, top_count=10, interval=900, warm_audio=False, window_days=28,
+                 audio_dir="data/audio", get_used_ids=None):
+        """
+        :param history: The history to find the most played songs in
+        :type history: PlayHistory
+        :param get_server_ids: A function that returns the IDs of the servers to warm songs for
+        :type get_server_ids: function
+        :param top_count: The number of most played songs to warm in every server
+        :type top_count: int
+        :param interval: Number of seconds between warm ups
+        :type interval: int
+        :param warm_audio: Whether or not to download the audio of the songs as well
+        :type warm_audio: bool
+        :param window_days: Only plays from this number of days back are considered
+        :type window_days: int
+        :param audio_dir: The directory downloaded audio is kept in. Audio that is no longer among the most played is
+                          deleted from it, so every warmer needs a directory of its own.
+        :type audio_dir: str
+        :param get_used_ids: A function that returns the IDs of the videos that are queued or playing, whose audio is
+                             never deleted
+        :type get_used_ids: function
+        """
+        super().__init__(daemon=True)
+        self.history = history
+        self.get_server_ids = get_server_ids
+        self.top_count = top_count
+        self.interval = interval
+        self.warm_audio = warm_audio
+        self.window_days = window_days
+        self.audio_dir = audio_dir
+        self.get_used_ids = get_used_ids
+        self.stats = {
+            "resolved": 0,
+            "downloaded": 0,
+            "failed": 0
+        }
+
+    def run(self):
+        while True:
+            try:
+                self.warm()
+            except Exception as e:
+                log.warning("Warming the most played songs failed", error=e)
+            time.sleep(self.interval)
+
+    def warm(self):
+        """
+        Resolves the most played songs of this time of day in every server, unless they're already resolved for long
+        enough to last until the next warm up.
+        """
+        hour = current_hour()
+        hours_of_day = set((hour + offset) % 24 for offset in (-1, 0, 1))
+        since = hour - self.window_days * 24
+
+        hot_ids = set()
+        for server_id in self.get_server_ids():
+            for video_id, title, length, count in self.history.top_songs(server_id, self.top_count, since,
+                                                                         hours_of_day):
+                hot_ids.add(video_id)
+                if songfetcher.cache.is_fresh(video_id, margin=self.interval * 2) and \
+                        (not self.warm_audio or os.path.isfile(self._audio_path(video_id))):
+                    continue
+                try:
+                    song = songfetcher.get_youtube_song("https://www.youtube.com/watch?v=" + video_id, cached=False)
+                    self.stats["resolved"] += 1
+                    if self.warm_audio:
+                        self.download_audio(song)
+                        self.stats["downloaded"] += 1
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    log.warning("Could not warm a song", title=title, video=video_id, error=e)
+
+        if self.warm_audio:
+            self.remove_cold_audio(hot_ids)
+
+    def _audio_path(self, video_id):
+        return os.path.join(self.audio_dir, video_id)
+
+    def download_audio(self, song):
+        """
+        Downloads the audio of a song, and makes the song cache play it from the downloaded file.
+
+        :param song: A resolved song
+        :type song: song.Song
+        """
+        import requests
+
+        os.makedirs(self.audio_dir, exist_ok=True)
+        path = self._audio_path(song.video_id)
+        partial_path = path + ".part"
+        with requests.get(song.stream_url, stream=True, timeout=30) as resp:
+            resp.raise_for_status()
+            with open(partial_path, "wb") as audio_file:
+                for chunk in resp.iter_content(65536):
+                    audio_file.write(chunk)
+        os.replace(partial_path, path)
+
+        song.stream_url = path
+        songfetcher.cache.put(song)
+
+    def remove_cold_audio(self, hot_ids):
+        """
+        Deletes downloaded audio of songs that are no longer among the most played, unless they're queued or playing.
+        Songs whose audio is deleted are forgotten by the song cache, so they're resolved again when they're requested.
+
+        :param hot_ids: The IDs of the videos whose audio should be kept
+        :type hot_ids: set
+        """
+        if not os.path.isdir(self.audio_dir):
+            return
+        used_ids = set(self.get_used_ids()) if self.get_used_ids is not None else set()
+        for name in os.listdir(self.audio_dir):
+            if name in hot_ids or name in used_ids:
+                continue
+            try:
+                os.remove(self._audio_path(name))
+            except OSError as e:
+                log.warning("Could not delete downloaded audio", video=name, error=e)
+                continue
+            songfetcher.cache.discard(name)
@@ -0,0 +1,278 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+import json
+import mmap
+import os
+import struct
+import subprocess
+import threading
+from collections import namedtuple
+from bot import song
+from bot import log
+
+AUDIO_EXTENSIONS = (".mp3", ".flac", ".ogg", ".opus", ".m4a", ".aac", ".wav", ".wma", ".webm")
+
+# The index file is a header, a table with the offset of every track, and the tracks themselves. A track is a fixed
+# size record followed by its UTF-8 encoded path, title and artist.
+INDEX_MAGIC = b"MBLIB\x01"
+INDEX_HEADER = struct.Struct("<6sI")  # magic, track count
+INDEX_OFFSET = struct.Struct("<I")
+INDEX_RECORD = struct.Struct("<dQIHHH")  # mtime, file size, length, path size, title size, artist size
+
+Track = namedtuple("Track", ("path", "mtime", "size", "length", "title", "artist"))
+
+
+def track_display_title(track):
+    """
+    Returns the title a track is shown with.
+
+    :param track: The track
+    :type track: Track
+    :rtype: str
+    """
+    if len(track.artist) > 0:
+        return "%s - %s" % (track.artist, track.title)
+    return track.title
+
+
+def read_tags(path):
+    """
+    Reads the title, artist and length of an audio file. Uses mutagen if it is installed, and ffprobe otherwise. When
+    the file has no title, the file's name is used instead.
+
+    :param path: Path of the audio file
+    :type path: str
+    :return: A (title, artist, length in seconds) tuple
+    :rtype: tuple
+    """
+    title = ""
+    artist = ""
+    length = 0
+    try:
+        import mutagen
+        audio = mutagen.File(path, easy=True)
+        if audio is not None:
+            title = (audio.get("title") or [""])[0]
+            artist = (audio.get("artist") or [""])[0]
+            length = int(audio.info.length)
+    except ImportError:
+        output = subprocess.run(["ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", path],
+                                stdout=subprocess.PIPE, timeout=30).stdout
+        file_format = json.loads(output.decode("utf-8") or "{}").get("format", {})
+        tags = dict((key.lower(), value) for key, value in file_format.get("tags", {}).items())
+        title = tags.get("title", "")
+        artist = tags.get("artist", "")
+        length = int(float(file_format.get("duration", 0)))
+
+    if len(title) == 0:
+        title = os.path.splitext(os.path.basename(path))[0]
+    return title, artist, length
+
+
+def _encode_tag(tag):
+    """
+    Encodes a tag for the index, trimmed to the longest length the index holds without splitting a character.
+    """
+    return tag.encode("utf-8")[:0xffff].decode("utf-8", "ignore").encode("utf-8")
+
+
+class LocalLibrary:
+    """
+    Audio files from local directories. The tags of the files are kept in a compact index file that is memory-mapped,
+    so a large library takes little memory and is available as soon as the bot starts. Rescanning only reads the tags
+    of files that were added or changed since the last scan.
+    """
+    def __init__(self, directories, index_path):
+        """
+        :param directories: The directories to look for audio files in, including their subdirectories
+        :type directories: list
+        :param index_path: Path of the index file
+        :type index_path: str
+        """
+        self.directories = directories
+        self.index_path = index_path
+        self.last_scan = {
+            "added": 0,
+            "changed": 0,
+            "removed": 0,
+            "failed": 0
+        }
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+        self._count = 0
+        self.load()
+
+    def load(self):
+        """
+        Maps the index file to memory. The library is empty if there is no valid index file.
+        """
+        with self._lock:
+            self._close()
+            if not os.path.isfile(self.index_path) or os.path.getsize(self.index_path) < INDEX_HEADER.size:
+                return
+            self._file = open(self.index_path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, count = INDEX_HEADER.unpack_from(self._map)
+            if magic != INDEX_MAGIC:
+                log.warning("Ignoring library index with an unknown format", path=self.index_path)
+                self._close()
+                return
+            self._count = count
+
+    def _close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+        self._file = None
+        self._map = None
+        self._count = 0
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def __len__(self):
+        return self._count
+
+    def _track_at(self, index):
+        offset, = INDEX_OFFSET.unpack_from(self._map, INDEX_HEADER.size + index * INDEX_OFFSET.size)
+        mtime, size, length, path_size, title_size, artist_size = INDEX_RECORD.unpack_from(self._map, offset)
+        start = offset + INDEX_RECORD.size
+        path = self._map[start:start + path_size].decode("utf-8", "surrogateescape")
+        start += path_size
+        title = self._map[start:start + title_size].decode("utf-8")
+        start += title_size
+        artist = self._map[start:start + artist_size].decode("utf-8")
+        return Track(path, mtime, size, length, title, artist)
+
+    def tracks(self):
+        """
+        Returns all of the tracks in the library, in the order they were found in.
+
+        :rtype: list
+        """
+        with self._lock:
+            return [self._track_at(index) for index in range(self._count)]
+
+    def search(self, query, limit=None):
+        """
+        Finds the tracks whose title, artist or file name contain every word of a query. Tracks whose title contains
+        the query as a whole come first.
+
+        :param query: The search query
+        :type query: str
+        :param limit: The maximal number of tracks to return, None for no limit
+        :type limit: int
+        :return: A list of :class:`Track` objects
+        :rtype: list
+        """
+        query = query.lower().strip()
+        words = query.split()
+        if len(words) == 0:
+            return []
+
+        exact = []
+        partial = []
+        for track in self.tracks():
+            title = track_display_title(track).lower()
+            text = "%s %s" % (title, os.path.basename(track.path).lower())
+            if all(word in text for word in words):
+                (exact if query in title else partial).append(track)
+        matches = exact + partial
+        return matches if limit is None else matches[:limit]
+
+    def scan(self):
+        """
+        Looks for audio files in the library's directories and updates the index. Tags are only read from files whose
+        modification time or size changed since the last scan.
+
+        :return: The number of tracks added, changed, removed and failed to read, see :attr:`last_scan`
+        :rtype: dict
+        """
+        known = dict((track.path, track) for track in self.tracks())
+        stats = dict.fromkeys(self.last_scan, 0)
+        tracks = []
+        for directory in self.directories:
+            for root, dirs, files in os.walk(directory):
+                dirs.sort()
+                for name in sorted(files):
+                    if not name.lower().endswith(AUDIO_EXTENSIONS):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                        track = known.pop(path, None)
+                        if track is not None and track.mtime == stat.st_mtime and track.size == stat.st_size:
+                            tracks.append(track)
+                            continue
+                        title, artist, length = read_tags(path)
+                    except Exception as e:
+                        log.warning("Could not read tags", path=path, error=e)
+                        stats["failed"] += 1
+                        continue
+                    stats["changed" if track is not None else "added"] += 1
+                    tracks.append(Track(path, stat.st_mtime, stat.st_size, length, title, artist))
+        stats["removed"] = len(known)
+
+        try:
+            self._write_index(tracks)
+        finally:
+            self.load()
+        self.last_scan = stats
+        return stats
+
+    def _write_index(self, tracks):
+        records = []
+        offset = INDEX_HEADER.size + len(tracks) * INDEX_OFFSET.size
+        offsets = []
+        for track in tracks:
+            path = track.path.encode("utf-8", "surrogateescape")
+            title = _encode_tag(track.title)
+            artist = _encode_tag(track.artist)
+            record = INDEX_RECORD.pack(track.mtime, track.size, track.length, len(path), len(title), len(artist)) + \
+                path + title + artist
+            offsets.append(INDEX_OFFSET.pack(offset))
+            records.append(record)
+            offset += len(record)
+
+        directory = os.path.dirname(self.index_path)
+        if len(directory) > 0:
+            os.makedirs(directory, exist_ok=True)
+        partial_path = "%s.%s.part" % (self.index_path, os.getpid())  # every shard's process rescans the library
+        with open(partial_path, "wb") as index_file:
+            index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, len(tracks)))
+            index_file.write(b"".join(offsets))
+            index_file.write(b"".join(records))
+        with self._lock:
+            self._close()  # a file that is mapped can't be replaced on Windows
+            os.replace(partial_path, self.index_path)
+
+    @staticmethod
+    def to_song(track):
+        """
+        Builds a song that plays a track straight from its file.
+
+        :param track: The track
+        :type track: Track
+        :rtype: song.Song
+        """
+        return song.Song(stream_url=track.path, title=track_display_title(track), length=track.length)
@@ -0,0 +1,227 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+"""
+The bot's log. Logging never blocks: records are put in a bounded buffer and written by a background thread, and
+records that don't fit in the buffer are dropped and counted. Every record has a level, an optional guild (server) ID
+and key-value fields, and is written to the terminal or to rotating files, as text or as JSON lines.
+"""
+
+import atexit
+import io
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR
+}
+
+logger = logging.getLogger("metalbot")
+logger.propagate = False
+
+# the arguments of the last call to setup(), so child processes can set the log up the same way
+settings = {}
+stats = {
+    "written": 0,
+    "dropped": 0
+}
+
+_buffer = None
+_listener = None
+_pid = None
+_stdout = None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records in a bounded queue, dropping them when the queue is full instead of waiting.
+    """
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            stats["dropped"] += 1
+
+
+class _CountingListener(logging.handlers.QueueListener):
+    def handle(self, record):
+        super().handle(record)
+        stats["written"] += 1
+
+
+def _format_value(value):
+    value = str(value)
+    if len(value) == 0 or any(c in value for c in ' "='):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+class KeyValueFormatter(logging.Formatter):
+    """
+    Formats records as a line of text followed by their guild and fields as key=value pairs.
+    """
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = []
+        if getattr(record, "guild", None) is not None:
+            fields.append(("guild", record.guild))
+        fields.extend(sorted(getattr(record, "fields", {}).items()))
+        if len(fields) > 0:
+            line += " " + " ".join("%s=%s" % (key, _format_value(value)) for key, value in fields)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as JSON objects, one per line.
+    """
+    def format(self, record):
+        data = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) +
+            (".%03d" % record.msecs),
+            "level": record.levelname.lower(),
+            "message": record.getMessage()
+        }
+        if getattr(record, "guild", None) is not None:
+            data["guild"] = record.guild
+        data.update(getattr(record, "fields", {}))
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup(level="info", path="", json_lines=False, max_bytes=10485760, backup_count=5, buffer_size=10000):
+    """
+    Sets the log up, replacing the previous setup.
+
+    :param level: The lowest level that is written: debug, info, warning or error
+    :type level: str
+    :param path: The file to write to, the terminal if empty. The file is rotated when it gets too big.
+    :type path: str
+    :param json_lines: Whether to write JSON lines instead of text
+    :type json_lines: bool
+    :param max_bytes: The size at which the file is rotated
+    :type max_bytes: int
+    :param backup_count: The number of rotated files to keep
+    :type backup_count: int
+    :param buffer_size: The number of records that can wait to be written before new records are dropped
+    :type buffer_size: int
+    """
+    global _buffer, _listener, _pid, _stdout
+    if level.lower() not in LEVELS:
+        raise ValueError("Unknown log level '%s', expected one of: %s" % (level, ", ".join(sorted(LEVELS))))
+    shutdown()
+    settings.clear()
+    settings.update(level=level, path=path, json_lines=json_lines, max_bytes=max_bytes, backup_count=backup_count,
+                    buffer_size=buffer_size)
+
+    if len(path) > 0:
+        directory = os.path.dirname(path)
+        if len(directory) > 0:
+            os.makedirs(directory, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                       encoding="utf-8")
+    elif hasattr(sys.stdout, "buffer"):
+        # characters the terminal can't show are replaced rather than failing the write. The wrapper is never
+        # replaced, because dropping it would close the terminal's buffer.
+        if _stdout is None:
+            _stdout = io.TextIOWrapper(sys.stdout.buffer, encoding=sys.stdout.encoding or "utf-8", errors="replace",
+                                       line_buffering=True)
+        handler = logging.StreamHandler(_stdout)
+    else:
+        handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if json_lines else KeyValueFormatter())
+
+    _buffer = queue.Queue(buffer_size)
+    _listener = _CountingListener(_buffer, handler)
+    _listener.start()
+    _pid = os.getpid()
+    logger.handlers = [DroppingQueueHandler(_buffer)]
+    logger.setLevel(LEVELS[level.lower()])
+
+
+def shutdown():
+    """
+    Writes the records that are still in the buffer and stops the writer thread.
+    """
+    global _listener
+    if _listener is not None and _pid == os.getpid():
+        _listener.stop()
+    _listener = None
+
+
+atexit.register(shutdown)
+
+
+def _ensure_setup():
+    if _listener is None:
+        setup(**settings)
+    elif _pid != os.getpid():
+        # a forked child process doesn't have the parent's writer thread, and shouldn't rotate the parent's files
+        child_settings = dict(settings)
+        if len(child_settings.get("path", "")) > 0:
+            root, extension = os.path.splitext(child_settings["path"])
+            child_settings["path"] = "%s-child%s" % (root, extension)
+        setup(**child_settings)
+
+
+def log(level, message, guild=None, **fields):
+    """
+    Adds a record to the log.
+
+    :param level: The level of the record, one of :data:`LEVELS`
+    :type level: int
+    :param message: The message
+    :type message: str
+    :param guild: The ID of the guild (server) the record is about, if any
+    :type guild: str
+    :param fields: Additional key-value fields
+    """
+    if _listener is None or _pid != os.getpid():
+        _ensure_setup()
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={"guild": guild, "fields": fields})
+
+
+def debug(message, guild=None, **fields):
+    log(logging.DEBUG, message, guild, **fields)
+
+
+def info(message, guild=None, **fields):
+    log(logging.INFO, message, guild, **fields)
+
+
+def warning(message, guild=None, **fields):
+    log(logging.WARNING, message, guild, **fields)
+
+
+def error(message, guild=None, **fields):
+    log(logging.ERROR, message, guild, **fields)
@@ -0,0 +1,137 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from bot import log
+
+_ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+
+class LoopMonitor(threading.Thread):
+    """
+    Watches an event loop for callbacks that block it. A heartbeat is scheduled on the loop every :attr:`interval`
+    seconds and the time until it runs is the loop's lag. When a heartbeat waits longer than :attr:`threshold`, the
+    stack of the loop's thread is logged, which shows the code that blocks it.
+
+    It also flags calls to the loop's ``call_soon`` from other threads (which ``create_task`` makes as well). Those are
+    not thread safe and may not wake the loop up, so they are counted, logged once for every place they are made from,
+    and passed to ``call_soon_threadsafe`` instead.
+    """
+    RECENT_LAGS = 1000  # the number of heartbeats the lag percentiles are calculated from
+
+    def __init__(self, loop, threshold=0.1, interval=0.05):
+        """
+        :param loop: The loop to watch
+        :type loop: asyncio.AbstractEventLoop
+        :param threshold: Number of seconds the loop can be blocked for before it's reported
+        :type threshold: float
+        :param interval: Number of seconds between heartbeats
+        :type interval: float
+        """
+        super().__init__(daemon=True)
+        self.loop = loop
+        self.threshold = threshold
+        self.interval = interval
+        self.stats = {
+            "heartbeats": 0,
+            "max_lag": 0.0,
+            "blocked": 0,
+            "max_blocked_time": 0.0,
+            "cross_thread_calls": 0
+        }
+        self.recent_lags = deque(maxlen=self.RECENT_LAGS)
+        self._loop_thread = None
+        self._beat_done = threading.Event()
+        self._flagged_sites = set()
+        self._call_soon = loop.call_soon
+        loop.call_soon = self._checked_call_soon
+
+    def _checked_call_soon(self, callback, *args, **kwargs):
+        if self._loop_thread is None or threading.get_ident() == self._loop_thread:
+            return self._call_soon(callback, *args, **kwargs)
+
+        self.stats["cross_thread_calls"] += 1
+        frame = sys._getframe(1)
+        # the place that matters is the first one outside of asyncio, like the code that called create_task
+        while frame is not None and (frame.f_code.co_filename.startswith(_ASYNCIO_DIR) or
+                                     frame.f_code.co_filename == __file__):
+            frame = frame.f_back
+        site = "%s:%s" % (frame.f_code.co_filename, frame.f_lineno) if frame is not None else "unknown"
+        if site not in self._flagged_sites:
+            self._flagged_sites.add(site)
+            log.warning("Event loop used from another thread", site=site, thread=threading.current_thread().name,
+                        stack="".join(traceback.format_stack(frame, limit=8)) if frame is not None else "")
+        return self.loop.call_soon_threadsafe(callback, *args, **kwargs)
+
+    def _beat(self, sent):
+        self._loop_thread = threading.get_ident()
+        lag = time.monotonic() - sent
+        self.stats["heartbeats"] += 1
+        self.stats["max_lag"] = max(self.stats["max_lag"], lag)
+        self.recent_lags.append(lag)
+        self._beat_done.set()
+
+    def run(self):
+        while not self.loop.is_closed():
+            self._beat_done.clear()
+            sent = time.monotonic()
+            self.loop.call_soon_threadsafe(self._beat, sent)
+            # until the loop runs for the first time, there's nothing that blocks it
+            if not self._beat_done.wait(self.threshold) and self._loop_thread is not None:
+                self._report_blocked(sent)
+            time.sleep(self.interval)
+
+    def _report_blocked(self, sent):
+        frame = sys._current_frames().get(self._loop_thread)
+        self.stats["blocked"] += 1
+        log.warning("Event loop blocked", threshold=self.threshold,
+                    stack="".join(traceback.format_stack(frame, limit=12)) if frame is not None else "")
+        while not self._beat_done.wait(1):
+            if self.loop.is_closed():
+                return
+        blocked_time = time.monotonic() - sent
+        self.stats["max_blocked_time"] = max(self.stats["max_blocked_time"], blocked_time)
+        log.info("Event loop unblocked", blocked_time="%.3f" % blocked_time)
+
+    def lag_percentile(self, percent):
+        """
+        Returns a percentile of the lag of recent heartbeats.
+
+        :param percent: The percentile, 0-100
+        :type percent: float
+        :return: The lag in seconds, 0 if there were no heartbeats yet
+        :rtype: float
+        """
+        lags = sorted(self.recent_lags)
+        if len(lags) == 0:
+            return 0.0
+        return lags[min(int(len(lags) * percent / 100), len(lags) - 1)]
+
+    def __str__(self):
+        return "Lag: %.1fms median, %.1fms p99, %.1fms max\n%s times blocked (%.0fms max), %s calls from other " \
+               "threads" % (self.lag_percentile(50) * 1000, self.lag_percentile(99) * 1000,
+                            self.stats["max_lag"] * 1000, self.stats["blocked"],
+                            self.stats["max_blocked_time"] * 1000, self.stats["cross_thread_calls"])
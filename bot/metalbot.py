@@ -18,31 +18,62 @@
 # along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
 # -----------------------
 
+import asyncio
 import discord
+import math
+import os
 from threading import Thread
-import traceback
 from bot import opus_loader
-from bot.player import Player
+from bot.player import Player, PlayerWatchdog
+from bot.audioworker import RemotePlayer, RemoteVoiceClient
 from bot.song import Song
 from bot.permissions import Permissions
+from bot.history import PlayHistory, HistoryWarmer
+from bot.library import LocalLibrary, track_display_title
+from bot.playlists import SavedPlaylists, normalize_name
+from bot.titleindex import TitleIndex
+from bot.ratelimit import AdmissionControl
+from bot.loopmonitor import LoopMonitor
+from bot.sharedcache import SharedCache, CachedSearchBackend
 from bot import songfetcher
+from bot import search
+from bot import log
 from bot import utils
 
+LIBRARY_PREFIX = "lib:"  # !play queries that start with this are looked up in the local library
+CHOICE_EMOJIS = ["%s\u20e3" % digit for digit in range(1, 10)] + ["\U0001f51f"]  # keycap 1-9 and keycap 10
+SEARCH_CHOICE_TIMEOUT = 30  # seconds
+DUPLICATE_POLICIES = ("allow", "reject", "merge")
+
 
 class MetalBot(discord.Client):
     """
     Represents a music bot's client connection that connects to Discord. This bot is capable of playing songs and
     playlists from YouTube by streaming them to a :class:`discord.VoiceClient`.
     """
-    def __init__(self, config):
+    def __init__(self, config, shard_id=None, shard_count=None):
         """
         :param config: The bot's config
         :type config: configparser.ConfigParser
+        :param shard_id: The shard this client connects as, None to connect without sharding
+        :type shard_id: int
+        :param shard_count: The total number of shards
+        :type shard_count: int
         """
         self.config = config
 
-        self.player = Player(update_listener=self.song_changed_handler,
-                             volume=self.config.getfloat("Preferences", "DefaultVolume"))
+        # the audio worker plays in a separate process, see audioworker.py
+        player_type = RemotePlayer if self.config.getboolean("Playback", "AudioWorker") else Player
+        self.player = player_type(update_listener=self.song_changed_handler,
+                                  volume=self.config.getfloat("Preferences", "DefaultVolume"),
+                                  max_resume_retries=self.config.getint("Playback", "MaxResumeRetries"),
+                                  resume_tolerance=self.config.getint("Playback", "ResumeTolerance"),
+                                  lookahead=self.config.getint("Playback", "LookaheadSongs"),
+                                  stall_timeout=self.config.getfloat("Playback", "StallTimeout"),
+                                  stall_grace=self.config.getfloat("Playback", "StallGrace"))
+        if not isinstance(self.player, RemotePlayer) and self.player.stall_timeout > 0:
+            # the audio worker watches its own player
+            PlayerWatchdog(self.player, interval=self.player.stall_timeout / 4).start()
         # sets including members who voted on some command
         self.voters = {
             "skip": set(),
@@ -52,19 +83,150 @@ class MetalBot(discord.Client):
             owner_id=self.config.get("Permissions", "OwnerID"),
             owner_role=self.config.get("Permissions", "OwnerRole")
         )
+        search.set_backend(search.create_backend(self.config.get("Preferences", "SearchBackend")))
+        resolver_backends = [name.strip() for name in self.config.get("Preferences", "ResolverBackends").split(",")
+                             if len(name.strip()) > 0]
+        self.player.set_resolver(resolver_backends,
+                                 hedge_percentile=self.config.getfloat("Preferences", "HedgePercentile"))
+        if self.config.get("Preferences", "DuplicatePolicy").lower() not in DUPLICATE_POLICIES:
+            raise ValueError("Unknown duplicate policy '%s', expected one of: %s" %
+                             (self.config.get("Preferences", "DuplicatePolicy"), ", ".join(DUPLICATE_POLICIES)))
         self.idle_playing_str = self.config["Preferences"]["CommandPrefix"] + "play"  # shown when nothing is playing
+        # limits how many songs users can make the bot resolve
+        self.admission = AdmissionControl({
+            "user": (self.config.getfloat("Limits", "UserRate"), self.config.getint("Limits", "UserBurst")),
+            "guild": (self.config.getfloat("Limits", "GuildRate"), self.config.getint("Limits", "GuildBurst")),
+            "global": (self.config.getfloat("Limits", "GlobalRate"), self.config.getint("Limits", "GlobalBurst"))
+        })
+
+        # titles of songs that were played, resolved or are in the library, so queries can be matched locally
+        self.title_index = TitleIndex()
+        self.search_stats = {
+            "local": 0,
+            "youtube": 0
+        }
+        songfetcher.cache.max_size = self.config.getint("History", "SongCacheSize")
+        songfetcher.cache.put_listener = self.index_song
+        self.shared_cache = None
+        if len(self.config.get("Sharding", "SharedCachePath")) > 0:
+            self.shared_cache = SharedCache(self.config.get("Sharding", "SharedCachePath"))
+            songfetcher.cache.shared = self.shared_cache
+            search.set_backend(CachedSearchBackend(search.get_backend(), self.shared_cache,
+                                                   max_age=self.config.getfloat("Sharding", "SearchCacheAge")))
+        self.history = None
+        self.history_warmer = None
+        if len(self.config.get("History", "HistoryPath")) > 0:
+            self.history = PlayHistory(self.config.get("History", "HistoryPath"))
+            if self.config.getint("History", "WarmTopSongs") > 0:
+                audio_dir = self.config.get("History", "AudioCachePath")
+                if shard_id is not None:  # every shard warms the songs of its own servers, and deletes the rest
+                    audio_dir = os.path.join(audio_dir, "shard%s" % shard_id)
+                self.history_warmer = HistoryWarmer(
+                    self.history,
+                    lambda: [server.id for server in list(self.servers)],
+                    top_count=self.config.getint("History", "WarmTopSongs"),
+                    interval=self.config.getint("History", "WarmInterval"),
+                    warm_audio=self.config.getboolean("History", "WarmAudio"),
+                    audio_dir=audio_dir,
+                    get_used_ids=self.get_used_video_ids
+                )
+
+        self.library = None
+        directories = [d.strip() for d in self.config.get("Library", "Directories").split(";") if len(d.strip()) > 0]
+        if len(directories) > 0:
+            self.library = LocalLibrary(directories, self.config.get("Library", "IndexPath"))
+
+        self.saved_playlists = None
+        if len(self.config.get("Playlists", "Path")) > 0:
+            self.saved_playlists = SavedPlaylists(self.config.get("Playlists", "Path"))
+
+        if shard_id is not None:
+            super().__init__(shard_id=shard_id, shard_count=shard_count)
+        else:
+            super().__init__()
+        Song.find_channel = self.get_channel  # songs only keep the IDs of their requesters and text channel
+        self._idle_handle = None  # suspends or disconnects the player while nobody listens, see check_idle
+        self.loop_monitor = None
+        if self.config.getboolean("Logging", "LoopMonitor"):
+            self.loop_monitor = LoopMonitor(self.loop, threshold=self.config.getfloat("Logging", "LoopBlockThreshold"))
+            self.loop_monitor.start()
+        Thread(target=self.warm_up, daemon=True).start()
+
+    def warm_up(self):
+        """
+        Prepares what the first song needs (OPUS or the audio worker, and the modules that resolve songs) in the
+        background while the bot connects to Discord.
+        """
+        try:
+            if isinstance(self.player, RemotePlayer):
+                self.player.start_worker()
+            else:
+                opus_loader.load_opus_lib(cache_path=opus_loader.CACHE_PATH)
+            songfetcher.preload()
+        except Exception as e:
+            log.error("Warm up failed", error=e)
+
+        if self.shared_cache is not None:
+            self.shared_cache.prune()
 
-        super().__init__()
+        if self.history is not None:
+            for video_id, title, length in self.history.songs():
+                self.title_index.add("yt:" + video_id, title, "https://www.youtube.com/watch?v=" + video_id)
+        if self.library is not None:
+            self.rescan_library()
+
+    def get_used_video_ids(self):
+        """
+        Returns the IDs of the videos that are playing or queued.
+
+        :rtype: list
+        """
+        songs = list(self.player.queue.queue)
+        if self.player.current_song is not None:
+            songs.append(self.player.current_song)
+        return [song.video_id for song in songs if song.video_id is not None]
+
+    def index_song(self, song):
+        """
+        Adds the title of a resolved YouTube song to the title index.
+
+        :param song: The song
+        :type song: Song
+        """
+        if song.video_id is not None:
+            self.title_index.add("yt:" + song.video_id, song.title, song.song_url)
+
+    def rescan_library(self):
+        """
+        Updates the local library with the files that were added, changed or removed since it was last scanned.
+
+        :return: The number of tracks added, changed, removed and failed to read, None if the scan failed
+        :rtype: dict
+        """
+        try:
+            stats = self.library.scan()
+        except Exception as e:
+            log.error("Scanning the library failed", error=e)
+            return None
+
+        paths = set()
+        for track in self.library.tracks():
+            paths.add(track.path)
+            self.title_index.add(LIBRARY_PREFIX + track.path, track_display_title(track), track)
+        for key in self.title_index.keys():
+            if key.startswith(LIBRARY_PREFIX) and key[len(LIBRARY_PREFIX):] not in paths:
+                self.title_index.remove(key)
+        log.info("Library scanned", tracks=len(self.library), **stats)
+        return stats
 
     async def on_ready(self):
         """
         Initial set up of the bot once it is connected to Discord.
         """
-        utils.safe_print('Logged in as')
-        utils.safe_print(self.user.name)
-        utils.safe_print(self.user.id)
-        utils.safe_print('------')
+        log.info("Logged in", user=self.user.name, id=self.user.id, guilds=len(self.servers), shard=self.shard_id)
         await self.set_listening_to(self.idle_playing_str)
+        if self.history_warmer is not None and self.history_warmer.ident is None:  # on_ready fires on reconnects too
+            self.history_warmer.start()
         await self.auto_summon(self.config["Permissions"]["OwnerID"])
 
     async def join_voice_channel(self, channel):
@@ -77,22 +239,106 @@ class MetalBot(discord.Client):
         :return: A voice client that is fully connected to the voice server.
         :rtype: discord.VoiceClient
         """
-        # make sure OPUS is loaded
-        if not discord.opus.is_loaded():
-            utils.safe_print("loading opus...")
-            opus_loader.load_opus_lib()
-
-        utils.safe_print("Joining voice channel %s" % channel)
+        log.info("Joining voice channel", guild=channel.server.id, channel=channel.name)
         voice = self.voice_client_in(channel.server)
-        if voice is None:
-            voice = await super().join_voice_channel(channel)
+        if voice is not None:
+            await voice.move_to(channel)
+        elif isinstance(self.player, RemotePlayer):  # the audio worker connects to voice and loads OPUS itself
+            voice = RemoteVoiceClient(self, channel, self.player)
+            await voice.connect()
         else:
-            voice = await voice.move_to(channel)
+            # make sure OPUS is loaded
+            if not discord.opus.is_loaded():
+                log.info("Loading OPUS")
+                opus_loader.load_opus_lib(cache_path=opus_loader.CACHE_PATH)
+            voice = await super().join_voice_channel(channel)
 
         self.player.voice_client = voice
-        self.player.ensure_playing()
+        self.player.set_stream_preferences(self.get_stream_bitrate(channel),
+                                           self.config.getboolean("Playback", "PreferOpus"))
+        self.loop.run_in_executor(None, self.player.ensure_playing)
+        self.check_idle(channel.server)
         return voice
 
+    async def on_voice_state_update(self, before, after):
+        """
+        Checks whether or not anyone listens to the bot whenever someone in its server joins, leaves or deafens.
+        """
+        voice = self.player.voice_client
+        if voice is not None and voice.server.id == after.server.id:
+            self.check_idle(after.server)
+
+    def check_idle(self, server):
+        """
+        Suspends the player once nobody listened to it for SuspendAfter seconds, and leaves the voice channel
+        IdleDisconnect seconds after that. A suspended song is resumed as soon as someone listens again.
+
+        :param server: The server the bot plays in
+        :type server: discord.Server
+        """
+        if self.get_listener_count(server) > 0:
+            if self._idle_handle is not None:
+                self._idle_handle.cancel()
+                self._idle_handle = None
+            if self.player.is_suspended() and self.player.can_play():
+                log.info("Someone is listening again, resuming", guild=server.id)
+                self.loop.run_in_executor(None, self.player.resume_suspended)
+        elif self._idle_handle is None and self.config.getfloat("Playback", "SuspendAfter") > 0:
+            self._idle_handle = self.loop.call_later(self.config.getfloat("Playback", "SuspendAfter"),
+                                                     self.suspend_idle, server)
+
+    def suspend_idle(self, server):
+        """
+        Suspends the player if nobody is listening to it, see :meth:`check_idle`.
+
+        :param server: The server the bot plays in
+        :type server: discord.Server
+        """
+        self._idle_handle = None
+        if self.get_listener_count(server) > 0:
+            return
+        self.loop.run_in_executor(None, self.player.suspend)
+        if self.config.getfloat("Playback", "IdleDisconnect") > 0:
+            self._idle_handle = self.loop.call_later(self.config.getfloat("Playback", "IdleDisconnect"),
+                                                     self.disconnect_idle, server)
+
+    def disconnect_idle(self, server):
+        """
+        Leaves the voice channel if nobody is listening to the bot, see :meth:`check_idle`. A suspended song stays
+        suspended until the bot is summoned again, and a paused song keeps the bot in the channel.
+
+        :param server: The server the bot plays in
+        :type server: discord.Server
+        """
+        self._idle_handle = None
+        voice = self.voice_client_in(server)
+        if voice is None or self.get_listener_count(server) > 0 or \
+                (self.player.is_playing() and not self.player.is_suspended()):
+            return
+        log.info("Leaving idle voice channel", guild=server.id, channel=voice.channel.name)
+        self.player.voice_client = None
+        self.loop.create_task(voice.disconnect())
+
+    def get_stream_bitrate(self, channel):
+        """
+        Returns the bitrate of the audio streams that are picked for songs played in a voice channel, see
+        :func:`songfetcher.set_stream_preferences`.
+
+        :param channel: The voice channel
+        :type channel: discord.Channel
+        :return: The bitrate in kbps, 0 for the best streams
+        :rtype: int
+        """
+        # both options were validated when the bot started, see run.py
+        guild_bitrates = utils.parse_guild_stream_bitrates(self.config.get("Playback", "GuildStreamBitrates"))
+        if channel.server.id in guild_bitrates:
+            return guild_bitrates[channel.server.id]
+
+        bitrate = utils.parse_stream_bitrate(self.config.get("Playback", "StreamBitrate"))
+        if bitrate is None:  # auto
+            return (getattr(channel, "bitrate", None) or 0) // 1000
+        return bitrate
+
     async def set_listening_to(self, title):
         """
         Sets the bot's presence to "listening to " + title. Removes presence if title is None.
@@ -131,7 +377,8 @@ class MetalBot(discord.Client):
         Immediately skips the current song
         """
         self.voters["skip"].clear()
-        self.player.play_next()
+        # the next song's stream may have to be resolved first, which shouldn't hold up the event loop
+        self.loop.run_in_executor(None, self.player.play_next)
 
     def song_changed_handler(self, song):
         """
@@ -145,9 +392,16 @@ class MetalBot(discord.Client):
             self.loop.create_task(self.set_listening_to(self.idle_playing_str))
             self.voters["clear"].clear()
         else:
+            voice = self.player.voice_client
+            if voice is not None:  # a song may start while nobody listens, like after it was added from a text channel
+                self.loop.call_soon_threadsafe(self.check_idle, voice.server)
+            if self.history is not None and None not in (song.video_id, song.requester_id, song.text_channel):
+                self.history.record(song.text_channel.server.id, song.video_id, song.requester_id, song.title,
+                                    song.length)
+
             playing_str = "**%s** is now playing!" % song.title
             if self.config.getboolean("Preferences", "MentionPlaying"):
-                playing_str = song.requester.mention + ", " + playing_str
+                playing_str = ", ".join(user.mention for user in song.requesters) + ", " + playing_str
 
             self.loop.create_task(
                 self.send_message(song.text_channel, playing_str)
@@ -253,6 +507,113 @@ class MetalBot(discord.Client):
             await self.send_message(text_channel, "%s, vote registered. %s more votes needed to clear." %
                                     (voter.mention, extra_skips_needed))
 
+    async def check_listening(self, msg):
+        """
+        Makes sure the author of a message is listening to a song that is currently playing, and reports an error to
+        the message's channel if they are not.
+
+        :param msg: The message of the user
+        :type msg: discord.Message
+        :return: Whether or not the author is listening
+        :rtype: bool
+        """
+        bot_voice = self.voice_client_in(msg.server)
+        if bot_voice is None or not self.player.is_playing():
+            await self.send_error(msg.channel, "Nothing is currently playing!")
+            return False
+
+        if msg.author.voice_channel is None or msg.author.voice_channel != bot_voice.channel:
+            await self.send_error(msg.channel, "Join **%s** to use this command" % bot_voice.channel.name)
+            return False
+
+        if utils.is_member_deafened(msg.author):
+            await self.send_error(msg.channel, "You cannot use this command while deafened.")
+            return False
+
+        return True
+
+    async def check_can_enqueue(self, msg):
+        """
+        Makes sure the author of a message can add songs to the queue, and reports an error to the message's channel
+        if they can't.
+
+        :param msg: The message of the user
+        :type msg: discord.Message
+        :return: Whether or not the author can add songs
+        :rtype: bool
+        """
+        if not self.is_voice_connected(msg.server):
+            await self.send_error(msg.channel, "You must summon me first!")
+            return False
+
+        if msg.author.voice_channel is None:
+            await self.send_error(msg.channel, "Please join a voice channel to use this command.")
+            return False
+
+        if utils.is_member_deafened(msg.author):
+            await self.send_error(msg.channel, "You cannot enqueue songs.")
+            return False
+
+        return True
+
+    def admit(self, original_msg, count, already_admitted=0):
+        """
+        Checks whether the author of a message may make the bot resolve songs now, and tells them to slow down if
+        they may not. See :class:`ratelimit.AdmissionControl`.
+
+        :param original_msg: The message that requests the songs
+        :type original_msg: discord.Message
+        :param count: The number of songs the message makes the bot resolve
+        :type count: int
+        :param already_admitted: The number of songs the message was already admitted for
+        :type already_admitted: int
+        :return: Whether or not the songs may be resolved
+        :rtype: bool
+        """
+        if count <= 0 and already_admitted == 0:
+            return True
+        wait = self.admission.admit(original_msg.author.id, original_msg.server.id, count, already_admitted)
+        if wait == 0:
+            return True
+
+        log.info("Throttled", guild=original_msg.server.id, user=original_msg.author.id, songs=count,
+                 retry_after="%.1f" % wait)
+        self.loop.create_task(
+            self.send_error(original_msg.channel, "Slow down! You can add more songs in %s seconds." %
+                            int(math.ceil(wait)))
+        )
+        return False
+
+    async def seek(self, timestamp, original_msg):
+        """
+        Seeks to a position in the song that is currently playing. Only the user who enqueued the song or the owner can
+        seek.
+
+        :param timestamp: The position to seek to, in SS, MM:SS or HH:MM:SS format
+        :type timestamp: str
+        :param original_msg: The message that caused this function to be called
+        :type original_msg: discord.Message
+        """
+        current_song = self.player.current_song
+        if original_msg.author != current_song.requester and not self.permissions.is_owner(original_msg.author):
+            await self.send_error(original_msg.channel, "Only the user who enqueued the song can seek in it.")
+            return
+
+        try:
+            position = utils.timestamp_to_seconds(timestamp)
+        except ValueError:
+            await self.send_error(original_msg.channel, "`%s` is not a valid timestamp" % timestamp)
+            return
+
+        if current_song.length > 0 and position >= current_song.length:
+            await self.send_error(original_msg.channel, "Position %s out of range: 00:00-%s" %
+                                  (utils.seconds_to_timestamp(position),
+                                   utils.seconds_to_timestamp(current_song.length)))
+            return
+
+        self.player.seek(position)
+        await self.send_message(original_msg.channel, "Seeked to %s" % utils.seconds_to_timestamp(position))
+
     def add_youtube_to_queue(self, url, original_msg):
         """
         Adds a video from YouTube to the play queue.
@@ -263,22 +624,42 @@ class MetalBot(discord.Client):
         :type original_msg: discord.Message
         """
 
+        if not self.check_duplicate(utils.get_video_id(url), original_msg):
+            return False
+
         newsong = None
         try:
             newsong = songfetcher.get_youtube_song(url)
         except ValueError as e:
-            utils.safe_print(("got ValueError with input '%s' Error: %s" % (url, e)))
+            log.warning("Could not resolve video", guild=original_msg.server.id, input=url, error=e)
             self.loop.create_task(
                 self.send_error(original_msg.channel, "Value Error:\n```%s```\nInput: `%s`" % (e, url))
             )
-            traceback.print_stack()
             return False
         except OSError as e:
-            utils.safe_print(("got OSError with input '%s' Error: %s" % (url, e)))
+            log.warning("Could not resolve video", guild=original_msg.server.id, input=url, error=e)
             self.loop.create_task(
                 self.send_error(original_msg.channel, "OS Error:\n```%s```\nInput: `%s`" % (e, url))
             )
-            traceback.print_stack()
+            return False
+
+        return self.enqueue_song(newsong, original_msg)
+
+    def enqueue_song(self, newsong, original_msg, notify=True):
+        """
+        Adds a resolved song to the play queue on behalf of the author of a message, if it is not longer than the
+        limit.
+
+        :param newsong: The song to add
+        :type newsong: Song
+        :param original_msg: The message that caused this function to be called
+        :type original_msg: discord.Message
+        :param notify: Whether or not to tell the author of the message what happened
+        :type notify: bool
+        :return: Whether or not the song was added
+        :rtype: bool
+        """
+        if not self.check_duplicate(newsong.video_id, original_msg, notify):
             return False
 
         newsong.requester = original_msg.author
@@ -286,6 +667,8 @@ class MetalBot(discord.Client):
 
         max_length = self.config.getint("Preferences", "MaxSongLength")
         if newsong.length > max_length > 0:
+            if not notify:
+                return False
             self.loop.create_task(
                 self.send_error(original_msg.channel, "Song too long! (%s, limit is %s)" % (
                     utils.seconds_to_timestamp(newsong.length),
@@ -297,16 +680,54 @@ class MetalBot(discord.Client):
         estimated_time = self.player.calc_queue_time()
         self.player.add_to_queue(newsong)
 
-        if estimated_time > 0:
+        if estimated_time > 0 and notify:
             self.loop.create_task(
                 self.send_message(original_msg.channel, "Enqueued **%s**, ETA: %s" %
                                   (newsong.title, utils.seconds_to_timestamp(estimated_time)))
             )
         return True
 
+    def check_duplicate(self, video_id, original_msg, notify=True):
+        """
+        Applies the duplicate policy from the bot's config to a video that is about to be added to the queue. If the
+        video is already queued, it is either allowed anyway, rejected, or the author of the message is added as one of
+        the requesters of the queued song.
+
+        :param video_id: The ID of the video, None if it is unknown
+        :type video_id: str
+        :param original_msg: The message that caused this function to be called
+        :type original_msg: discord.Message
+        :param notify: Whether or not to tell the author of the message what happened
+        :type notify: bool
+        :return: Whether or not the video should be added to the queue
+        :rtype: bool
+        """
+        policy = self.config.get("Preferences", "DuplicatePolicy").lower()
+        if policy == "allow" or video_id is None:
+            return True
+
+        duplicate = self.player.queue.find(video_id)
+        if duplicate is None:
+            return True
+
+        if policy == "merge":
+            duplicate.add_requester(original_msg.author)
+            if notify:
+                self.loop.create_task(
+                    self.send_message(original_msg.channel, "**%s** is already in the queue, you were added as one of "
+                                                            "its requesters." % duplicate.title)
+                )
+        elif notify:
+            self.loop.create_task(
+                self.send_error(original_msg.channel, "**%s** is already in the queue." % duplicate.title)
+            )
+        return False
+
     def add_ytsearch_to_queue(self, term, original_msg):
         """
-        Searches YouTube for the term given and adds the first video found to the player queue
+        Searches YouTube for the term given and adds the first video found to the player queue. If the term is very
+        similar to the title of a song that was played before or is in the library, that song is added instead without
+        searching.
 
         :param term: The search term
         :type term: str
@@ -316,9 +737,16 @@ class MetalBot(discord.Client):
         :rtype: bool
         """
 
-        urls = utils.search_youtube(term)
-        if len(urls) > 0:
-            self.add_youtube_to_queue(urls[0], original_msg)
+        match = self.match_title(term)
+        if match is not None:
+            if isinstance(match, Song):
+                return self.enqueue_song(match, original_msg)
+            return self.add_youtube_to_queue(match, original_msg)
+
+        self.search_stats["youtube"] += 1
+        results = search.search_youtube(term, limit=1)
+        if len(results) > 0:
+            self.add_youtube_to_queue(results[0].url, original_msg)
             return True
         else:
             self.loop.create_task(
@@ -326,20 +754,338 @@ class MetalBot(discord.Client):
             )
             return False
 
+    def match_title(self, term):
+        """
+        Looks for a song that was played before or is in the library whose title is very similar to a search term.
+
+        :param term: The search term
+        :type term: str
+        :return: The song if it is from the library, the URL of the video if it is from YouTube, None if nothing is
+            similar enough
+        """
+        threshold = self.config.getfloat("Preferences", "LocalMatchThreshold")
+        if threshold <= 0:
+            return None
+        matches = self.title_index.query(term, threshold, limit=1)
+        if len(matches) == 0:
+            return None
+
+        score, key, title, value = matches[0]
+        log.info("Matched query locally", query=term, title=title, similarity="%.2f" % score)
+        self.search_stats["local"] += 1
+        if key.startswith(LIBRARY_PREFIX):
+            return LocalLibrary.to_song(value)
+        return value
+
+    def resolve_request(self, request):
+        """
+        Resolves a single request of the play command to a song: a YouTube URL, a library query (lib:<query>) or a
+        search term.
+
+        :param request: The request
+        :type request: str
+        :return: The song
+        :rtype: Song
+        :raises ValueError: If nothing was found for the request
+        """
+        if request.lower().startswith(LIBRARY_PREFIX):
+            if self.library is None:
+                raise ValueError("No local library is configured")
+            tracks = self.library.search(request[len(LIBRARY_PREFIX):].strip(), limit=1)
+            if len(tracks) == 0:
+                raise ValueError("No results in the library")
+            return LocalLibrary.to_song(tracks[0])
+        if "youtube.com/watch" in request or "youtu.be/" in request:
+            return songfetcher.get_youtube_song(request)
+        if "youtube.com/playlist" in request:
+            raise ValueError("Playlists can only be played on their own")
+
+        match = self.match_title(request)
+        if isinstance(match, Song):
+            return match
+        elif match is not None:
+            return songfetcher.get_youtube_song(match)
+
+        self.search_stats["youtube"] += 1
+        results = search.search_youtube(request, limit=1)
+        if len(results) == 0:
+            raise ValueError("No results")
+        return songfetcher.get_youtube_song(results[0].url)
+
+    async def add_batch_to_queue(self, requests, original_msg):
+        """
+        Resolves several requests of the play command at the same time and adds the songs to the play queue in the
+        order they were requested in. The author of the message is told what happened in a single message.
+
+        :param requests: The requests, see :meth:`resolve_request`
+        :type requests: list
+        :param original_msg: The message that caused this function to be called
+        :type original_msg: discord.Message
+        """
+        max_count = self.config.getint("Preferences", "MaxPlaylistLength")
+        ignored_count = 0
+        if len(requests) > max_count > 0:
+            ignored_count = len(requests) - max_count
+            requests = requests[:max_count]
+        if not self.admit(original_msg, len([request for request in requests
+                                             if not request.lower().startswith(LIBRARY_PREFIX)])):
+            return
+
+        # videos that are already queued are skipped before they are resolved
+        skipped = [request for request in requests
+                   if not self.check_duplicate(utils.get_video_id(request), original_msg, notify=False)]
+        requests = [request for request in requests if request not in skipped]
+        results = await asyncio.gather(*[self.loop.run_in_executor(None, self.resolve_request, request)
+                                         for request in requests], loop=self.loop, return_exceptions=True)
+
+        added = []
+        failed = []
+        for request, result in zip(requests, results):
+            if isinstance(result, Exception):
+                log.warning("Could not resolve request", guild=original_msg.server.id, input=request, error=result)
+                failed.append("`%s`: %s" % (request, result))
+            elif self.enqueue_song(result, original_msg, notify=False):
+                added.append(result)
+            else:
+                skipped.append(request)
+
+        summary = "Added %s songs to the queue for a total play time of %s." % \
+                  (len(added), utils.seconds_to_timestamp(sum(song.length for song in added)))
+        if len(skipped) > 0:
+            summary += "\n%s songs were already in the queue or too long." % len(skipped)
+        if ignored_count > 0:
+            summary += "\n%s songs were over the limit and were ignored." % ignored_count
+        if len(failed) > 0:
+            summary += "\nCould not add:\n" + "\n".join(failed)
+        await self.send_message(original_msg.channel, summary)
+
+    def add_library_to_queue(self, query, original_msg):
+        """
+        Looks the query given up in the local library and adds the best matching track to the play queue.
+
+        :param query: The search query
+        :type query: str
+        :param original_msg: The message that caused this function to be called
+        :type original_msg: discord.Message
+        :return: Whether or not a song was added
+        :rtype: bool
+        """
+        if self.library is None:
+            self.loop.create_task(self.send_error(original_msg.channel, "No local library is configured."))
+            return False
+
+        tracks = self.library.search(query, limit=1)
+        if len(tracks) == 0:
+            self.loop.create_task(
+                self.send_error(original_msg.channel, "No results in the library for: `%s`" % query)
+            )
+            return False
+        return self.enqueue_song(LocalLibrary.to_song(tracks[0]), original_msg)
+
+    def get_playlist_owner(self, msg):
+        """
+        Returns the ID of the owner of the saved playlists a message refers to: its server or its author, depending on
+        the bot's config.
+
+        :param msg: The message
+        :type msg: discord.Message
+        :rtype: str
+        """
+        if self.config.get("Playlists", "Scope").lower() == "user":
+            return msg.author.id
+        return msg.server.id
+
+    def add_saved_playlist_to_queue(self, name, original_msg):
+        """
+        Adds the songs of a saved playlist to the play queue. Nothing is resolved: the songs are built from the saved
+        details, and the player resolves their streams as they get closer to playing.
+
+        :param name: The name of the playlist
+        :type name: str
+        :param original_msg: The message that caused this function to be called
+        :type original_msg: discord.Message
+        :return: Whether or not songs were added
+        :rtype: bool
+        """
+        songs = self.saved_playlists.load(self.get_playlist_owner(original_msg), name)
+        if len(songs) == 0:
+            self.loop.create_task(self.send_error(original_msg.channel, "There is no saved playlist named `%s`" % name))
+            return False
+
+        max_count = self.config.getint("Preferences", "MaxPlaylistLength")
+        if len(songs) > max_count > 0:
+            songs = songs[:max_count]
+        if not self.admit(original_msg, len([song for song in songs if song.video_id is not None])):
+            return False
+
+        total_time = 0
+        added_count = 0
+        duplicate_count = 0
+        seen_ids = set()
+        for song in songs:
+            if song.video_id is not None:
+                if song.video_id in seen_ids or not self.check_duplicate(song.video_id, original_msg, notify=False):
+                    duplicate_count += 1
+                    continue
+                if self.config.get("Preferences", "DuplicatePolicy").lower() != "allow":
+                    seen_ids.add(song.video_id)
+            song.requester = original_msg.author
+            song.text_channel = original_msg.channel
+            self.player.add_to_queue(song)
+            total_time += song.length
+            added_count += 1
+
+        duplicates_str = ""
+        if duplicate_count > 0:
+            duplicates_str = " %s songs were already in the queue." % duplicate_count
+        self.loop.create_task(
+            self.send_message(original_msg.channel,
+                              "Loaded **%s**: added %s songs to the queue for a total play time of %s.%s" %
+                              (name, added_count, utils.seconds_to_timestamp(total_time), duplicates_str))
+        )
+        return True
+
+    def get_library_embed(self, query):
+        """
+        Builds and returns a rich-embed with the library tracks matching a query, or with the size of the library if
+        no query is given.
+
+        :param query: The search query, may be empty
+        :type query: str
+        :return: A :class:`discord.Embed` with the matching tracks
+        :rtype: discord.Embed
+        """
+        prefix = self.config["Preferences"]["CommandPrefix"]
+        if len(query) == 0:
+            return discord.Embed(
+                title="Library",
+                description="%s tracks. Play one with %splay %s<query>" % (len(self.library), prefix, LIBRARY_PREFIX)
+            )
+
+        tracks = self.library.search(query, limit=11)
+        if len(tracks) == 0:
+            return discord.Embed(title="No results in the library for `%s`" % query)
+        tracks_str = ""
+        for index, track in enumerate(tracks[:10], 1):
+            tracks_str += "%s. **%s** (%s)\n" % (index, track_display_title(track),
+                                                 utils.seconds_to_timestamp(track.length))
+        if len(tracks) > 10:
+            tracks_str += "And more..."
+        return discord.Embed(title="Library results for `%s`" % query, description=tracks_str)
+
+    async def choose_search_result(self, term, original_msg):
+        """
+        Searches YouTube for the term given and lets the author of the message choose which of the top results to add
+        to the queue, either by replying with its number or by reacting. All of the results are resolved while the user
+        chooses, so the chosen song is enqueued right away.
+
+        :param term: The search term
+        :type term: str
+        :param original_msg: The message that caused this function to be called
+        :type original_msg: discord.Message
+        :return: Whether or not a song was added
+        :rtype: bool
+        """
+        count = min(max(self.config.getint("Preferences", "SearchResultCount"), 1), len(CHOICE_EMOJIS))
+        results = await self.loop.run_in_executor(None, search.search_youtube, term, count)
+        if len(results) == 0:
+            await self.send_error(original_msg.channel, "No results for search term: `%s`" % term)
+            return False
+
+        # start resolving all of the results while the user chooses
+        resolutions = [self.loop.run_in_executor(None, songfetcher.get_youtube_song, result.url)
+                       for result in results]
+
+        choices_str = ""
+        for index, result in enumerate(results, 1):
+            choices_str += "%s. **%s** (%s)\n" % (index, result.title, utils.seconds_to_timestamp(result.length))
+        em = discord.Embed(title="Search results for `%s`" % term, description=choices_str)
+        em.set_footer(text="Reply with a number or react to choose. This expires in %s seconds." %
+                           SEARCH_CHOICE_TIMEOUT)
+        choices_msg = await self.send_message(original_msg.channel, embed=em)
+        emojis = CHOICE_EMOJIS[:len(results)]
+        reactions_task = self.loop.create_task(self.add_reactions(choices_msg, emojis))
+
+        def is_choice(msg):
+            return msg.content.strip().isdigit() and 1 <= int(msg.content.strip()) <= len(results)
+
+        waiters = [
+            self.loop.create_task(self.wait_for_reaction(emojis, user=original_msg.author, message=choices_msg,
+                                                         timeout=SEARCH_CHOICE_TIMEOUT)),
+            self.loop.create_task(self.wait_for_message(timeout=SEARCH_CHOICE_TIMEOUT, author=original_msg.author,
+                                                        channel=original_msg.channel, check=is_choice))
+        ]
+        done, pending = await asyncio.wait(waiters, loop=self.loop, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        reactions_task.cancel()
+
+        choice = None
+        for task in done:
+            answer = task.result()
+            if answer is None:  # timed out
+                continue
+            elif isinstance(answer, discord.Message):
+                choice = int(answer.content.strip()) - 1
+            else:
+                choice = emojis.index(answer.reaction.emoji)
+
+        for index, resolution in enumerate(resolutions):
+            if index != choice:
+                resolution.cancel()
+                # results that were resolved already are never awaited, so their errors are retrieved to be dropped
+                resolution.add_done_callback(lambda future: future.cancelled() or future.exception())
+        await self.delete_message(choices_msg)
+
+        if choice is None:
+            await self.send_error(original_msg.channel, "No result was chosen for search term: `%s`" % term)
+            return False
+
+        try:
+            newsong = await resolutions[choice]
+        except (ValueError, OSError) as e:
+            log.warning("Could not resolve video", guild=original_msg.server.id, input=results[choice].url, error=e)
+            await self.send_error(original_msg.channel, "%s:\n```%s```\nInput: `%s`" %
+                                  (type(e).__name__, e, results[choice].url))
+            return False
+
+        return self.enqueue_song(newsong, original_msg)
+
+    async def add_reactions(self, message, emojis):
+        """
+        Reacts to a message with each of the emojis given, in order.
+
+        :param message: The message to react to
+        :type message: discord.Message
+        :param emojis: The emojis to react with
+        :type emojis: list
+        """
+        for emoji in emojis:
+            await self.add_reaction(message, emoji)
+
     def add_ytplaylist_to_queue(self, playlist_url, original_msg):
         """
         Adds videos from a YouTube playlist to the play queue. The playlist can be limited via the bot's config.
 
+        The limits are checked with the details listed in the playlist first, and only then are streams resolved, for
+        the songs that will be queued. Even those are only resolved if they are about to play; the rest are resolved by
+        the player as they get closer to playing.
+
         :param playlist_url: URL of the playlist
         :type playlist_url: str
         :param original_msg: The message that caused this function to be called
         :type original_msg: discord.Message
         """
 
-        playlist_dict = songfetcher.get_ytplaylist_pafys(playlist_url)
-        song_count = len(playlist_dict)
+        entries = songfetcher.get_ytplaylist_entries(playlist_url)
+        song_count = len(entries)
+        max_count = self.config.getint("Preferences", "MaxPlaylistLength")
+        # the play command admitted a single song before the playlist was listed
+        if not self.admit(original_msg, min(song_count, max_count) if max_count > 0 else song_count,
+                          already_admitted=1):
+            return False
 
-        if song_count > self.config.getint("Preferences", "MaxPlaylistLength") > 0:
+        if song_count > max_count > 0:
             self.loop.create_task(
                 self.send_message(
                     original_msg.channel, "Playlist is longer than the limit. Processing %s/%s songs..." %
@@ -353,31 +1099,51 @@ class MetalBot(discord.Client):
         self.loop.create_task(
             self.send_typing(original_msg.channel)
         )
+        # first phase: filter the songs with the details listed in the playlist
+        max_length = self.config.getint("Preferences", "MaxSongLength")
         songs = []
-        for element in playlist_dict:
-            video = element['pafy']
-            utils.safe_print(("processing " + str(video.title)))
-            song = songfetcher.get_pafy_song(video)
-            if song is not None and song.length > 0:
-                if self.config.getint("Preferences", "MaxSongLength") <= 0 or\
-                        song.length < self.config.getint("Preferences", "MaxSongLength"):
-                    songs.append(song)
-
-            if len(songs) >= self.config.getint("Preferences", "MaxPlaylistLength") > 0:
+        seen_ids = set()
+        duplicate_count = 0
+        for entry in entries:
+            if entry.length <= 0 or 0 < max_length <= entry.length:
+                continue
+            if entry.video_id in seen_ids or not self.check_duplicate(entry.video_id, original_msg, notify=False):
+                duplicate_count += 1
+                continue
+            if self.config.get("Preferences", "DuplicatePolicy").lower() != "allow":
+                seen_ids.add(entry.video_id)
+
+            songs.append(songfetcher.get_unresolved_song(entry))
+            if len(songs) >= max_count > 0:
                 break
 
+        # second phase: resolve the streams of the songs that will play soon
+        resolve_count = max(self.player.lookahead - self.player.queue.qsize(), 1)
         total_time = 0
-
-        for song in songs:
+        added_count = 0
+        for index, song in enumerate(songs):
+            if index < resolve_count:
+                log.debug("Processing playlist item", guild=original_msg.server.id, title=song.title,
+                          video=song.video_id)
+                try:
+                    Player.resolve_stream(song)
+                except (ValueError, OSError) as e:
+                    log.warning("Could not resolve playlist item", guild=original_msg.server.id, video=song.video_id,
+                                error=e)
+                    continue
             song.requester = original_msg.author
             song.text_channel = original_msg.channel
             self.player.add_to_queue(song)
             total_time += song.length
+            added_count += 1
 
+        duplicates_str = ""
+        if duplicate_count > 0:
+            duplicates_str = " %s songs were already in the queue." % duplicate_count
         self.loop.create_task(
             self.send_message(original_msg.channel,
-                              "Successfully added %s songs to the queue for a total play time of %s." %
-                              (len(songs), utils.seconds_to_timestamp(total_time)))
+                              "Successfully added %s songs to the queue for a total play time of %s.%s" %
+                              (added_count, utils.seconds_to_timestamp(total_time), duplicates_str))
         )
 
         return True
@@ -399,7 +1165,8 @@ class MetalBot(discord.Client):
             queue_str = ""
             index = 1
             for song in list(self.player.queue.queue):
-                queue_str += "%s. **%s** by %s\n" % (index, song.title, song.requester.mention)
+                queue_str += "%s. **%s** by %s\n" % (index, song.title,
+                                                      ", ".join(user.mention for user in song.requesters))
                 if index >= 15:
                     queue_str += "And %s more..." % (self.player.queue.qsize() - index)
                     break
@@ -425,12 +1192,15 @@ class MetalBot(discord.Client):
             description="Queue something with %splay" % self.config["Preferences"]["CommandPrefix"]
         )
         if current_song is not None:
+            elapsed = current_song.elapsed()
+            progress = elapsed / current_song.length if current_song.length > 0 else 0
             em = discord.Embed(
                 title=current_song.title,
-                description="by %s \n%s\n[%s/%s]\n%s" %
+                description="by %s %s\n%s\n[%s/%s]\n%s" %
                             (current_song.requester.mention,
-                             utils.progress_bar(current_song.elapsed() / current_song.length),
-                             utils.seconds_to_timestamp(current_song.elapsed()),
+                             "(paused)" if current_song.is_paused() else "",
+                             utils.progress_bar(progress),
+                             utils.seconds_to_timestamp(elapsed),
                              utils.seconds_to_timestamp(current_song.length),
                              current_song.song_url
                              )
@@ -440,6 +1210,77 @@ class MetalBot(discord.Client):
 
         return em
 
+    def get_stats_embed(self):
+        """
+        Builds and returns a rich-embed with playback statistics
+
+        :return: A :class:`discord.Embed` with playback statistics
+        :rtype: discord.Embed
+        """
+        recovery = self.player.recovery_stats
+        average_recovery = 0.0
+        if recovery["recovered"] > 0:
+            average_recovery = recovery["total_recovery_time"] / recovery["recovered"]
+
+        em = discord.Embed(title="Statistics")
+        em.add_field(
+            name="Stream recovery",
+            value="%s interrupted, %s recovered, %s failed\nRecovery time: %.2fs average, %.2fs last" %
+                  (recovery["interrupted"], recovery["recovered"], recovery["failed"], average_recovery,
+                   recovery["last_recovery_time"]),
+            inline=False
+        )
+        streams = songfetcher.stream_stats
+        streams_str = "%s songs played, about %.1f MB downloaded" % \
+                      (self.player.stream_stats["songs"], self.player.stream_stats["bytes"] / 1024 / 1024)
+        if streams["selected"] > 0:
+            streams_str += "\n%s streams picked (%s Opus), %s kbps on average instead of %s kbps" % \
+                           (streams["selected"], streams["opus"], streams["selected_bitrate"] // streams["selected"],
+                            streams["best_bitrate"] // streams["selected"])
+        em.add_field(name="Streams", value=streams_str, inline=False)
+        stalls = self.player.stall_stats
+        average_stall_recovery = 0.0
+        if stalls["stalled"] > 0:
+            average_stall_recovery = stalls["total_recovery_time"] / stalls["stalled"]
+        em.add_field(
+            name="Stalled playback",
+            value="%s stalled\nRecovery time: %.2fs average, %.2fs last" %
+                  (stalls["stalled"], average_stall_recovery, stalls["last_recovery_time"]),
+            inline=False
+        )
+        suspends = self.player.suspend_stats
+        suspends_str = "%s times suspended, %s resumed, %.0fs suspended" % \
+                       (suspends["suspended"], suspends["resumed"], suspends["suspended_time"])
+        if suspends["streaming_time"] > 0:  # ffmpeg's CPU time can't be measured everywhere
+            suspends_str += "\nAbout %.1f ffmpeg CPU-seconds saved (estimated)" % suspends["cpu_seconds_saved"]
+        em.add_field(name="Suspended playback", value=suspends_str, inline=False)
+        cache = songfetcher.cache
+        cache_str = "%s songs, %s hits, %s misses" % (len(cache), cache.hits, cache.misses)
+        if self.shared_cache is not None:
+            cache_str += "\nShared: %s hits in songs, %s hits overall, %s misses" % \
+                         (cache.shared_hits, self.shared_cache.stats["hits"], self.shared_cache.stats["misses"])
+        if self.history_warmer is not None:
+            cache_str += "\nMost played songs: %(resolved)s resolved, %(downloaded)s downloaded, %(failed)s failed" % \
+                         self.history_warmer.stats
+        em.add_field(name="Song cache", value=cache_str, inline=False)
+        em.add_field(name="Lookups", value=str(songfetcher.resolver), inline=False)
+        em.add_field(name="Coalesced requests", value="Resolves: %s\nSearches: %s" %
+                                                    (songfetcher.resolves, search.searches), inline=False)
+        throttled = self.admission.throttled
+        em.add_field(name="Admission", value="%s requests admitted, throttled by user: %s, guild: %s, global: %s" %
+                                             (self.admission.admitted, throttled["user"], throttled["guild"],
+                                              throttled["global"]), inline=False)
+        em.add_field(name="Log", value="%(written)s messages written, %(dropped)s dropped" % log.stats, inline=False)
+        if self.loop_monitor is not None:
+            em.add_field(name="Event loop", value=str(self.loop_monitor), inline=False)
+        em.add_field(name="Searches", value="%s matched locally (%s titles), %s searched on YouTube" %
+                                            (self.search_stats["local"], len(self.title_index),
+                                             self.search_stats["youtube"]), inline=False)
+        for name, stats in (("Frame timing (current song)", self.player.song_frame_stats),
+                            ("Frame timing (previous songs)", self.player.frame_stats)):
+            em.add_field(name=name, value="%s\n%s" % (stats, stats.histogram_str() or "No frames sent"), inline=False)
+        return em
+
     async def change_volume(self, new_volume, original_msg):
         """
         Changes the player's volume.
@@ -524,7 +1365,7 @@ class MetalBot(discord.Client):
                 return
 
             await self.send_message(msg.channel, "Shutting down...")
-            utils.safe_print("Shutting down...")
+            log.info("Shutting down")
 
             for voice in list(self.voice_clients):
                 await voice.disconnect()
@@ -567,6 +1408,33 @@ class MetalBot(discord.Client):
 
             await self.skip_song_democratic(msg.author, msg.server, msg.channel)
 
+        elif lower_command == "pause":
+            if not await self.check_listening(msg):
+                return
+            if self.player.pause():
+                await self.send_message(msg.channel, "Paused. Use %sresume to continue." %
+                                        self.config["Preferences"]["CommandPrefix"])
+            else:
+                await self.send_error(msg.channel, "Already paused!")
+
+        elif lower_command == "resume":
+            if not await self.check_listening(msg):
+                return
+            if await self.loop.run_in_executor(None, self.player.resume):  # a suspended song may be resolved again
+                await self.send_message(msg.channel, "Resumed.")
+            else:
+                await self.send_error(msg.channel, "Not paused!")
+
+        elif lower_command.startswith("seek"):
+            arg = command[len("seek") + 1:]
+            if len(arg) == 0:  # no argument given
+                await self.send_error(msg.channel, "Usage: %sseek <[HH:]MM:SS>" %
+                                      self.config["Preferences"]["CommandPrefix"])
+                return
+            if not await self.check_listening(msg):
+                return
+            await self.seek(arg, msg)
+
         elif command == "clear":
             bot_voice = self.voice_client_in(msg.server)
             if bot_voice is None:
@@ -591,6 +1459,12 @@ class MetalBot(discord.Client):
                 return
             await self.send_message(msg.channel, "Cleared %s songs." % self.player.clear_queue())
 
+        elif lower_command == "stats":
+            if not self.permissions.is_owner(msg.author):
+                await self.send_error(msg.channel, "You lack permission to use this command.")
+                return
+            await self.send_message(msg.channel, embed=self.get_stats_embed())
+
         elif lower_command == "queue":
             await self.send_message(msg.channel, embed=self.get_queue_embed())
 
@@ -601,18 +1475,84 @@ class MetalBot(discord.Client):
             self.player.shuffle_queue()
             await self.send_message(msg.channel, ":clubs: :diamonds: Queue shuffled! :spades: :hearts:")
 
-        elif lower_command.startswith("play"):
+        elif lower_command.startswith("search"):
+            if not await self.check_can_enqueue(msg):
+                return
 
-            if not self.is_voice_connected(msg.server):
-                await self.send_error(msg.channel, "You must summon me first!")
+            arg = command[len("search") + 1:]
+            if len(arg) == 0:  # no argument given
+                await self.send_error(msg.channel, "Usage: %ssearch <query>" %
+                                      self.config["Preferences"]["CommandPrefix"])
                 return
 
-            if msg.author.voice_channel is None:
-                await self.send_error(msg.channel, "Please join a voice channel to use this command.")
+            if not self.admit(msg, min(max(self.config.getint("Preferences", "SearchResultCount"), 1),
+                                       len(CHOICE_EMOJIS))):
                 return
+            await self.send_typing(msg.channel)
+            await self.choose_search_result(arg, msg)
 
-            if utils.is_member_deafened(msg.author):
-                await self.send_error(msg.channel, "You cannot enqueue songs.")
+        elif lower_command.startswith("library"):
+            if self.library is None:
+                await self.send_error(msg.channel, "No local library is configured.")
+                return
+
+            arg = command[len("library") + 1:].strip()
+            if arg.lower() == "rescan":
+                if not self.permissions.is_owner(msg.author):
+                    await self.send_error(msg.channel, "You lack permission to use this command.")
+                    return
+                await self.send_typing(msg.channel)
+                stats = await self.loop.run_in_executor(None, self.rescan_library)
+                if stats is None:
+                    await self.send_error(msg.channel, "Scanning the library failed.")
+                else:
+                    await self.send_message(msg.channel, "Library scanned: %s tracks, %s added, %s changed, %s "
+                                                         "removed." % (len(self.library), stats["added"],
+                                                                       stats["changed"], stats["removed"]))
+                return
+
+            await self.send_message(msg.channel, embed=await self.loop.run_in_executor(None, self.get_library_embed,
+                                                                                        arg))
+
+        elif lower_command.startswith("save") or lower_command.startswith("load") or lower_command == "playlists":
+            if self.saved_playlists is None:
+                await self.send_error(msg.channel, "Saving playlists is disabled.")
+                return
+
+            if lower_command == "playlists":
+                playlists = self.saved_playlists.names(self.get_playlist_owner(msg))
+                await self.send_message(msg.channel, embed=discord.Embed(
+                    title="Saved playlists",
+                    description="\n".join("**%s** (%s songs)" % (name, count) for name, count in playlists) or
+                                "No playlists were saved yet."
+                ))
+                return
+
+            name = normalize_name(command[len("save") + 1:])
+            if len(name) == 0:
+                await self.send_error(msg.channel, "Usage: %s%s <name>" %
+                                      (self.config["Preferences"]["CommandPrefix"], lower_command[:len("save")]))
+                return
+
+            if lower_command.startswith("save"):
+                songs = list(self.player.queue.queue)
+                if self.player.current_song is not None:
+                    songs.insert(0, self.player.current_song)
+                if len(songs) == 0:
+                    await self.send_error(msg.channel, "The queue is empty, there is nothing to save.")
+                    return
+                saved_count = await self.loop.run_in_executor(None, self.saved_playlists.save,
+                                                              self.get_playlist_owner(msg), name, songs)
+                await self.send_message(msg.channel, "Saved %s songs as **%s**. Use %sload %s to play them again." %
+                                        (saved_count, name, self.config["Preferences"]["CommandPrefix"], name))
+                return
+
+            if not await self.check_can_enqueue(msg):
+                return
+            Thread(target=self.add_saved_playlist_to_queue, args=(name, msg)).start()
+
+        elif lower_command.startswith("play"):
+            if not await self.check_can_enqueue(msg):
                 return
 
             arg = command[len("play") + 1:]
@@ -623,9 +1563,20 @@ class MetalBot(discord.Client):
 
             await self.send_typing(msg.channel)
 
+            requests = utils.split_play_requests(arg)
+            if len(requests) > 1:
+                await self.add_batch_to_queue(requests, msg)
+                return
+            # playlists are admitted for a single song here, and for the rest of their songs once they are listed
+            if not arg.lower().startswith(LIBRARY_PREFIX) and not self.admit(msg, 1):
+                return
+
             download_thread_target = None
 
-            if "youtube.com/watch" in arg or "youtu.be/" in arg:
+            if arg.lower().startswith(LIBRARY_PREFIX):
+                arg = arg[len(LIBRARY_PREFIX):].strip()
+                download_thread_target = self.add_library_to_queue
+            elif "youtube.com/watch" in arg or "youtu.be/" in arg:
                 download_thread_target = self.add_youtube_to_queue
             elif "youtube.com/playlist" in arg:
                 download_thread_target = self.add_ytplaylist_to_queue
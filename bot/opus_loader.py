@@ -22,20 +22,49 @@
 # THE SOFTWARE.
 #
 
+import ctypes.util
+import os
 from discord import opus
 
 OPUS_LIBS = ['libopus-0.x86.dll', 'libopus-0.x64.dll', 'libopus-0.dll', 'libopus.so.0', 'libopus.0.dylib']
+CACHE_PATH = 'config/opus_lib.cache'
 
 
-def load_opus_lib(opus_libs=OPUS_LIBS):
+def load_opus_lib(opus_libs=OPUS_LIBS, cache_path=None):
+    """
+    Loads the first opus lib that can be loaded. If none of the libs given can be loaded, the system's library search
+    is used. When a cache path is given, the lib that was loaded is remembered in it and tried first next time, so
+    the search only runs once.
+    """
     if opus.is_loaded():
         return True
 
-    for opus_lib in opus_libs:
+    candidates = list(opus_libs)
+    if cache_path is not None and os.path.isfile(cache_path):
+        with open(cache_path) as cache:
+            candidates.insert(0, cache.read().strip())
+
+    for opus_lib in candidates:
+        if _try_load(opus_lib, cache_path):
+            return True
+
+    found = ctypes.util.find_library('opus')
+    if found is not None and _try_load(found, cache_path):
+        return True
+
+    raise RuntimeError('Could not load an opus lib. Tried %s' % (', '.join(candidates)))
+
+
+def _try_load(opus_lib, cache_path):
+    try:
+        opus.load_opus(opus_lib)
+    except OSError:
+        return False
+
+    if cache_path is not None:
         try:
-            opus.load_opus(opus_lib)
-            return
+            with open(cache_path, 'w') as cache:
+                cache.write(opus_lib)
         except OSError:
             pass
-
-    raise RuntimeError('Could not load an opus lib. Tried %s' % (', '.join(opus_libs)))
+    return True
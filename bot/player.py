@@ -18,16 +18,23 @@
 # along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
 # -----------------------
 
-import queue
+import time
 import bot.utils as utils
+from bot import log
+from bot import songfetcher
+from bot import resolver
+from bot.audiostats import FrameStats
+from bot.songqueue import SongQueue
 from random import shuffle
+from threading import Lock, RLock, Thread
 
 
 class Player:
     """
     Represents a music player that can be used by :class:`MetalBot`. It uses :class:`song.Song` objects as input.
     """
-    def __init__(self, voice_client=None, volume=0.15, update_listener=None):
+    def __init__(self, voice_client=None, volume=0.15, update_listener=None, max_resume_retries=3,
+                 resume_tolerance=5, lookahead=3, stall_timeout=20, stall_grace=30):
         """
         :param voice_client: The voice client the player should play in
         :type voice_client: discord.VoiceClient
@@ -35,13 +42,74 @@ class Player:
         :type volume: float
         :param update_listener: A method that should be called when the player changes its state
         :type update_listener: function
+        :param max_resume_retries: How many times the player tries to resume a song whose stream ended prematurely
+        :type max_resume_retries: int
+        :param resume_tolerance: A stream that ends less than this number of seconds before the end of the song is
+                                 considered finished
+        :type resume_tolerance: int
+        :param lookahead: The number of songs at the front of the queue whose streams are kept resolved. Songs after
+                          them don't keep their stream URL until they get closer to playing.
+        :type lookahead: int
+        :param stall_timeout: Playback that sends no audio for this number of seconds is considered stalled, see
+                              :meth:`check_progress`. 0 to never consider playback stalled.
+        :type stall_timeout: float
+        :param stall_grace: Playback that goes on for this number of seconds after its song should have ended is
+                            considered stalled
+        :type stall_grace: float
         """
-        self.queue = queue.Queue()
+        self.queue = SongQueue()
+        self.lookahead = lookahead
+        self._lookahead_lock = Lock()
+        # held while the current song or its stream changes, which the event loop, the executor, the stream players'
+        # finish handlers and the watchdog all do
+        self._playback_lock = RLock()
         self.voice_client = voice_client
         self.update_listener = update_listener
+        self.max_resume_retries = max_resume_retries
+        self.resume_tolerance = resume_tolerance
         self._current_song = None
         self._volume = volume
         self._stream_player = None
+        self._resume_attempts = 0
+        self.stall_timeout = stall_timeout
+        self.stall_grace = stall_grace
+        self._recovering = False  # an interrupted stream is being resumed, so no audio is expected
+        self._progress = None  # (stream player, frames sent, time) when the last frame was noticed
+        # statistics about streams that ended before their song did
+        self.recovery_stats = {
+            "interrupted": 0,
+            "recovered": 0,
+            "failed": 0,
+            "total_recovery_time": 0.0,
+            "last_recovery_time": 0.0
+        }
+        # the number of bytes downloaded from the streams of the songs that finished, as far as it can be estimated
+        self.stream_stats = {
+            "songs": 0,
+            "bytes": 0
+        }
+        # statistics about playback that stalled without its stream ending, see check_progress
+        self.stall_stats = {
+            "stalled": 0,
+            "total_recovery_time": 0.0,
+            "last_recovery_time": 0.0
+        }
+        self._suspended_since = None  # monotonic time the current song was suspended at, see suspend
+        self._stream_started = None  # monotonic time the current stream started at
+        # statistics about songs suspended while nobody listened. The CPU-seconds saved are an estimate: the time spent
+        # suspended at the rate ffmpeg used CPU while streaming, for as long as ffmpeg's CPU time can be measured (see
+        # utils.get_process_cpu_time)
+        self.suspend_stats = {
+            "suspended": 0,
+            "resumed": 0,
+            "suspended_time": 0.0,
+            "cpu_seconds_saved": 0.0,
+            "ffmpeg_cpu_time": 0.0,
+            "streaming_time": 0.0
+        }
+        # timing of the audio frames sent for the current song, and for all of the songs that finished before it
+        self.song_frame_stats = FrameStats()
+        self.frame_stats = FrameStats()
 
     def is_playing(self):
         """
@@ -64,8 +132,9 @@ class Player:
         """
         Makes sure the player is playing something if it can.
         """
-        if not self.is_playing() and not self.queue.empty() and self.can_play():
-            self.play_next()
+        with self._playback_lock:
+            if not self.is_playing() and not self.queue.empty() and self.can_play():
+                self.play_next()
 
     @property
     def current_song(self):
@@ -84,6 +153,141 @@ class Player:
         if self._stream_player is not None:
             self._stream_player.volume = self._volume
 
+    def is_paused(self):
+        """
+        Returns whether or not the song that is currently playing is paused.
+
+        :rtype: bool
+        """
+        return self._current_song is not None and self._current_song.is_paused()
+
+    def pause(self):
+        """
+        Pauses the song that is currently playing.
+
+        :return: Whether or not the song was paused
+        :rtype: bool
+        """
+        if self._current_song is None or self.is_paused():
+            return False
+        self._stream_player.pause()
+        self._current_song.pause()
+        log.info("Paused", title=self._current_song.title)
+        return True
+
+    def resume(self):
+        """
+        Resumes the song that is currently playing if it is paused.
+
+        :return: Whether or not the song was resumed
+        :rtype: bool
+        """
+        if self.is_suspended():
+            return self.resume_suspended()
+        if not self.is_paused():
+            return False
+        self.song_frame_stats.interrupt()
+        self._stream_player.resume()
+        self._current_song.play()
+        log.info("Resumed", title=self._current_song.title)
+        return True
+
+    def seek(self, seconds):
+        """
+        Restarts the song that is currently playing from the position given. The song's stream is reused, so its
+        details are not resolved again. Seeking a paused song resumes it.
+
+        :param seconds: The position to play from, in seconds
+        :type seconds: float
+        :return: Whether or not there was a song to seek in
+        :rtype: bool
+        """
+        song = self._current_song
+        if song is None:
+            return False
+
+        self._end_suspension()
+        self._stop_stream()
+        self._start_stream(song, seconds)
+        song.seek(seconds)
+        song.play()
+        log.info("Seeked", title=song.title, position=utils.seconds_to_timestamp(seconds))
+        return True
+
+    def is_suspended(self):
+        """
+        Returns whether or not the song that is currently playing is suspended, see :meth:`suspend`.
+
+        :rtype: bool
+        """
+        return self._suspended_since is not None
+
+    def suspend(self):
+        """
+        Stops streaming the song that is currently playing, for when nobody is listening to it. Its ffmpeg process is
+        stopped, which closes its connection to the stream, and its position is kept so :meth:`resume_suspended` plays
+        it from there. Paused songs are not suspended, their ffmpeg process is idle already.
+
+        :return: Whether or not the song was suspended
+        :rtype: bool
+        """
+        with self._playback_lock:
+            song = self._current_song
+            if song is None or self._stream_player is None or self.is_paused():
+                return False
+
+            song.pause()
+            self._stop_stream(kill=True)
+            self._suspended_since = time.monotonic()
+            self.suspend_stats["suspended"] += 1
+            log.info("Suspended, nobody is listening", title=song.title,
+                     position=utils.seconds_to_timestamp(song.elapsed()))
+            return True
+
+    def resume_suspended(self):
+        """
+        Plays a suspended song again from where it was suspended. Its stream URL is resolved again if it expired in the
+        meantime.
+
+        :return: Whether or not there was a suspended song
+        :rtype: bool
+        """
+        with self._playback_lock:
+            song = self._current_song
+            if song is None or not self.is_suspended():
+                return False
+
+            self._end_suspension()
+            self.suspend_stats["resumed"] += 1
+            position = song.elapsed()
+            song.play()
+            try:
+                if song.stream_url.startswith("http") and utils.is_stream_url_expired(song.stream_url):
+                    song.stream_url = songfetcher.get_stream_url(song.song_url)
+                self._start_stream(song, position)
+            except Exception as e:
+                log.warning("Could not resume suspended song", title=song.title, error=e)
+                if not self.resume_interrupted(song):
+                    self.play_next()
+                return True
+
+            song.seek(position)
+            log.info("Resumed suspended song", title=song.title, position=utils.seconds_to_timestamp(position))
+            return True
+
+    def _end_suspension(self):
+        """
+        Counts the time the current song was suspended for, and the CPU time that was saved by it.
+        """
+        if self._suspended_since is None:
+            return
+        suspended_time = time.monotonic() - self._suspended_since
+        self._suspended_since = None
+        self.suspend_stats["suspended_time"] += suspended_time
+        if self.suspend_stats["streaming_time"] > 0:
+            self.suspend_stats["cpu_seconds_saved"] += suspended_time * self.suspend_stats["ffmpeg_cpu_time"] / \
+                                                       self.suspend_stats["streaming_time"]
+
     def add_to_queue(self, song):
         """
         Adds an song to the play queue and starts playing.
@@ -91,10 +295,13 @@ class Player:
         :param song: The song to add
         :type song: song.Song
         """
+        if self.queue.qsize() >= self.lookahead and song.video_id is not None:
+            song.stream_url = None  # resolved again once the song gets closer to playing, see update_lookahead
         self.queue.put(song)
-        utils.safe_print("Added to queue: %s" % song.title)
+        log.debug("Added to queue", title=song.title, video=song.video_id)
         if not self.is_playing() and self.can_play():
-            self.play_next()
+            # the song that is being skipped to or resumed may hold up playback for a while, so it's started elsewhere
+            Thread(target=self.ensure_playing, daemon=True).start()
 
     def clear_queue(self):
         """
@@ -103,11 +310,7 @@ class Player:
         :return: The number of items removed
         :rtype: int
         """
-        removed_count = 0
-        while not self.queue.empty():
-            self.queue.get()
-            removed_count += 1
-        return removed_count
+        return self.queue.clear()
 
     def shuffle_queue(self):
         """
@@ -117,9 +320,47 @@ class Player:
             return
         song_list = list(self.queue.queue)
         shuffle(song_list)
-        self.clear_queue()
-        for song in song_list:
-            self.queue.put(song)
+        self.queue.replace(song_list)
+        Thread(target=self.update_lookahead, daemon=True).start()
+
+    def set_stream_preferences(self, target_bitrate, prefer_opus=True):
+        """
+        Sets which audio streams are picked for songs, see :func:`songfetcher.set_stream_preferences`.
+        """
+        songfetcher.set_stream_preferences(target_bitrate, prefer_opus)
+
+    def set_resolver(self, backend_names, hedge_percentile=95):
+        """
+        Sets how songs are looked up, see :func:`resolver.create_resolver`.
+        """
+        songfetcher.set_resolver(resolver.create_resolver(backend_names, hedge_percentile))
+
+    @staticmethod
+    def resolve_stream(song):
+        """
+        Resolves the stream URL of a song if it has none or if it expired.
+
+        :param song: The song
+        :type song: song.Song
+        """
+        if song.stream_url is None or utils.is_stream_url_expired(song.stream_url):
+            song.stream_url = songfetcher.get_youtube_song(song.song_url).stream_url
+
+    def update_lookahead(self):
+        """
+        Resolves the streams of the songs at the front of the queue, so they start right away, and drops the stream
+        URLs of the songs after them.
+        """
+        with self._lookahead_lock:
+            for index, song in enumerate(list(self.queue.queue)):
+                if index >= self.lookahead:
+                    if song.video_id is not None:
+                        song.stream_url = None
+                    continue
+                try:
+                    self.resolve_stream(song)
+                except Exception as e:
+                    log.warning("Could not resolve stream", title=song.title, error=e)
 
     def calc_queue_time(self):
         """
@@ -127,7 +368,7 @@ class Player:
         currently playing.
 
         :return: Seconds left in play queue
-        :rtype: int
+        :rtype: float
         """
         time = 0
         for song in list(self.queue.queue):
@@ -141,7 +382,7 @@ class Player:
         Calculates the number of seconds left for the song that is currently playing.
 
         :return: Seconds left in the current song
-        :rtype: int
+        :rtype: float
         """
         if self._current_song is None:
             return 0
@@ -154,7 +395,7 @@ class Player:
         :param seconds: Some number of seconds
         :type seconds: int
         :return: The difference between seconds and the current song's elapsed seconds
-        :rtype: int
+        :rtype: float
         """
         if self._current_song is None:
             return seconds
@@ -167,29 +408,251 @@ class Player:
         if self.update_listener is not None:
             self.update_listener(self._current_song)
 
+    def is_interrupted(self, song):
+        """
+        Returns whether or not the stream of a song ended before the song itself did.
+
+        :param song: The song whose stream ended
+        :type song: song.Song
+        :rtype: bool
+        """
+        if song.length <= 0:  # the length is unknown, there is no way to tell
+            return False
+        return song.elapsed() < song.length - self.resume_tolerance
+
+    def _start_stream(self, song, offset=0):
+        """
+        Starts streaming a song to the voice client.
+
+        :param song: The song to stream
+        :type song: song.Song
+        :param offset: The position to start the song from, in seconds
+        :type offset: float
+        """
+        before_options = []
+        if song.stream_url.startswith("http"):
+            before_options.append("-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5")
+        if offset > 0:
+            before_options.append("-ss %.3f" % offset)
+
+        self._stream_player = self.voice_client.create_ffmpeg_player(
+            filename=song.stream_url,
+            before_options=" ".join(before_options),
+            after=self._stream_finished
+        )
+        self._stream_player.volume = self._volume
+        # measure the timing of the frames the stream player reads from ffmpeg and sends
+        self.song_frame_stats.interrupt()
+        self._stream_player.player = self.song_frame_stats.wrap_sender(self._stream_player.player)
+        self._stream_player.buff = self.song_frame_stats.wrap_stream(self._stream_player.buff)
+        self._stream_player.start()
+        self._stream_started = time.monotonic()
+
+    def _stop_stream(self, kill=False):
+        """
+        Stops the current stream without triggering its finish handler.
+
+        :param kill: Whether to kill the stream's ffmpeg process as well, for when the stream player is stuck reading
+                     from it
+        :type kill: bool
+        """
+        process = getattr(self._stream_player, "process", None)
+        if self._stream_started is not None and process is not None:
+            cpu_time = utils.get_process_cpu_time(process.pid)  # None once ffmpeg exited and was collected
+            if cpu_time is not None:
+                self.suspend_stats["ffmpeg_cpu_time"] += cpu_time
+                self.suspend_stats["streaming_time"] += time.monotonic() - self._stream_started
+        self._stream_started = None
+
+        self._stream_player.after = None
+        self._stream_player.stop()
+        self._stream_player.resume()  # a paused stream player only notices it was stopped once it is resumed
+        if kill and process is not None:
+            try:
+                process.kill()
+            except OSError:  # it already exited
+                pass
+
+    def _stream_finished(self, stream_player):
+        """
+        Called by a stream player when its stream ends. Resumes the current song if the stream ended prematurely,
+        otherwise plays the next song.
+
+        :param stream_player: The stream player that finished
+        :type stream_player: discord.voice_client.StreamPlayer
+        """
+        with self._playback_lock:
+            if stream_player is not self._stream_player:  # this stream was already replaced
+                return
+
+            song = self._current_song
+            if song is not None and self.is_interrupted(song):
+                log.warning("Stream ended prematurely", title=song.title,
+                            position=utils.seconds_to_timestamp(song.elapsed()),
+                            length=utils.seconds_to_timestamp(song.length), error=stream_player.error)
+                if self.resume_interrupted(song):
+                    return
+
+            self.play_next()
+
+    def resume_interrupted(self, song):
+        """
+        Restarts the stream of a song from the position it was interrupted at. The stream URL is resolved again if it
+        expired or if resuming with it already failed. Gives up after :attr:`max_resume_retries` attempts.
+
+        :param song: The song that was interrupted
+        :type song: song.Song
+        :return: Whether or not the song was resumed
+        :rtype: bool
+        """
+        position = song.elapsed()
+        start_time = time.monotonic()
+        self.recovery_stats["interrupted"] += 1
+        self._recovering = True
+        try:
+            return self._resume_at(song, position, start_time)
+        finally:
+            self._recovering = False
+
+    def _resume_at(self, song, position, start_time):
+        while self._resume_attempts < self.max_resume_retries:
+            self._resume_attempts += 1
+            try:
+                # local files have nothing to resolve again
+                if song.stream_url.startswith("http") and \
+                        (self._resume_attempts > 1 or utils.is_stream_url_expired(song.stream_url)):
+                    log.info("Resolving stream again", title=song.title)
+                    song.stream_url = songfetcher.get_stream_url(song.song_url)
+                self._start_stream(song, position)
+            except Exception as e:
+                log.warning("Resume attempt failed", title=song.title, attempt=self._resume_attempts,
+                            max_attempts=self.max_resume_retries, error=e)
+                time.sleep(min(2 ** self._resume_attempts, 10))
+                continue
+
+            song.seek(position)
+            recovery_time = time.monotonic() - start_time
+            self.recovery_stats["recovered"] += 1
+            self.recovery_stats["total_recovery_time"] += recovery_time
+            self.recovery_stats["last_recovery_time"] = recovery_time
+            log.info("Resumed interrupted stream", title=song.title, position=utils.seconds_to_timestamp(position),
+                     recovery_time="%.2f" % recovery_time, attempt=self._resume_attempts,
+                     max_attempts=self.max_resume_retries)
+            return True
+
+        self.recovery_stats["failed"] += 1
+        log.error("Could not resume, giving up", title=song.title)
+        return False
+
+    def check_progress(self):
+        """
+        Checks that the song that is currently playing is making progress, and recovers it if it stalled: if no audio
+        was sent for :attr:`stall_timeout` seconds (for example when ffmpeg hangs), or if it went on for
+        :attr:`stall_grace` seconds longer than the song (for example when the stream's finish handler was never
+        called). A stalled song is resumed from where it stopped if it was interrupted, and skipped otherwise. This is
+        meant to be called periodically, see :class:`PlayerWatchdog`.
+
+        :return: Whether or not the song stalled
+        :rtype: bool
+        """
+        song = self._current_song
+        stream_player = self._stream_player
+        if self.stall_timeout <= 0 or song is None or stream_player is None or song.is_paused() or \
+                self._recovering:
+            self._progress = None
+            return False
+
+        now = time.monotonic()
+        frames = self.song_frame_stats.frames
+        if self._progress is None or self._progress[0] is not stream_player or self._progress[1] != frames:
+            self._progress = (stream_player, frames, now)
+        last_progress = self._progress[2]
+
+        if now - last_progress >= self.stall_timeout:
+            reason = "no audio sent for %ss" % int(now - last_progress)
+        elif song.length > 0 and song.elapsed() > song.length + self.stall_grace:
+            reason = "played %ss past its end" % int(song.elapsed() - song.length)
+        else:
+            return False
+
+        with self._playback_lock:
+            # the song may have ended or been skipped since it was checked
+            if self._current_song is not song or self._stream_player is not stream_player or self._recovering:
+                self._progress = None
+                return False
+            self.stall_stats["stalled"] += 1
+            song.seek(max(song.elapsed() - (now - last_progress), 0))  # the time it stalled for wasn't heard
+            log.warning("Playback stalled", title=song.title, reason=reason,
+                        position=utils.seconds_to_timestamp(song.elapsed()),
+                        length=utils.seconds_to_timestamp(song.length))
+            self._stop_stream(kill=True)
+            if not self.is_interrupted(song) or not self.resume_interrupted(song):
+                self.play_next()
+
+        recovery_time = time.monotonic() - last_progress
+        self.stall_stats["total_recovery_time"] += recovery_time
+        self.stall_stats["last_recovery_time"] = recovery_time
+        self._progress = None
+        log.info("Recovered stalled playback", title=song.title, recovery_time="%.2f" % recovery_time)
+        return True
+
     def play_next(self):
         """
         Plays the next song in the queue.
         """
-        if self._stream_player is not None:
-            self._stream_player.after = None
-            self._stream_player.stop()
-            if self._current_song is not None:
-                utils.safe_print("Song finished: %s" % self._current_song.title)
+        with self._playback_lock:
+            if self._stream_player is not None:
+                self._stop_stream()
+                if self._current_song is not None:
+                    self.stream_stats["songs"] += 1
+                    self.stream_stats["bytes"] += utils.estimate_stream_bytes(self._current_song.stream_url,
+                                                                              self._current_song.elapsed())
+                    log.info("Song finished", title=self._current_song.title, frame_timing=self.song_frame_stats,
+                             frame_histogram=self.song_frame_stats.histogram_str())
 
-        self._current_song = None
+            self.frame_stats.merge(self.song_frame_stats)
+            self.song_frame_stats = FrameStats()
+            self._end_suspension()
+            self._current_song = None
+            self._resume_attempts = 0
 
-        if not self.queue.empty():
-            song = self.queue.get()
-            self._stream_player = self.voice_client.create_ffmpeg_player(
-                filename=song.stream_url,
-                after=self.play_next
-            )
-            self._stream_player.volume = self._volume
-            self._stream_player.start()
-            self._current_song = song
-            self._current_song.play()
-            utils.safe_print("Playing: %s" % self._current_song.title)
+            while not self.queue.empty():
+                song = self.queue.get()
+                try:
+                    self.resolve_stream(song)
+                except Exception as e:
+                    log.warning("Could not resolve stream, skipping the song", title=song.title, error=e)
+                    continue
+                self._current_song = song
+                self._start_stream(song)
+                self._current_song.play()
+                log.info("Playing", title=song.title, video=song.video_id, requester=song.requester_id)
+                break
+
+            if not self.queue.empty():
+                Thread(target=self.update_lookahead, daemon=True).start()
+            self.fire_update_listener()
 
-        self.fire_update_listener()
 
+class PlayerWatchdog(Thread):
+    """
+    Periodically checks that a :class:`Player` is making progress, see :meth:`Player.check_progress`.
+    """
+    def __init__(self, player, interval=5):
+        """
+        :param player: The player to watch
+        :type player: Player
+        :param interval: Number of seconds between checks
+        :type interval: float
+        """
+        super().__init__(daemon=True)
+        self.player = player
+        self.interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.player.check_progress()
+            except Exception as e:
+                log.error("Checking playback progress failed", error=e)
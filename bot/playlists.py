@@ -0,0 +1,130 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+import os
+import sqlite3
+import threading
+from bot import song
+from bot import songfetcher
+from bot.search import SearchResult
+
+MAX_NAME_LENGTH = 32
+
+
+def normalize_name(name):
+    """
+    Returns the name a playlist is saved under: lowercase, with single spaces.
+
+    :param name: The name of the playlist as the user typed it
+    :type name: str
+    :rtype: str
+    """
+    return " ".join(name.lower().split())[:MAX_NAME_LENGTH]
+
+
+class SavedPlaylists:
+    """
+    Playlists that users saved, with the details of their songs, so loading them again doesn't resolve anything. Every
+    playlist belongs to an owner, which is a server or a user. Songs only keep their video ID (or the path of a library
+    track), title and length; their streams are resolved by the player once they get close to playing.
+    """
+    def __init__(self, path):
+        """
+        :param path: Path of the SQLite database file to keep the playlists in
+        :type path: str
+        """
+        directory = os.path.dirname(path)
+        if len(directory) > 0:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS playlist_songs ("
+                             "owner_id TEXT NOT NULL, name TEXT NOT NULL, position INTEGER NOT NULL, "
+                             "source TEXT NOT NULL, title TEXT NOT NULL, length INTEGER NOT NULL, "
+                             "PRIMARY KEY (owner_id, name, position)) WITHOUT ROWID")
+
+    def save(self, owner_id, name, songs):
+        """
+        Saves songs as a playlist, replacing the playlist with the same name if there is one.
+
+        :param owner_id: The ID of the server or user the playlist belongs to
+        :type owner_id: str
+        :param name: The name of the playlist, see :func:`normalize_name`
+        :type name: str
+        :param songs: The songs, in order. Songs that are neither YouTube videos nor library tracks are left out.
+        :type songs: list
+        :return: The number of songs saved
+        :rtype: int
+        """
+        rows = []
+        for saved_song in songs:
+            if saved_song.video_id is not None:
+                source = saved_song.video_id
+            elif saved_song.stream_url is not None and not saved_song.stream_url.startswith("http"):
+                source = saved_song.stream_url  # a library track
+            else:
+                continue
+            rows.append((owner_id, name, len(rows), source, saved_song.title, saved_song.length))
+
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM playlist_songs WHERE owner_id = ? AND name = ?", (owner_id, name))
+            self._db.executemany("INSERT INTO playlist_songs VALUES (?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def load(self, owner_id, name):
+        """
+        Builds the songs of a saved playlist. Their streams are not resolved.
+
+        :param owner_id: The ID of the server or user the playlist belongs to
+        :type owner_id: str
+        :param name: The name of the playlist, see :func:`normalize_name`
+        :type name: str
+        :return: A list of :class:`song.Song` objects, empty if there is no such playlist
+        :rtype: list
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT source, title, length FROM playlist_songs "
+                                    "WHERE owner_id = ? AND name = ? ORDER BY position", (owner_id, name)).fetchall()
+
+        songs = []
+        for source, title, length in rows:
+            if "/" in source or os.sep in source:
+                songs.append(song.Song(stream_url=source, title=title, length=length))
+            else:
+                songs.append(songfetcher.get_unresolved_song(SearchResult(source, title, length)))
+        return songs
+
+    def names(self, owner_id):
+        """
+        Returns the playlists an owner saved.
+
+        :param owner_id: The ID of the server or user
+        :type owner_id: str
+        :return: A list of (name, song count) tuples, sorted by name
+        :rtype: list
+        """
+        with self._lock:
+            return self._db.execute("SELECT name, COUNT(*) FROM playlist_songs WHERE owner_id = ? "
+                                    "GROUP BY name ORDER BY name", (owner_id,)).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,155 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    A token bucket: it holds up to :attr:`capacity` tokens and is refilled at a constant rate. Taking tokens from it
+    limits how often something can be done on average while still allowing short bursts.
+    """
+    def __init__(self, rate, capacity):
+        """
+        :param rate: The number of tokens added every second
+        :type rate: float
+        :param capacity: The maximal number of tokens the bucket holds, which is also the largest burst allowed
+        :type capacity: float
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        if now <= self._updated:  # the time was read before the bucket was made
+            return
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, count, now=None):
+        """
+        Returns how long it takes until the bucket has enough tokens.
+
+        :param count: The number of tokens needed
+        :type count: float
+        :param now: The current monotonic time, read if not given
+        :type now: float
+        :return: The number of seconds to wait, 0 if there are enough tokens already
+        :rtype: float
+        """
+        self._refill(time.monotonic() if now is None else now)
+        if self._tokens >= count:
+            return 0.0
+        return (count - self._tokens) / self.rate
+
+    def take(self, count):
+        """
+        Takes tokens from the bucket. Call :meth:`wait_time` first to make sure there are enough of them. A negative
+        count gives tokens back, up to the bucket's capacity.
+
+        :param count: The number of tokens to take
+        :type count: float
+        """
+        self._tokens = min(self.capacity, self._tokens - count)
+
+    def is_full(self, now=None):
+        self._refill(time.monotonic() if now is None else now)
+        return self._tokens >= self.capacity
+
+
+class AdmissionControl:
+    """
+    Limits how many songs can be resolved per user, per guild and overall, with a :class:`TokenBucket` for each. A
+    request is only admitted if every bucket it applies to has a token for every song it resolves, and then tokens are
+    taken from all of them.
+    """
+    SCOPES = ("user", "guild", "global")
+    MAX_IDLE_BUCKETS = 1000  # full buckets of users and guilds are forgotten once there are more than this many
+
+    def __init__(self, limits):
+        """
+        :param limits: The (rate in songs per minute, burst) of each scope in :attr:`SCOPES`. Scopes that are missing
+                       or whose rate is 0 are not limited.
+        :type limits: dict
+        """
+        self.limits = dict((scope, (rate / 60.0, burst)) for scope, (rate, burst) in limits.items()
+                           if rate > 0 and burst > 0)
+        self.throttled = dict.fromkeys(self.SCOPES, 0)  # the number of requests denied because of each scope
+        self.admitted = 0
+        self._buckets = dict((scope, {}) for scope in self.SCOPES)
+        self._lock = threading.Lock()
+
+    def _bucket(self, scope, key):
+        buckets = self._buckets[scope]
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= self.MAX_IDLE_BUCKETS:
+                for idle_key in [k for k, b in buckets.items() if b.is_full()]:
+                    del buckets[idle_key]
+            bucket = buckets[key] = TokenBucket(*self.limits[scope])
+        return bucket
+
+    def admit(self, user_id, guild_id, count=1, already_admitted=0):
+        """
+        Admits a request to resolve songs if none of the limits it applies to is exceeded. A request for more songs
+        than a burst allows is admitted once the bucket is full, so large playlists can still be played.
+
+        A request whose number of songs is only known after some work was done (like a playlist, which has to be listed
+        first) is admitted for part of its songs before that work, and for the rest of them once their number is known.
+        Tokens taken for songs that turned out not to exist are given back.
+
+        :param user_id: The ID of the user who made the request
+        :type user_id: str
+        :param guild_id: The ID of the guild the request was made in
+        :type guild_id: str
+        :param count: The number of songs the request resolves
+        :type count: int
+        :param already_admitted: The number of songs the request was already admitted for
+        :type already_admitted: int
+        :return: 0 if the request is admitted, otherwise the number of seconds until it would be
+        :rtype: float
+        """
+        keys = {"user": user_id, "guild": guild_id, "global": None}
+        with self._lock:
+            now = time.monotonic()
+            buckets = []
+            wait = 0.0
+            throttled_scope = None
+            for scope in self.SCOPES:
+                if scope not in self.limits:
+                    continue
+                bucket = self._bucket(scope, keys[scope])
+                needed = min(count, bucket.capacity) - min(already_admitted, bucket.capacity)
+                scope_wait = bucket.wait_time(needed, now)
+                if scope_wait > wait:
+                    wait = scope_wait
+                    throttled_scope = scope
+                buckets.append((bucket, needed))
+
+            if throttled_scope is not None:
+                self.throttled[throttled_scope] += 1
+                return wait
+            for bucket, needed in buckets:
+                bucket.take(needed)
+            if already_admitted == 0:
+                self.admitted += 1
+            return 0.0
@@ -0,0 +1,321 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+import concurrent.futures
+import threading
+import time
+from collections import deque
+from bot import log
+
+
+class ResolverBackend:
+    """
+    A way of looking up a YouTube video. Backends return :class:`pafy.Pafy` objects, so the rest of the bot doesn't
+    depend on which one looked the video up.
+    """
+    RECENT_CALLS = 100  # the number of calls the latency and error rate are calculated from
+
+    def __init__(self, name):
+        """
+        :param name: The name the backend is shown with
+        :type name: str
+        """
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.last_error_time = None
+        self.recent_latencies = deque(maxlen=self.RECENT_CALLS)
+        self.recent_errors = deque(maxlen=self.RECENT_CALLS)
+        self._lock = threading.Lock()
+
+    def fetch(self, url):
+        """
+        Looks up a video.
+
+        :param url: URL of the video
+        :type url: str
+        :rtype: pafy.Pafy
+        """
+        raise NotImplementedError
+
+    def is_available(self):
+        """
+        Returns whether or not the modules this backend needs are installed.
+
+        :rtype: bool
+        """
+        return True
+
+    def timed_fetch(self, url):
+        """
+        Looks up a video like :meth:`fetch`, and records how long it took and whether or not it failed.
+        """
+        start = time.monotonic()
+        try:
+            video = self.fetch(url)
+        except Exception:
+            with self._lock:
+                self.calls += 1
+                self.errors += 1
+                self.last_error_time = time.monotonic()
+                self.recent_errors.append(True)
+            raise
+        with self._lock:
+            self.calls += 1
+            self.recent_latencies.append(time.monotonic() - start)
+            self.recent_errors.append(False)
+        return video
+
+    def latency_percentile(self, percent):
+        """
+        Returns a percentile of the latency of recent successful calls.
+
+        :param percent: The percentile, 0-100
+        :type percent: float
+        :return: The latency in seconds, None if there were no successful calls yet
+        :rtype: float
+        """
+        with self._lock:
+            latencies = sorted(self.recent_latencies)
+        if len(latencies) == 0:
+            return None
+        return latencies[min(int(len(latencies) * percent / 100), len(latencies) - 1)]
+
+    @property
+    def error_rate(self):
+        """
+        The fraction of recent calls that failed.
+        """
+        with self._lock:
+            if len(self.recent_errors) == 0:
+                return 0.0
+            return sum(self.recent_errors) / len(self.recent_errors)
+
+    def is_healthy(self, max_error_rate=0.5, retry_after=60):
+        """
+        Returns whether or not the backend should be used. A backend that fails too often is avoided, until a while
+        after it last failed.
+
+        :param max_error_rate: The fraction of recent calls that can fail
+        :type max_error_rate: float
+        :param retry_after: Number of seconds after the last failure that an unhealthy backend is tried again
+        :type retry_after: float
+        :rtype: bool
+        """
+        return self.error_rate <= max_error_rate or time.monotonic() - self.last_error_time > retry_after
+
+    def __str__(self):
+        median = self.latency_percentile(50)
+        p95 = self.latency_percentile(95)
+        if median is None:
+            return "%s: %s calls, %s failed" % (self.name, self.calls, self.errors)
+        return "%s: %s calls, %s failed (%.0f%% recently), %.2fs median, %.2fs p95" % \
+               (self.name, self.calls, self.errors, self.error_rate * 100, median, p95)
+
+
+class PafyBackend(ResolverBackend):
+    """
+    Looks videos up with pafy, using whichever backend pafy is set to.
+    """
+    def __init__(self):
+        super().__init__("pafy")
+
+    def fetch(self, url):
+        import pafy
+        return pafy.new(url)
+
+
+class InternalBackend(ResolverBackend):
+    """
+    Looks videos up with pafy's own backend, which reads YouTube's pages directly.
+    """
+    def __init__(self):
+        super().__init__("internal")
+
+    def fetch(self, url):
+        from pafy.backend_internal import InternPafy
+        return InternPafy(url)
+
+    def is_available(self):
+        try:
+            import pafy.backend_internal
+        except ImportError:
+            return False
+        return True
+
+
+class YoutubeDlBackend(ResolverBackend):
+    """
+    Looks videos up with pafy's youtube-dl backend.
+    """
+    def __init__(self):
+        super().__init__("youtube-dl")
+
+    def fetch(self, url):
+        from pafy.backend_youtube_dl import YtdlPafy
+        return YtdlPafy(url)
+
+    def is_available(self):
+        try:
+            import pafy.backend_youtube_dl  # imports youtube_dl
+        except ImportError:
+            return False
+        return True
+
+
+BACKENDS = {
+    "pafy": PafyBackend,
+    "internal": InternalBackend,
+    "youtube-dl": YoutubeDlBackend
+}
+
+
+def create_backend(name):
+    """
+    Creates a resolver backend by its name.
+
+    :param name: The name of the backend, one of the keys of :data:`BACKENDS`
+    :type name: str
+    :return: The resolver backend
+    :rtype: ResolverBackend
+    """
+    if name.lower() not in BACKENDS:
+        raise ValueError("Unknown resolver backend '%s', expected one of: %s" % (name, ", ".join(sorted(BACKENDS))))
+    return BACKENDS[name.lower()]()
+
+
+def create_resolver(names, hedge_percentile=95):
+    """
+    Creates a resolver with the backends that are installed out of the ones given. Backends that are not installed are
+    skipped, and if none of them is, pafy's default backend is used.
+
+    :param names: The names of the backends, in order of preference
+    :type names: list
+    :param hedge_percentile: See :class:`Resolver`
+    :type hedge_percentile: float
+    :rtype: Resolver
+    """
+    backends = []
+    for name in names:
+        backend = create_backend(name)
+        if backend.is_available():
+            backends.append(backend)
+        else:
+            log.warning("Resolver backend is not installed", backend=backend.name)
+    if len(backends) == 0:
+        backends.append(PafyBackend())
+    return Resolver(backends, hedge_percentile)
+
+
+class Resolver:
+    """
+    Looks videos up with the fastest of several backends. Backends are ordered by their median latency, and backends
+    that fail too often are avoided. When the fastest backend takes longer than it usually does (see
+    :attr:`hedge_percentile`), the video is looked up with the next backend as well and whichever answers first is used,
+    so one slow lookup doesn't hold a song back. A backend that fails is followed by the next one.
+    """
+    MIN_SAMPLES = 10  # the number of calls a backend needs before its latency percentile is trusted
+    DEFAULT_HEDGE_DELAY = 5  # seconds to wait before hedging a backend that has too few samples
+
+    def __init__(self, backends, hedge_percentile=95):
+        """
+        :param backends: The backends to use, in order of preference for as long as their latency is unknown
+        :type backends: list
+        :param hedge_percentile: The percentile of a backend's latency after which the next backend is tried too
+                                 (0-100), 0 to never try two backends at once
+        :type hedge_percentile: float
+        """
+        if len(backends) == 0:
+            raise ValueError("A resolver needs at least one backend")
+        self.backends = backends
+        self.hedge_percentile = hedge_percentile
+        self.stats = {
+            "hedged": 0,
+            "hedge_wins": 0,
+            "failovers": 0
+        }
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=4 * len(backends))
+
+    def ranked_backends(self):
+        """
+        Returns the backends in the order they should be tried: healthy backends first, fastest first. Backends that
+        weren't measured enough yet come first, so they get measured.
+
+        :rtype: list
+        """
+        def rank(backend):
+            measured = len(backend.recent_latencies) >= self.MIN_SAMPLES
+            return not backend.is_healthy(), measured, backend.latency_percentile(50) if measured else 0.0
+        return sorted(self.backends, key=rank)  # sorted is stable, so ties keep the configured order
+
+    def hedge_delay(self, backend):
+        """
+        Returns the number of seconds to wait for a backend before trying the next one as well.
+
+        :type backend: ResolverBackend
+        :rtype: float
+        """
+        if len(backend.recent_latencies) < self.MIN_SAMPLES:
+            return self.DEFAULT_HEDGE_DELAY
+        return backend.latency_percentile(self.hedge_percentile)
+
+    def fetch(self, url):
+        """
+        Looks a video up.
+
+        :param url: URL of the video
+        :type url: str
+        :rtype: pafy.Pafy
+        """
+        backends = self.ranked_backends()
+        pending = {self._executor.submit(backends[0].timed_fetch, url): backends[0]}
+        next_index = 1
+        first_error = None
+        while len(pending) > 0:
+            can_hedge = self.hedge_percentile > 0 and next_index < len(backends) and len(pending) == 1
+            timeout = self.hedge_delay(next(iter(pending.values()))) if can_hedge else None
+            done, _ = concurrent.futures.wait(pending, timeout=timeout,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            if len(done) == 0:  # the backend is slower than usual
+                self.stats["hedged"] += 1
+                log.debug("Hedging a slow lookup", url=url, slow=pending[next(iter(pending))].name,
+                          hedge=backends[next_index].name)
+                pending[self._executor.submit(backends[next_index].timed_fetch, url)] = backends[next_index]
+                next_index += 1
+                continue
+
+            for future in done:
+                backend = pending.pop(future)
+                if future.exception() is None:
+                    if backend is not backends[0]:
+                        self.stats["hedge_wins" if first_error is None else "failovers"] += 1
+                    return future.result()
+                log.debug("Lookup failed", url=url, backend=backend.name, error=future.exception())
+                if first_error is None:
+                    first_error = future.exception()
+            if len(pending) == 0 and next_index < len(backends):
+                pending[self._executor.submit(backends[next_index].timed_fetch, url)] = backends[next_index]
+                next_index += 1
+        raise first_error
+
+    def __str__(self):
+        return "%s\n%s hedged (%s won by the hedge), %s failed over" % \
+               ("\n".join(str(backend) for backend in self.backends), self.stats["hedged"],
+                self.stats["hedge_wins"], self.stats["failovers"])
@@ -0,0 +1,285 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+import json
+from bot import utils
+from bot.singleflight import SingleFlight
+
+YOUTUBE_URL = "https://www.youtube.com"
+
+
+class SearchResult:
+    """
+    Represents a single video found by a :class:`SearchBackend`.
+    """
+    def __init__(self, video_id, title, length=0):
+        """
+        :param video_id: The unique ID of the video
+        :type video_id: str
+        :param title: The title of the video
+        :type title: str
+        :param length: The length of the video in seconds, 0 if unknown
+        :type length: int
+        """
+        self.video_id = video_id
+        self.title = title
+        self.length = length
+
+    @property
+    def url(self):
+        """
+        A URL to the video. This is read-only.
+        """
+        return YOUTUBE_URL + "/watch?v=" + self.video_id
+
+    def __eq__(self, other):
+        return isinstance(other, SearchResult) and \
+            (self.video_id, self.title, self.length) == (other.video_id, other.title, other.length)
+
+    def __repr__(self):
+        return "SearchResult(%r, %r, %r)" % (self.video_id, self.title, self.length)
+
+
+class SearchBackend:
+    """
+    Base class of the ways to search YouTube. Subclasses implement :meth:`search`.
+    """
+    def __init__(self, base_url=YOUTUBE_URL, timeout=10):
+        """
+        :param base_url: The URL of the site to search, without a trailing slash
+        :type base_url: str
+        :param timeout: Number of seconds to wait for the site to respond
+        :type timeout: float
+        """
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def search(self, term, limit=None):
+        """
+        Searches for the term given.
+
+        :param term: A search term
+        :type term: str
+        :param limit: The maximal number of results to return, None for no limit
+        :type limit: int
+        :return: A list of :class:`SearchResult` objects, ordered by relevance
+        :rtype: list
+        """
+        raise NotImplementedError
+
+
+class InitialDataBackend(SearchBackend):
+    """
+    Searches YouTube by extracting the results from the JSON the results page embeds for its scripts (ytInitialData).
+    The page is streamed and the download stops as soon as the JSON is complete, and no DOM is ever built.
+    """
+    MARKERS = (b"var ytInitialData = ", b'window["ytInitialData"] = ')
+    END_MARKER = b";</script>"
+
+    def __init__(self, base_url=YOUTUBE_URL, timeout=10, chunk_size=16384):
+        """
+        :param base_url: The URL of the site to search, without a trailing slash
+        :type base_url: str
+        :param timeout: Number of seconds to wait for the site to respond
+        :type timeout: float
+        :param chunk_size: Number of bytes to read from the page at a time
+        :type chunk_size: int
+        """
+        super().__init__(base_url, timeout)
+        self.chunk_size = chunk_size
+
+    def search(self, term, limit=None):
+        import requests
+
+        resp = requests.get(self.base_url + "/results", params={
+            "search_query": term
+        }, stream=True, timeout=self.timeout)
+        try:
+            initial_data = self.extract_initial_data(resp.iter_content(self.chunk_size))
+        finally:
+            resp.close()
+
+        if initial_data is None:
+            return []
+        return self.parse_initial_data(initial_data, limit)
+
+    @classmethod
+    def extract_initial_data(cls, chunks):
+        """
+        Reads chunks of a page until the embedded initial data is complete, and decodes it.
+
+        :param chunks: An iterable of byte chunks that make up the page
+        :type chunks: iterable
+        :return: The decoded initial data, None if the page doesn't contain any
+        :rtype: dict
+        """
+        buffer = bytearray()
+        start = -1
+        search_from = 0
+        for chunk in chunks:
+            buffer += chunk
+            if start < 0:
+                for marker in cls.MARKERS:
+                    index = buffer.find(marker, search_from)
+                    if index >= 0:
+                        start = index + len(marker)
+                        break
+                else:
+                    # a marker may be split between this chunk and the next one
+                    search_from = max(0, len(buffer) - max(len(m) for m in cls.MARKERS))
+                    continue
+                search_from = start
+
+            end = buffer.find(cls.END_MARKER, search_from)
+            if end >= 0:
+                return json.loads(buffer[start:end].decode("utf-8"))
+            search_from = max(start, len(buffer) - len(cls.END_MARKER))
+
+        return None
+
+    @staticmethod
+    def parse_initial_data(initial_data, limit=None):
+        """
+        Finds the videos in decoded initial data.
+
+        :param initial_data: The decoded initial data of a results page
+        :type initial_data: dict
+        :param limit: The maximal number of results to return, None for no limit
+        :type limit: int
+        :return: A list of :class:`SearchResult` objects, in the order they appear in
+        :rtype: list
+        """
+        results = []
+        stack = [initial_data]
+        while len(stack) > 0:
+            node = stack.pop()
+            if isinstance(node, list):
+                stack.extend(reversed(node))
+            elif isinstance(node, dict):
+                renderer = node.get("videoRenderer")
+                if renderer is not None and "videoId" in renderer:
+                    results.append(InitialDataBackend._parse_video_renderer(renderer))
+                    if limit is not None and len(results) >= limit:
+                        break
+                else:
+                    stack.extend(node.values())
+        return results
+
+    @staticmethod
+    def _parse_video_renderer(renderer):
+        title = renderer.get("title", {})
+        if "runs" in title:
+            title = "".join(run.get("text", "") for run in title["runs"])
+        else:
+            title = title.get("simpleText", "")
+
+        length = 0
+        length_text = renderer.get("lengthText", {}).get("simpleText")
+        if length_text is not None:  # live streams have no length
+            try:
+                length = utils.timestamp_to_seconds(length_text)
+            except ValueError:
+                pass
+
+        return SearchResult(renderer["videoId"], title, length)
+
+
+class HtmlBackend(SearchBackend):
+    """
+    Searches YouTube by building the DOM of the results page and looking for video links in it. This only works with
+    the old markup of the site, which marked results with the "yt-uix-tile-link" class.
+    """
+    def search(self, term, limit=None):
+        import requests
+        from lxml import html
+
+        resp = requests.get(self.base_url + "/results", params={
+            "search_query": term
+        }, timeout=self.timeout)
+
+        tree = html.fromstring(resp.content)
+        elements = tree.xpath("//a[contains(@class, 'yt-uix-tile-link')]")
+        results = []
+        for e in elements:
+            href = e.get("href")
+            if href.startswith("/watch?v="):
+                results.append(SearchResult(href[len("/watch?v="):], e.get("title", e.text_content())))
+                if limit is not None and len(results) >= limit:
+                    break
+        return results
+
+
+BACKENDS = {
+    "initialdata": InitialDataBackend,
+    "html": HtmlBackend
+}
+
+_backend = InitialDataBackend()
+# searches for the same term that are made at the same time share one
+searches = SingleFlight()
+
+
+def create_backend(name, **kwargs):
+    """
+    Creates a search backend by its name.
+
+    :param name: The name of the backend, one of the keys of :data:`BACKENDS`
+    :type name: str
+    :return: The search backend
+    :rtype: SearchBackend
+    """
+    if name.lower() not in BACKENDS:
+        raise ValueError("Unknown search backend '%s', expected one of: %s" % (name, ", ".join(sorted(BACKENDS))))
+    return BACKENDS[name.lower()](**kwargs)
+
+
+def set_backend(backend):
+    """
+    Sets the backend used by :func:`search_youtube`.
+
+    :param backend: The new search backend
+    :type backend: SearchBackend
+    """
+    global _backend
+    _backend = backend
+
+
+def get_backend():
+    """
+    Returns the backend used by :func:`search_youtube`.
+
+    :rtype: SearchBackend
+    """
+    return _backend
+
+
+def search_youtube(term, limit=None):
+    """
+    Search YouTube.com for the term given and return the videos found.
+
+    :param term: A search term
+    :type term: str
+    :param limit: The maximal number of results to return, None for no limit
+    :type limit: int
+    :return: A list of :class:`SearchResult` objects, ordered by relevance
+    :rtype: list
+    """
+    results, shared = searches.do((" ".join(term.lower().split()), limit), _backend.search, term, limit)
+    return list(results) if shared else results
@@ -0,0 +1,192 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from bot import log
+from bot import utils
+from bot.search import SearchBackend, SearchResult
+
+
+class SharedCache:
+    """
+    Resolved songs and search results kept in an SQLite file, so that every process of the bot (every shard) can use
+    what the others resolved. It backs the in-memory :class:`songcache.SongCache` of each process, and search backends
+    through :class:`CachedSearchBackend`.
+    """
+    def __init__(self, path, timeout=5):
+        """
+        :param path: Path of the SQLite database file, the same for every process
+        :type path: str
+        :param timeout: Number of seconds to wait for another process that is writing to the file
+        :type timeout: float
+        """
+        directory = os.path.dirname(path)
+        if len(directory) > 0:
+            os.makedirs(directory, exist_ok=True)
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "errors": 0
+        }
+        self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            # write-ahead logging lets processes read while another one writes
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS songs ("
+                             "video_id TEXT PRIMARY KEY, stream_url TEXT NOT NULL, title TEXT NOT NULL, "
+                             "length INTEGER NOT NULL, image TEXT, song_url TEXT NOT NULL) WITHOUT ROWID")
+            self._db.execute("CREATE TABLE IF NOT EXISTS searches ("
+                             "term TEXT PRIMARY KEY, results TEXT NOT NULL, created REAL NOT NULL) WITHOUT ROWID")
+
+    def _execute(self, query, params=(), write=False):
+        try:
+            with self._lock:
+                if write:
+                    with self._db:
+                        return self._db.execute(query, params).fetchall()
+                return self._db.execute(query, params).fetchall()
+        except sqlite3.Error as e:  # the cache is only an optimization, so it never fails what uses it
+            self.stats["errors"] += 1
+            log.warning("Shared cache failed", error=e)
+            return []
+
+    def get_song(self, video_id):
+        """
+        Returns the details of a resolved song whose stream didn't expire.
+
+        :param video_id: The ID of the song's video
+        :type video_id: str
+        :return: The keyword arguments of a :class:`song.Song`, None if there is no such song
+        :rtype: dict
+        """
+        rows = self._execute("SELECT stream_url, title, length, image, song_url FROM songs WHERE video_id = ?",
+                             (video_id,))
+        if len(rows) == 0 or utils.is_stream_url_expired(rows[0][0]):
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        stream_url, title, length, image, song_url = rows[0]
+        return {
+            "stream_url": stream_url,
+            "title": title,
+            "length": length,
+            "image": image,
+            "song_url": song_url
+        }
+
+    def put_song(self, video_id, details):
+        """
+        Stores the details of a resolved song.
+
+        :param video_id: The ID of the song's video
+        :type video_id: str
+        :param details: The keyword arguments of a :class:`song.Song`
+        :type details: dict
+        """
+        self._execute("INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?, ?, ?)",
+                      (video_id, details["stream_url"], details["title"], details["length"], details["image"],
+                       details["song_url"]), write=True)
+
+    def discard_song(self, video_id):
+        """
+        Forgets a resolved song if it is stored.
+
+        :param video_id: The ID of the song's video
+        :type video_id: str
+        """
+        self._execute("DELETE FROM songs WHERE video_id = ?", (video_id,), write=True)
+
+    def get_search(self, term, max_age):
+        """
+        Returns the results of a search that was made recently.
+
+        :param term: The search term
+        :type term: str
+        :param max_age: The number of seconds results are used for
+        :type max_age: float
+        :return: A list of :class:`search.SearchResult` objects, None if the search wasn't made recently
+        :rtype: list
+        """
+        rows = self._execute("SELECT results FROM searches WHERE term = ? AND created >= ?",
+                             (term, time.time() - max_age))
+        if len(rows) == 0:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return [SearchResult(*result) for result in json.loads(rows[0][0])]
+
+    def put_search(self, term, results):
+        """
+        Stores the results of a search.
+
+        :param term: The search term
+        :type term: str
+        :param results: A list of :class:`search.SearchResult` objects
+        :type results: list
+        """
+        self._execute("INSERT OR REPLACE INTO searches VALUES (?, ?, ?)",
+                      (term, json.dumps([(result.video_id, result.title, result.length) for result in results]),
+                       time.time()), write=True)
+
+    def prune(self):
+        """
+        Deletes songs whose stream expired.
+        """
+        expired = [video_id for video_id, stream_url in self._execute("SELECT video_id, stream_url FROM songs")
+                   if utils.is_stream_url_expired(stream_url)]
+        for video_id in expired:
+            self._execute("DELETE FROM songs WHERE video_id = ?", (video_id,), write=True)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class CachedSearchBackend(SearchBackend):
+    """
+    Searches with another backend, and keeps the results in a :class:`SharedCache` for a while.
+    """
+    def __init__(self, backend, cache, max_age=3600):
+        """
+        :param backend: The backend that searches
+        :type backend: SearchBackend
+        :param cache: The cache to keep results in
+        :type cache: SharedCache
+        :param max_age: The number of seconds results are kept for
+        :type max_age: float
+        """
+        super().__init__()
+        self.backend = backend
+        self.cache = cache
+        self.max_age = max_age
+
+    def search(self, term, limit=None):
+        # a search for fewer results may stop reading the page early, so results are kept by their limit too
+        key = "%s\n%s" % (" ".join(term.lower().split()), limit)
+        results = self.cache.get_search(key, self.max_age)
+        if results is None:
+            results = self.backend.search(term, limit)
+            self.cache.put_search(key, results)
+        return results
@@ -0,0 +1,84 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+import threading
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Makes concurrent calls for the same key share one call. The first thread to ask for a key makes the call, and the
+    threads that ask for it while the call is in flight wait for it and get its result (or its error) too.
+    """
+    def __init__(self):
+        self.stats = {
+            "calls": 0,
+            "coalesced": 0
+        }
+        self._flights = dict()  # key -> the call in flight
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        """
+        Calls a function, unless a call for the same key is already in flight, in which case its result is waited for.
+
+        :param key: Identifies calls that have the same result
+        :param function: The function to call
+        :param args: The arguments to call the function with
+        :return: A tuple: (the result, whether or not it's shared with another call)
+        :rtype: tuple
+        """
+        with self._lock:
+            self.stats["calls"] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = function(*args)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, False
+
+    def __str__(self):
+        return "%s of %s calls coalesced" % (self.stats["coalesced"], self.stats["calls"])
@@ -18,13 +18,48 @@
 # along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
 # -----------------------
 
-import datetime
+import sys
+import time
+from bot import utils
+
+YOUTUBE_WATCH_URL = "https://www.youtube.com/watch?v="
+
+
+class UserRef:
+    """
+    Stands in for the requester of a song when they can't be found, for example after they left the server.
+    """
+    __slots__ = ("id",)
+
+    def __init__(self, user_id):
+        self.id = user_id
+
+    @property
+    def mention(self):
+        return "<@%s>" % self.id
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
 
 
 class Song:
     """
     Represents a song that can be played by a :class:`player.Player` instance.
+
+    Songs are kept compact because queues can be very long: they have no ``__dict__``, the requesters and the text
+    channel are kept as IDs and are looked up when they're used, repeated strings are interned, and YouTube songs keep
+    the ID of their video rather than its URL. Songs far from the front of the queue don't keep a stream URL either,
+    see :attr:`player.Player.lookahead`.
     """
+    __slots__ = ("stream_url", "title", "length", "image", "_video_id", "_song_url", "_requester_id",
+                 "_text_channel_id", "_other_requester_ids", "_last_resume", "_seconds_played")
+
+    # finds a channel by its ID. Set by the bot, the requesters and text channel of songs can't be found without it
+    find_channel = None
+
     def __init__(self, stream_url, title, requester=None, length=0, text_channel=None, image=None, song_url=""):
         """
         :param stream_url: URL of the stream to download the song from
@@ -43,36 +78,146 @@ class Song:
         :type song_url: str
         """
         self.stream_url = stream_url
-        self.title = title
-        self.requester = requester
+        self.title = sys.intern(title)
         self.length = length
-        self.text_channel = text_channel
-        self.image = image
+        self.image = sys.intern(image) if image is not None else None
         self.song_url = song_url
-        self._last_resume = datetime.datetime.fromtimestamp(0)
-        self._seconds_played = 0  # used for when the song is paused
+        self.requester = requester
+        self.text_channel = text_channel
+        self._other_requester_ids = None  # users who requested the song after it was already queued
+        self._last_resume = None  # monotonic time of the last play or resume, None while not playing
+        self._seconds_played = 0.0  # playback time accumulated before the last play or resume
+
+    @property
+    def video_id(self):
+        """
+        The ID of the song's YouTube video, None if the song is not from YouTube. This is read-only.
+        """
+        return self._video_id
+
+    @property
+    def song_url(self):
+        """
+        A URL to the song.
+        """
+        if self._video_id is not None:
+            return YOUTUBE_WATCH_URL + self._video_id
+        return self._song_url
+
+    @song_url.setter
+    def song_url(self, song_url):
+        video_id = utils.get_video_id(song_url) if song_url else None
+        self._video_id = sys.intern(video_id) if video_id is not None else None
+        self._song_url = song_url if video_id is None else None
+
+    @property
+    def text_channel(self):
+        """
+        The text channel the song was added from, None if it can't be found.
+        """
+        if self._text_channel_id is None or Song.find_channel is None:
+            return None
+        return Song.find_channel(self._text_channel_id)
+
+    @text_channel.setter
+    def text_channel(self, channel):
+        self._text_channel_id = sys.intern(channel.id) if channel is not None else None
+
+    @property
+    def requester_id(self):
+        """
+        The ID of the user who requested the song, None if it is unknown. This is read-only.
+        """
+        return self._requester_id
+
+    @property
+    def requester(self):
+        """
+        The user who requested the song, a :class:`UserRef` if they can't be found.
+        """
+        return self._find_user(self._requester_id)
+
+    @requester.setter
+    def requester(self, user):
+        self._requester_id = sys.intern(user.id) if user is not None else None
+
+    @property
+    def other_requesters(self):
+        """
+        The users who requested the song after it was already queued. This is read-only, use :meth:`add_requester`.
+        """
+        return [self._find_user(user_id) for user_id in self._other_requester_ids or ()]
+
+    def add_requester(self, user):
+        """
+        Adds a user to the requesters of the song, unless they're already one of them.
+
+        :param user: The user
+        :type user: discord.User
+        :return: Whether or not the user was added
+        :rtype: bool
+        """
+        if user.id == self._requester_id or user.id in (self._other_requester_ids or ()):
+            return False
+        self._other_requester_ids = (self._other_requester_ids or ()) + (sys.intern(user.id),)
+        return True
+
+    def _find_user(self, user_id):
+        if user_id is None:
+            return None
+        channel = self.text_channel
+        member = channel.server.get_member(user_id) if channel is not None else None
+        return member if member is not None else UserRef(user_id)
+
+    @property
+    def requesters(self):
+        """
+        Everyone who requested the song, starting with the user who queued it. This is read-only.
+        """
+        return [self.requester] + self.other_requesters
 
     def play(self):
         """
         Used for tracking elapsed time. Call this when the song starts playing or is resumed.
         """
-        self._last_resume = datetime.datetime.now()
+        self._last_resume = time.monotonic()
 
     def pause(self):
         """
         Used for tracking elapsed time. Call this when the song is paused.
         """
-        now = datetime.datetime.now()
-        delta = (now - self._last_resume).seconds
-        self._seconds_played += delta
+        if self._last_resume is not None:
+            self._seconds_played += time.monotonic() - self._last_resume
+            self._last_resume = None
+
+    def is_paused(self):
+        """
+        Returns whether or not the song's playback clock is stopped.
+
+        :rtype: bool
+        """
+        return self._last_resume is None
 
     def elapsed(self):
         """
-        Gets the elapsed play time.
+        Gets the elapsed play time. This is measured with a monotonic clock, so it is not affected by changes to the
+        system time.
 
         :return: Elapsed play time in seconds
-        :rtype: int
+        :rtype: float
         """
-        now = datetime.datetime.now()
-        return (now - self._last_resume).seconds + self._seconds_played
+        elapsed = self._seconds_played
+        if self._last_resume is not None:
+            elapsed += time.monotonic() - self._last_resume
+        return elapsed
 
+    def seek(self, seconds):
+        """
+        Used for tracking elapsed time. Call this when the song starts playing from a specific position.
+
+        :param seconds: The position the song is playing from, in seconds
+        :type seconds: float
+        """
+        self._seconds_played = seconds
+        if self._last_resume is not None:
+            self._last_resume = time.monotonic()
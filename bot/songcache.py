@@ -0,0 +1,133 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+import threading
+from collections import OrderedDict
+from bot import song
+from bot import utils
+
+
+class SongCache:
+    """
+    Remembers the details of resolved songs by their video ID, so songs that are requested again don't have to be
+    resolved again. Songs whose stream URL expired are dropped, and when the cache is full the song that was used least
+    recently is dropped.
+    """
+    def __init__(self, max_size=500):
+        """
+        :param max_size: The maximal number of songs to remember
+        :type max_size: int
+        """
+        self.max_size = max_size
+        self.put_listener = None  # called with every song that is remembered
+        self.shared = None  # a sharedcache.SharedCache that other processes remember songs in as well
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._songs = OrderedDict()  # video ID -> song details, least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, video_id):
+        """
+        Returns a new song with the remembered details of a video.
+
+        :param video_id: The ID of the video
+        :type video_id: str
+        :return: The song, None if the video isn't remembered (here or in :attr:`shared`) or its stream expired
+        :rtype: song.Song
+        """
+        with self._lock:
+            details = self._songs.get(video_id)
+            if details is not None and utils.is_stream_url_expired(details["stream_url"]):
+                del self._songs[video_id]
+                details = None
+            if details is not None:
+                self._songs.move_to_end(video_id)
+                self.hits += 1
+                return song.Song(**details)
+
+        details = self.shared.get_song(video_id) if self.shared is not None else None
+        if details is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.shared_hits += 1
+            self._remember(video_id, details)
+        return song.Song(**details)
+
+    def _remember(self, video_id, details):
+        self._songs[video_id] = details
+        self._songs.move_to_end(video_id)
+        while len(self._songs) > self.max_size:
+            self._songs.popitem(last=False)
+
+    def put(self, new_song):
+        """
+        Remembers the details of a song. Songs without a video ID are ignored.
+
+        :param new_song: The song to remember
+        :type new_song: song.Song
+        """
+        if new_song.video_id is None:
+            return
+        details = {
+            "stream_url": new_song.stream_url,
+            "title": new_song.title,
+            "length": new_song.length,
+            "image": new_song.image,
+            "song_url": new_song.song_url
+        }
+        with self._lock:
+            self._remember(new_song.video_id, details)
+        # downloaded audio belongs to the process that downloaded it, other processes may delete theirs at any time
+        if self.shared is not None and new_song.stream_url.startswith("http"):
+            self.shared.put_song(new_song.video_id, details)
+        if self.put_listener is not None:
+            self.put_listener(new_song)
+
+    def discard(self, video_id):
+        """
+        Forgets a video if it is remembered, here and in :attr:`shared`.
+
+        :param video_id: The ID of the video
+        :type video_id: str
+        """
+        with self._lock:
+            self._songs.pop(video_id, None)
+        if self.shared is not None:
+            self.shared.discard_song(video_id)
+
+    def is_fresh(self, video_id, margin=60):
+        """
+        Returns whether or not a video is remembered and its stream URL will still be valid for a while.
+
+        :param video_id: The ID of the video
+        :type video_id: str
+        :param margin: Number of seconds the stream URL should still be valid for
+        :type margin: int
+        :rtype: bool
+        """
+        with self._lock:
+            details = self._songs.get(video_id)
+            return details is not None and not utils.is_stream_url_expired(details["stream_url"], margin)
+
+    def __len__(self):
+        return len(self._songs)
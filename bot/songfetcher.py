@@ -19,8 +19,102 @@
 # -----------------------
 
 from bot import song
+from bot import log
 from bot import utils
-import pafy
+from bot import search
+from bot.songcache import SongCache
+from bot.singleflight import SingleFlight
+from bot.resolver import Resolver, PafyBackend
+
+# details of recently resolved songs, shared by every way of resolving a song
+cache = SongCache()
+# resolves of the same video that are made at the same time (like a link that several users play at once) share one
+resolves = SingleFlight()
+# looks videos up, see set_resolver
+resolver = Resolver([PafyBackend()])
+
+# which audio stream is picked for a song, see select_audio_stream
+stream_preferences = {
+    "target_bitrate": 0,
+    "prefer_opus": True
+}
+# the streams that were picked, and their total bitrate compared to the best streams (in kbps)
+stream_stats = {
+    "selected": 0,
+    "opus": 0,
+    "selected_bitrate": 0,
+    "best_bitrate": 0
+}
+
+
+def set_stream_preferences(target_bitrate, prefer_opus=True):
+    """
+    Sets which audio stream is picked for the songs that are resolved from now on.
+
+    :param target_bitrate: The bitrate that is played, usually the bitrate of the voice channel, in kbps. The smallest
+                           stream that has it is picked. 0 to pick the best stream.
+    :type target_bitrate: int
+    :param prefer_opus: Whether or not to pick Opus (WebM) streams over other codecs. Discord plays Opus, so they
+                        sound better at the same bitrate.
+    :type prefer_opus: bool
+    """
+    stream_preferences["target_bitrate"] = target_bitrate
+    stream_preferences["prefer_opus"] = prefer_opus
+
+
+def set_resolver(new_resolver):
+    """
+    Sets the resolver that videos are looked up with.
+
+    :param new_resolver: The new resolver
+    :type new_resolver: resolver.Resolver
+    """
+    global resolver
+    resolver = new_resolver
+
+
+def select_audio_stream(video):
+    """
+    Picks the audio stream of a video to play, according to :data:`stream_preferences`. Streams with a higher bitrate
+    than the voice channel's are downloaded and decoded for nothing, so the smallest stream that has the target bitrate
+    is picked, or the best stream if none has it.
+
+    :param video: The video
+    :type video: pafy.Pafy
+    :return: The audio stream
+    :rtype: pafy.Stream
+    """
+    streams = [stream for stream in getattr(video, "audiostreams", None) or [] if stream.rawbitrate]
+    if len(streams) == 0:
+        return video.getbestaudio()
+
+    best = max(streams, key=lambda stream: stream.rawbitrate)
+    if stream_preferences["prefer_opus"]:
+        opus_streams = [stream for stream in streams if stream.extension == "webm"]
+        if len(opus_streams) > 0:
+            streams = opus_streams
+    target = stream_preferences["target_bitrate"] * 1000
+    large_enough = [stream for stream in streams if stream.rawbitrate >= target]
+    if target > 0 and len(large_enough) > 0:
+        selected = min(large_enough, key=lambda stream: stream.rawbitrate)
+    else:
+        selected = max(streams, key=lambda stream: stream.rawbitrate)
+
+    stream_stats["selected"] += 1
+    if selected.extension == "webm":
+        stream_stats["opus"] += 1
+    stream_stats["selected_bitrate"] += selected.rawbitrate // 1000
+    stream_stats["best_bitrate"] += best.rawbitrate // 1000
+    return selected
+
+
+def preload():
+    """
+    Imports the modules used to resolve songs ahead of time, so the first song doesn't wait for them. Resolving imports
+    them on demand otherwise.
+    """
+    import pafy
+    import requests
 
 
 def get_pafy_song(pafy_obj):
@@ -32,35 +126,72 @@ def get_pafy_song(pafy_obj):
     :return: The song with details from the pafy object
     :rtype: song.Song
     """
-    audio_stream = pafy_obj.getbestaudio()
-    return song.Song(
+    cached = cache.get(pafy_obj.videoid)
+    if cached is not None:
+        return cached
+    return _own_song(*resolves.do(pafy_obj.videoid, _resolve_pafy_song, pafy_obj))
+
+
+def _resolve_pafy_song(pafy_obj):
+    audio_stream = select_audio_stream(pafy_obj)
+    new_song = song.Song(
         stream_url=audio_stream.url,
         title=pafy_obj.title,
         length=pafy_obj.length,
         image=pafy_obj.bigthumb if pafy_obj.bigthumb else pafy_obj.thumb,
         song_url="https://www.youtube.com/watch?v=" + pafy_obj.videoid
     )
+    cache.put(new_song)
+    return new_song
+
+
+def _own_song(resolved, shared):
+    """
+    Returns a song resolved by :data:`resolves` that the caller can queue. A song that was shared with other callers is
+    copied, since queued songs keep their own requesters.
+    """
+    if not shared:
+        return resolved
+    return song.Song(stream_url=resolved.stream_url, title=resolved.title, length=resolved.length,
+                     image=resolved.image, song_url=resolved.song_url)
 
 
-def get_youtube_song(url):
+def get_youtube_song(url, cached=True):
     """
     Builds and returns a Song from a YouTube URL.
 
     :param url: URL of the video
     :type url: str
+    :param cached: Whether or not a song from the cache can be returned instead of resolving the video again
+    :type cached: bool
     :return: The song
     :rtype: song.Song
     """
-    video = pafy.new(url)
-    audio_stream = video.getbestaudio()
+    video_id = utils.get_video_id(url)
+    if video_id is None:
+        return _resolve_youtube_song(url)
+    if cached:
+        cached = cache.get(video_id)
+        if cached is not None:
+            return cached
+    return _own_song(*resolves.do(video_id, _resolve_youtube_song, url))
 
-    return song.Song(
-        stream_url=audio_stream.url,
-        title=video.title,
-        length=video.length,
-        image=video.bigthumb if video.bigthumb else video.thumb,
-        song_url="https://www.youtube.com/watch?v=" + video.videoid
-    )
+
+def _resolve_youtube_song(url):
+    return _resolve_pafy_song(resolver.fetch(url))
+
+
+def get_stream_url(url):
+    """
+    Resolves a fresh audio stream URL for a YouTube video. Stream URLs expire, so this is used to refresh the stream of
+    a song that was resolved a while ago.
+
+    :param url: URL of the video
+    :type url: str
+    :return: URL of the stream to download the song from
+    :rtype: str
+    """
+    return select_audio_stream(resolver.fetch(url)).url
 
 
 def get_ytsearch_song(term):
@@ -73,9 +204,9 @@ def get_ytsearch_song(term):
     :rtype: song.Song
     """
 
-    urls = utils.search_youtube(term)
-    if len(urls) > 0:
-        return get_youtube_song(urls[0])
+    results = search.search_youtube(term, limit=1)
+    if len(results) > 0:
+        return get_youtube_song(results[0].url)
     else:
         return None
 
@@ -89,14 +220,62 @@ def get_ytplaylist_pafys(playlist_url):
     :return: A dict of :class:`pafy.Pafy` objects.
     :rtype: dict
     """
+    import pafy
     playlist = pafy.get_playlist(playlist_url)
     return playlist["items"]
 
 
+def get_ytplaylist_entries(playlist_url):
+    """
+    Returns the videos of a playlist with the details that are listed in it, without resolving them. Videos whose
+    details are not listed are looked up.
+
+    :param playlist_url: URL of the playlist
+    :type playlist_url: str
+    :return: A list of :class:`search.SearchResult` objects, in the playlist's order
+    :rtype: list
+    """
+    import pafy
+    playlist = pafy.get_playlist(playlist_url)
+    entries = []
+    for element in playlist["items"]:
+        video = element["pafy"]
+        meta = element.get("playlist_meta") or {}
+        title = meta.get("title")
+        length = meta.get("length_seconds")
+        if title is None or length is None:
+            title = video.title
+            length = video.length
+        entries.append(search.SearchResult(meta.get("encrypted_id") or video.videoid, title, int(length)))
+    return entries
+
+
+def get_unresolved_song(entry):
+    """
+    Builds a song from the details of a video without resolving its stream, so it can be queued right away. The player
+    resolves the stream once the song gets close to playing. A song that is already in the cache is returned as is.
+
+    :param entry: The details of the video
+    :type entry: search.SearchResult
+    :rtype: song.Song
+    """
+    cached = cache.get(entry.video_id)
+    if cached is not None:
+        return cached
+    return song.Song(
+        stream_url=None,
+        title=entry.title,
+        length=entry.length,
+        image="https://i.ytimg.com/vi/%s/hqdefault.jpg" % entry.video_id,
+        song_url="https://www.youtube.com/watch?v=" + entry.video_id
+    )
+
+
 def get_ytplaylist_songs(playlist_url, limits=None):
     """
     Returns a list of :class:`song.Song` objects from the given playlist. This takes into account limits like the max
-    number of songs to process and the max song length
+    number of songs to process and the max song length. The limits are checked with the details listed in the
+    playlist, so only the songs that pass them are resolved.
 
     :param playlist_url: URL of the playlist
     :type playlist_url: str
@@ -105,10 +284,8 @@ def get_ytplaylist_songs(playlist_url, limits=None):
     :return: A tuple: (list of :class:`song.Song` objects, number of songs removed by filters).
     :rtype: tuple
     """
-
-    playlist = pafy.get_playlist(playlist_url)
-    playlist_dict = playlist["items"]
-    song_count = len(playlist_dict)
+    entries = get_ytplaylist_entries(playlist_url)
+    song_count = len(entries)
 
     if limits is None:
         limits = dict()
@@ -118,23 +295,21 @@ def get_ytplaylist_songs(playlist_url, limits=None):
             song_count = limits["MaxSongCount"]
 
     songs = []
-    for element in playlist_dict:
-        video = element['pafy']
-        utils.safe_print(("processing " + str(video.title)))
+    for entry in entries:
+        if limits.get("MaxSongLength") is not None and entry.length > limits.get("MaxSongLength"):
+            continue
+        log.debug("Processing playlist item", title=entry.title, video=entry.video_id)
         try:
-            newsong = get_pafy_song(video)
-            if newsong is not None:
-                if not (limits.get("MaxSongLength") is not None and newsong.length > limits.get("MaxSongLength")):
-                    songs.append(newsong)
+            songs.append(get_youtube_song(entry.url))
         except ValueError as e:
-            utils.safe_print("Value error! " + str(e))
+            log.warning("Could not resolve playlist item", video=entry.video_id, error=e)
         except OSError as e:
-            utils.safe_print("OS error! " + str(e))
+            log.warning("Could not resolve playlist item", video=entry.video_id, error=e)
 
         if len(songs) >= song_count:
             break
 
-    removed_count = len(playlist_dict) - len(songs)
+    removed_count = len(entries) - len(songs)
 
     return songs, removed_count
 
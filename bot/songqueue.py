@@ -0,0 +1,84 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+import queue
+
+
+class SongQueue(queue.Queue):
+    """
+    A queue of :class:`song.Song` objects that indexes its songs by their video ID, so finding out whether a video is
+    queued doesn't require going over the whole queue.
+    """
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self.index = {}  # video ID -> list of the queued songs with that ID, in queue order
+
+    def _put(self, song):
+        super()._put(song)
+        if song.video_id is not None:
+            self.index.setdefault(song.video_id, []).append(song)
+
+    def _get(self):
+        song = super()._get()
+        if song.video_id is not None:
+            songs = self.index[song.video_id]
+            songs.remove(song)
+            if len(songs) == 0:
+                del self.index[song.video_id]
+        return song
+
+    def find(self, video_id):
+        """
+        Returns the first queued song of a video.
+
+        :param video_id: The ID of the video
+        :type video_id: str
+        :return: The song, None if the video isn't queued
+        :rtype: song.Song
+        """
+        with self.mutex:
+            songs = self.index.get(video_id)
+            return songs[0] if songs else None
+
+    def clear(self):
+        """
+        Removes all of the songs from the queue.
+
+        :return: The number of songs removed
+        :rtype: int
+        """
+        with self.mutex:
+            removed_count = len(self.queue)
+            self.queue.clear()
+            self.index.clear()
+            return removed_count
+
+    def replace(self, songs):
+        """
+        Replaces the songs in the queue, for example to reorder them.
+
+        :param songs: The new songs of the queue, in order
+        :type songs: list
+        """
+        with self.mutex:
+            self.queue.clear()
+            self.index.clear()
+            for song in songs:
+                self._put(song)
@@ -0,0 +1,182 @@
+# -----------------------
+# MetalBot: A self hosted music bot for Discord servers.
+# Copyright (C) 2018 SilverTuxedo
+#
+# This file is part of MetalBot.
+#
+# MetalBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MetalBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
+# -----------------------
+
+import math
+import re
+import threading
+
+_BRACKETED = re.compile(r"\([^)]*\)|\[[^\]]*\]")  # like "(Official Video)" or "[HD]"
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def trigrams(text):
+    """
+    Returns the set of trigrams of a text. Case, punctuation and bracketed text are ignored, and every word is padded
+    with a space so short words still have trigrams.
+
+    :param text: The text
+    :type text: str
+    :rtype: set
+    """
+    words = _NON_WORD.sub(" ", _BRACKETED.sub(" ", text.lower())).split()
+    if len(words) == 0:
+        return set()
+    padded = " %s " % " ".join(words)
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def similarity(first, second):
+    """
+    Returns how similar two sets of trigrams are (their Dice coefficient), from 0 (nothing in common) to 1 (equal).
+
+    :type first: set
+    :type second: set
+    :rtype: float
+    """
+    if len(first) + len(second) == 0:
+        return 0.0
+    return 2.0 * len(first & second) / (len(first) + len(second))
+
+
+class TitleIndex:
+    """
+    An in-memory trigram index of titles, for finding titles that are similar to a query even when it has typos or is
+    worded a little differently. Every title is added with a unique key and a value that tells how to play it.
+    """
+    def __init__(self):
+        self._entries = []  # entry ID -> (key, title, value, trigrams), None for removed entries
+        self._ids = {}  # key -> entry ID
+        self._postings = {}  # trigram -> IDs of the entries whose title contains it
+        self._removed = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def keys(self):
+        """
+        Returns the keys of all of the titles in the index.
+
+        :rtype: list
+        """
+        with self._lock:
+            return list(self._ids)
+
+    def add(self, key, title, value=None):
+        """
+        Adds a title to the index, replacing the title with the same key if there is one.
+
+        :param key: A unique key of the title
+        :type key: str
+        :param title: The title
+        :type title: str
+        :param value: Anything that should be returned with the title when it matches a query
+        """
+        grams = trigrams(title)
+        with self._lock:
+            entry_id = self._ids.get(key)
+            if entry_id is not None:
+                old_key, old_title, old_value, old_grams = self._entries[entry_id]
+                if old_title == title:
+                    self._entries[entry_id] = (key, title, value, old_grams)
+                    return
+                self._remove(key)
+
+            entry_id = len(self._entries)
+            self._entries.append((key, title, value, frozenset(grams)))
+            self._ids[key] = entry_id
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(entry_id)
+
+    def remove(self, key):
+        """
+        Removes a title from the index, if it is in it.
+
+        :param key: The key of the title
+        :type key: str
+        """
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry_id = self._ids.pop(key, None)
+        if entry_id is None:
+            return
+        # the entry stays in the postings until they are compacted, and is skipped by queries until then
+        self._entries[entry_id] = None
+        self._removed += 1
+        if self._removed > len(self._ids):
+            self._compact()
+
+    def _compact(self):
+        entries = [entry for entry in self._entries if entry is not None]
+        self._entries = []
+        self._ids = {}
+        self._postings = {}
+        self._removed = 0
+        for key, title, value, grams in entries:
+            entry_id = len(self._entries)
+            self._entries.append((key, title, value, grams))
+            self._ids[key] = entry_id
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(entry_id)
+
+    def query(self, text, threshold=0.5, limit=5):
+        """
+        Finds the titles that are the most similar to a text.
+
+        Only titles that share enough trigrams with the text can reach the threshold, and every such title must
+        contain at least one of the text's rarest trigrams. So only the titles that contain those are compared with
+        the text, and common trigrams never have to be gone over.
+
+        :param text: The text to look for
+        :type text: str
+        :param threshold: The minimal similarity of the titles to return, between 0 and 1, see :func:`similarity`
+        :type threshold: float
+        :param limit: The maximal number of titles to return
+        :type limit: int
+        :return: A list of (similarity, key, title, value) tuples, the most similar first
+        :rtype: list
+        """
+        grams = trigrams(text)
+        if len(grams) == 0:
+            return []
+        # a title with c trigrams in common has a similarity of at most 2c / (len(grams) + c)
+        threshold = min(max(threshold, 0.01), 1.0)
+        min_common = int(math.ceil(threshold * len(grams) / (2.0 - threshold) - 1e-9))
+
+        with self._lock:
+            rarest = sorted(grams, key=lambda gram: len(self._postings.get(gram, ())))
+            candidates = set()
+            for gram in rarest[:len(grams) - min_common + 1]:
+                candidates.update(self._postings.get(gram, ()))
+
+            matches = []
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry is None:
+                    continue
+                # the same as similarity(), without a call for every candidate
+                score = 2.0 * len(grams & entry[3]) / (len(grams) + len(entry[3]))
+                if score >= threshold:
+                    matches.append((score, entry[0], entry[1], entry[2]))
+
+        matches.sort(key=lambda match: match[0], reverse=True)
+        return matches[:limit]
@@ -18,21 +18,22 @@
 # along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
 # -----------------------
 
-import requests
 import math
-import sys
-from lxml import html
+import os
+import time
+from urllib.parse import urlparse, parse_qs
 
 
 def seconds_to_timestamp(secs):
     """
     Formats seconds to MM:SS or HH:MM:SS
 
-    :param secs: Number of seconds
+    :param secs: Number of seconds. Fractions of a second are dropped.
     :type secs: int
     :return: Time in MM:SS or HH:MM:SS
     :rtype: str
     """
+    secs = int(secs)
     timestamp = ""
     hours = secs // 60 // 60
     mins = secs // 60 % 60
@@ -50,6 +51,28 @@ def seconds_to_timestamp(secs):
     return timestamp
 
 
+def timestamp_to_seconds(timestamp):
+    """
+    Parses a timestamp in SS, MM:SS or HH:MM:SS format.
+
+    :param timestamp: The timestamp to parse
+    :type timestamp: str
+    :return: Number of seconds
+    :rtype: int
+    :raises ValueError: If the timestamp is not in a valid format
+    """
+    parts = timestamp.strip().split(":")
+    if len(parts) > 3:
+        raise ValueError("Invalid timestamp: %s" % timestamp)
+
+    secs = 0
+    for part in parts:
+        if not part.isdigit():
+            raise ValueError("Invalid timestamp: %s" % timestamp)
+        secs = secs * 60 + int(part)
+    return secs
+
+
 def calc_min_votes_skip(current_count, listener_count, min_percent, min_users):
     """
     Returns the minimal number of people who need to vote to make the vote pass, taking into account the number of
@@ -71,28 +94,6 @@ def calc_min_votes_skip(current_count, listener_count, min_percent, min_users):
     return min(min_by_percent, min_by_users)
 
 
-def search_youtube(term):
-    """
-    Search YouTube.com for the term given and return a list with the resulting URLs
-
-    :param term: A search term
-    :type term: str
-    :return: list with YouTube video URLs
-    :rtype: list
-    """
-    resp = requests.get("https://www.youtube.com/results", params={
-        "search_query": term
-    })
-
-    tree = html.fromstring(resp.content)
-    elements = tree.xpath("//a[contains(@class, 'yt-uix-tile-link')]")
-    results = []
-    for e in elements:
-        if  e.get('href').startswith("/watch"):
-            results.append('https://www.youtube.com' + e.get('href'))
-    return results
-
-
 def progress_bar(percent, length=20, position='⬤', track='▬'):
     """
     Returns a progress bar made of characters.
@@ -128,6 +129,87 @@ def get_missing_from_config(config, params):
     return missing
 
 
+def get_invalid_from_config(config, params):
+    """
+    Returns the options whose values can't be read as their expected type. Missing options are ignored.
+
+    :param config: The config to check
+    :type config: configparser.ConfigParser
+    :param params: A dict of sections, each a dict of option names to their expected type: str, int, float, bool or a
+                   function that parses the option's value and raises ValueError if it's invalid. Such a function can
+                   describe the values it expects in an ``expected`` attribute.
+    :type params: dict
+    :return: A list of (section, option, expected type name) tuples
+    :rtype: list
+    """
+    getters = {
+        int: config.getint,
+        float: config.getfloat,
+        bool: config.getboolean,
+        str: config.get
+    }
+    invalid = []
+    for section in params:
+        for option, option_type in params[section].items():
+            if not config.has_option(section, option):
+                continue
+            try:
+                if option_type in getters:
+                    getters[option_type](section, option)
+                else:
+                    option_type(config.get(section, option))
+            except ValueError:
+                invalid.append((section, option, getattr(option_type, "expected", option_type.__name__)))
+    return invalid
+
+
+def parse_stream_bitrate(value):
+    """
+    Parses the bitrate of the audio streams to pick: "auto" for the bitrate of the voice channel, or a number of kbps.
+
+    :param value: The option's value
+    :type value: str
+    :return: The bitrate in kbps, None for "auto"
+    :rtype: int
+    """
+    value = value.strip().lower()
+    if value == "auto":
+        return None
+    bitrate = int(value)
+    if bitrate < 0:
+        raise ValueError("Negative bitrate: %s" % bitrate)
+    return bitrate
+
+
+parse_stream_bitrate.expected = "auto or a number of kbps"
+
+
+def parse_guild_stream_bitrates(value):
+    """
+    Parses a comma separated list of guild:bitrate pairs.
+
+    :param value: The option's value
+    :type value: str
+    :return: A dict of guild IDs to bitrates in kbps
+    :rtype: dict
+    """
+    bitrates = dict()
+    for guild_bitrate in value.split(","):
+        if len(guild_bitrate.strip()) == 0:
+            continue
+        guild_id, separator, bitrate = guild_bitrate.partition(":")
+        if len(separator) == 0 or len(guild_id.strip()) == 0:
+            raise ValueError("Expected guild:bitrate, got %s" % guild_bitrate.strip())
+        bitrate = int(bitrate)
+        if bitrate < 0:
+            raise ValueError("Negative bitrate: %s" % bitrate)
+        bitrates[guild_id.strip()] = bitrate
+    return bitrates
+
+
+parse_guild_stream_bitrates.expected = "comma separated guild:kbps pairs"
+
+
 def is_member_deafened(member):
     """
     Returns if a member is deafened, either by themselves or the server.
@@ -140,18 +222,115 @@ def is_member_deafened(member):
     return member.voice.self_deaf or member.voice.deaf
 
 
-def safe_print(text, end="\n", flush=True):
+def get_video_id(url):
+    """
+    Returns the ID of the YouTube video a URL points to.
+
+    :param url: A URL like youtube.com/watch?v=ID or youtu.be/ID
+    :type url: str
+    :return: The ID of the video, None if the URL doesn't point to a YouTube video
+    :rtype: str
+    """
+    parsed = urlparse(url if "//" in url else "//" + url)
+    if parsed.netloc.endswith("youtu.be"):
+        video_id = parsed.path.strip("/")
+        return video_id if len(video_id) > 0 else None
+    if parsed.netloc.endswith("youtube.com") and parsed.path == "/watch":
+        return parse_qs(parsed.query).get("v", [None])[0]
+    return None
+
+
+def split_play_requests(text):
     """
-    Safely prints text to the terminal
+    Splits the argument of the play command into the songs it requests. Every line is a separate request, and a line
+    of several URLs separated by spaces requests each of them.
 
-    :param text: Text to print
+    :param text: The argument of the play command
     :type text: str
-    :param end: Additional string added after text
-    :type end: str
-    :param flush: Whether or not to flush the system buffer
-    :type flush: bool
-    """
-    sys.stdout.buffer.write((text + end).encode('utf-8', 'replace'))
-    if flush:
-        sys.stdout.flush()
+    :return: The requests, in order
+    :rtype: list
+    """
+    requests = []
+    for line in text.splitlines():
+        words = line.split()
+        if len(words) > 1 and all("://" in word or word.startswith(("youtube.com/", "youtu.be/", "www."))
+                                  for word in words):
+            requests.extend(words)
+        elif len(words) > 0:
+            requests.append(" ".join(words))
+    return requests
+
+
+def estimate_stream_bytes(url, seconds):
+    """
+    Estimates the number of bytes downloaded from a stream to play part of it. Only URLs that carry the size and the
+    duration of their stream (like googlevideo streams, in their "clen" and "dur" parameters) can be estimated.
+
+    :param url: The URL of the stream
+    :type url: str
+    :param seconds: The number of seconds that were played
+    :type seconds: float
+    :return: The estimated number of bytes, 0 if it can't be estimated
+    :rtype: int
+    """
+    query = parse_qs(urlparse(url).query)
+    try:
+        size = int(query["clen"][0])
+        duration = float(query["dur"][0])
+    except (KeyError, ValueError):
+        return 0
+    if duration <= 0:
+        return 0
+    return int(size * min(seconds / duration, 1))
+
+
+def get_process_cpu_time(pid):
+    """
+    Returns the CPU time a process used so far, like the ffmpeg process of a stream. This needs psutil, or /proc on
+    Linux.
+
+    :param pid: The ID of the process
+    :type pid: int
+    :return: The CPU time in seconds, None if it can't be measured
+    :rtype: float
+    """
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        try:
+            cpu_times = psutil.Process(pid).cpu_times()
+        except psutil.Error:
+            return None
+        return cpu_times.user + cpu_times.system
+
+    try:
+        with open("/proc/%s/stat" % pid) as stat_file:
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+        # utime and stime, the 14th and 15th fields of the file, in clock ticks
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def is_stream_url_expired(url, margin=60):
+    """
+    Returns whether or not a stream URL has expired or is about to expire. Only URLs that carry an "expire" parameter
+    (like googlevideo streams) can expire.
+
+    :param url: The URL of the stream
+    :type url: str
+    :param margin: Number of seconds before the actual expiry time in which the URL is already considered expired
+    :type margin: int
+    :return: Whether or not the URL has expired
+    :rtype: bool
+    """
+    expire = parse_qs(urlparse(url).query).get("expire")
+    if expire is None:
+        return False
+    try:
+        return int(expire[0]) - margin <= time.time()
+    except ValueError:
+        return False
 
@@ -18,30 +18,94 @@
 # along with MetalBot.  If not, see <https://www.gnu.org/licenses/>.
 # -----------------------
 
-from bot.metalbot import MetalBot
+import bot.log
 import bot.utils
 import configparser
+import multiprocessing
 
-print("starting...")
-
+# the options the bot needs and their types. They are checked once here, so the bot can read them without failing.
 config_params = {
-    "Login": ["Token"],
-    "Permissions": ["OwnerID", "OwnerRole"],
-    "Preferences": ["CommandPrefix", "DefaultVolume", "MaxPlaylistLength", "MaxSongLength", "MentionPlaying"],
-    "Votes": ["SelfInstaSkip", "PassSkipVoteAfter", "MinimalSkipCount", "MinimalSkipPercent", "MinimalClearCount",
-              "MinimalClearPercent"]
+    "Login": {"Token": str},
+    "Permissions": {"OwnerID": str, "OwnerRole": str},
+    "Preferences": {"CommandPrefix": str, "DefaultVolume": float, "MaxPlaylistLength": int, "MaxSongLength": int,
+                    "MentionPlaying": bool, "SearchBackend": str, "SearchResultCount": int,
+                    "ResolverBackends": str, "HedgePercentile": float, "DuplicatePolicy": str,
+                    "LocalMatchThreshold": float},
+    "Playback": {"MaxResumeRetries": int, "ResumeTolerance": int, "AudioWorker": bool,
+                 "LookaheadSongs": int, "StallTimeout": float, "StallGrace": float,
+                 "SuspendAfter": float, "IdleDisconnect": float,
+                 "StreamBitrate": bot.utils.parse_stream_bitrate,
+                 "GuildStreamBitrates": bot.utils.parse_guild_stream_bitrates, "PreferOpus": bool},
+    "Library": {"Directories": str, "IndexPath": str},
+    "Playlists": {"Path": str, "Scope": str},
+    "History": {"HistoryPath": str, "WarmTopSongs": int, "WarmInterval": int, "WarmAudio": bool,
+                "AudioCachePath": str, "SongCacheSize": int},
+    "Limits": {"UserRate": float, "UserBurst": int, "GuildRate": float, "GuildBurst": int, "GlobalRate": float,
+               "GlobalBurst": int},
+    "Sharding": {"ShardCount": int, "SharedCachePath": str, "SearchCacheAge": float},
+    "Logging": {"Level": str, "Path": str, "JsonLines": bool, "MaxBytes": int, "BackupCount": int, "BufferSize": int,
+                "LoopMonitor": bool, "LoopBlockThreshold": float},
+    "Votes": {"SelfInstaSkip": bool, "PassSkipVoteAfter": int, "MinimalSkipCount": int, "MinimalSkipPercent": float,
+              "MinimalClearCount": int, "MinimalClearPercent": float}
 }
 
-config = configparser.ConfigParser()
-config.read("config/options.ini")
-missing = bot.utils.get_missing_from_config(config, config_params)
-
-if len(missing) > 0:
-    for m in missing:
-        print("Missing %s: %s" % m)
-    print("Config is missing options! Please check the config.")
-elif len(config.get("Login", "Token")) == 0:
-    print("Token is missing! Please update the config.")
-else:
-    client = MetalBot(config)
+
+def main():
+    print("starting...")
+
+    config = configparser.ConfigParser()
+    config.read("config/options.ini")
+    missing = bot.utils.get_missing_from_config(config, config_params)
+    invalid = bot.utils.get_invalid_from_config(config, config_params)
+
+    if len(missing) > 0:
+        for m in missing:
+            print("Missing %s: %s" % m)
+        print("Config is missing options! Please check the config.")
+    elif len(invalid) > 0:
+        for i in invalid:
+            print("Invalid %s: %s (expected %s)" % i)
+        print("Config has invalid options! Please check the config.")
+    elif len(config.get("Login", "Token")) == 0:
+        print("Token is missing! Please update the config.")
+    elif config.getint("Sharding", "ShardCount") > 1:
+        shard_count = config.getint("Sharding", "ShardCount")
+        shards = [multiprocessing.Process(target=run_bot, args=(config, shard_id, shard_count),
+                                          name="shard-%s" % shard_id) for shard_id in range(shard_count)]
+        for shard in shards:
+            shard.start()
+        for shard in shards:
+            shard.join()
+    else:
+        run_bot(config)
+
+
+def run_bot(config, shard_id=None, shard_count=None):
+    """
+    Runs the bot until it is closed.
+
+    :param config: The bot's config
+    :type config: configparser.ConfigParser
+    :param shard_id: The shard this process runs, None to run every server in this process
+    :type shard_id: int
+    :param shard_count: The total number of shards
+    :type shard_count: int
+    """
+    log_path = config.get("Logging", "Path")
+    if shard_id is not None and len(log_path) > 0:
+        log_path = "%s.shard%s" % (log_path, shard_id)  # the log file is rotated by the process that writes to it
+    bot.log.setup(level=config.get("Logging", "Level"),
+                  path=log_path,
+                  json_lines=config.getboolean("Logging", "JsonLines"),
+                  max_bytes=config.getint("Logging", "MaxBytes"),
+                  backup_count=config.getint("Logging", "BackupCount"),
+                  buffer_size=config.getint("Logging", "BufferSize"))
+    # imported only now so a bad config is reported without waiting for discord.py to load
+    from bot.metalbot import MetalBot
+    client = MetalBot(config, shard_id=shard_id, shard_count=shard_count)
     client.run(config.get("Login", "Token"))
+
+
+# the guard keeps the audio worker process from starting the bot again when it imports this module
+if __name__ == "__main__":
+    main()